@@ -0,0 +1,138 @@
+"""
+Асинхронные версии самых нагруженных эндпоинтов для ASGI-режима
+(SERVER_MODE=asgi): списков тегов и ингредиентов и скачивания списка
+покупок. Остальные вьюсеты DRF работают и под ASGI, Django выполняет
+их в потоке через sync_to_async.
+
+В Django 3.2 нет асинхронного ORM, а синхронные вьюхи под ASGI
+выполняются в одном общем потоке. Поэтому запросы к базе здесь идут
+через run_query в пуле потоков, и медленный клиент или долгий запрос
+не занимают ни цикл событий, ни этот общий поток.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.http import (HttpResponse,
+                         HttpResponseNotAllowed,
+                         StreamingHttpResponse)
+from rest_framework.exceptions import AuthenticationFailed, NotAuthenticated
+
+from recipes.models import Ingredient, Tag
+from recipes.servings import parse_servings
+from api.authentication import CachedTokenAuthentication
+from api.filters import IngredientFilter
+from api.renderers import COMPACT_RENDERERS
+from api.serializers import IngredientSerializer, TagSerializer
+from api.shopping_cart import get_shopping_cart, iter_shopping_cart_lines
+from api.throttling import throttle
+
+
+def _call_with_connection(func, *args, **kwargs):
+    # Соединения потоков пула живут по тем же правилам CONN_MAX_AGE,
+    # что и соединения обычных запросов
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_query(func, *args, **kwargs):
+    """Выполняет синхронную функцию с запросами к базе в пуле потоков."""
+    return await sync_to_async(
+        _call_with_connection, thread_sensitive=False
+    )(func, *args, **kwargs)
+
+
+def json_response(data, status=200, **kwargs):
+    return HttpResponse(
+        json.dumps(data, ensure_ascii=False, separators=(',', ':')),
+        status=status,
+        content_type='application/json',
+        **kwargs
+    )
+
+
+def list_response(request, data):
+    """Отдаёт список в компактном формате, если клиент его запросил."""
+    accept = request.headers.get('Accept', '')
+    for renderer_class in COMPACT_RENDERERS:
+        if renderer_class.media_type in accept:
+            return HttpResponse(
+                renderer_class().render(data),
+                content_type=renderer_class.media_type
+            )
+
+    return json_response(data)
+
+
+def error_response(error):
+    response = json_response({'detail': str(error.detail)}, error.status_code)
+    response['WWW-Authenticate'] = CachedTokenAuthentication.keyword
+    return response
+
+
+def get_tags():
+    return TagSerializer(Tag.objects.all(), many=True).data
+
+
+def get_ingredients(params):
+    ingredients = IngredientFilter(params, Ingredient.objects.all()).qs
+    return IngredientSerializer(ingredients, many=True).data
+
+
+def authenticate(request):
+    result = CachedTokenAuthentication().authenticate(request)
+    if result is None:
+        raise NotAuthenticated()
+    return result[0]
+
+
+@throttle('tags.list')
+async def tag_list(request):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(('GET',))
+
+    return list_response(request, await run_query(get_tags))
+
+
+@throttle('ingredients.list')
+async def ingredient_list(request):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(('GET',))
+
+    return list_response(
+        request, await run_query(get_ingredients, request.GET)
+    )
+
+
+@throttle('recipes.download_shopping_cart')
+async def download_shopping_cart(request):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(('GET',))
+
+    try:
+        user = await run_query(authenticate, request)
+    except (AuthenticationFailed, NotAuthenticated) as error:
+        return error_response(error)
+    servings = None
+    if 'servings' in request.GET:
+        try:
+            servings = parse_servings(request.GET['servings'])
+        except ValueError as error:
+            return json_response({'servings': str(error)}, 400)
+    shopping_cart = await run_query(get_shopping_cart, user, servings)
+
+    # Данные уже загружены, генератор только форматирует строки и не
+    # блокирует цикл событий. Асинхронные итераторы ответа появились
+    # только в Django 4.2, в 3.2 ASGI-обработчик перебирает обычный
+    # и отправляет клиенту каждую часть отдельно
+    return StreamingHttpResponse(
+        iter_shopping_cart_lines(*shopping_cart),
+        content_type='text/plain; charset=utf-8',
+        headers={
+            'Content-Disposition':
+                'attachment; filename="shopping_cart.txt"'
+        }
+    )
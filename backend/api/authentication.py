@@ -0,0 +1,90 @@
+import hashlib
+import pickle
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from api import metrics
+from api.cache import LocalTTLCache
+from foodgram.db_router import reset_read_database, set_read_database
+
+
+class TokenCache:
+    """
+    Двухуровневый кэш связки токен -> (пользователь, токен).
+
+    Первый уровень живёт в памяти процесса и хранится совсем недолго,
+    второй уровень - общий кэш Django, доступный всем воркерам.
+    Значения хранятся в сериализованном виде, чтобы запросы
+    не делили между собой один и тот же объект пользователя.
+    """
+
+    key_prefix = 'auth-token'
+
+    def __init__(self, local_ttl, shared_ttl):
+        self.local = LocalTTLCache(local_ttl)
+        self.shared_ttl = shared_ttl
+
+    def _shared_key(self, key):
+        # Сам токен в ключах кэша не светим
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return f'{self.key_prefix}:{digest}'
+
+    def get(self, key):
+        data = self.local.get(key)
+        if data is not None:
+            metrics.increment('auth_token_cache.local_hit')
+            return pickle.loads(data)
+
+        data = cache.get(self._shared_key(key))
+        if data is not None:
+            metrics.increment('auth_token_cache.shared_hit')
+            self.local.set(key, data)
+            return pickle.loads(data)
+
+        metrics.increment('auth_token_cache.miss')
+        return None
+
+    def set(self, key, value):
+        data = pickle.dumps(value)
+        self.local.set(key, data)
+        cache.set(self._shared_key(key), data, self.shared_ttl)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.local.delete(key)
+        cache.delete_many([self._shared_key(key) for key in keys])
+        metrics.increment('auth_token_cache.invalidation', len(keys))
+
+
+token_cache = TokenCache(
+    local_ttl=settings.TOKEN_CACHE_LOCAL_TTL,
+    shared_ttl=settings.TOKEN_CACHE_SHARED_TTL
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Аутентификация по токену, которая не ходит в базу данных
+    на каждый запрос, а берёт пользователя из кэша.
+    """
+
+    def authenticate_credentials(self, key):
+        credentials = token_cache.get(key)
+        if credentials is None:
+            try:
+                credentials = super().authenticate_credentials(key)
+            except AuthenticationFailed:
+                if not settings.DATABASE_REPLICAS:
+                    raise
+                # Только что выданный токен мог ещё не доехать до реплики
+                database = set_read_database(None)
+                try:
+                    credentials = super().authenticate_credentials(key)
+                finally:
+                    reset_read_database(database)
+            token_cache.set(key, credentials)
+
+        return credentials
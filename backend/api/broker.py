@@ -0,0 +1,247 @@
+"""
+Публикация и рассылка уведомлений для потока событий (/api/events/).
+
+LocalBroker рассылает сообщения подписчикам внутри процесса.
+PostgresBroker - общий для всех процессов брокер поверх LISTEN/NOTIFY:
+с ним уведомления из воркеров API доходят до отдельного процесса,
+который обслуживает поток событий. Брокер выбирается настройкой
+EVENTS_BROKER, любой брокер реализует subscribe, unsubscribe,
+add_topics и publish с теми же сигнатурами.
+
+У каждого подписчика своя очередь ограниченного размера: если клиент
+не успевает читать, новые сообщения отбрасываются, а подписчик
+помечается как отставший и должен перезапросить данные целиком.
+"""
+import asyncio
+import json
+import select
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, connections
+from django.utils.module_loading import import_string
+
+from api import metrics
+from api.constants import (EVENTS_LISTEN_POLL_SECONDS,
+                           EVENTS_LISTEN_RETRY_SECONDS,
+                           EVENTS_QUEUE_SIZE)
+
+
+class Subscriber:
+    """Очередь сообщений одного соединения в его цикле событий."""
+
+    def __init__(self, topics, queue_size=EVENTS_QUEUE_SIZE):
+        self.topics = set(topics)
+        self.loop = asyncio.get_running_loop()
+        self.thread_id = threading.get_ident()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def _put(self, message):
+        if self.queue.full():
+            self.overflowed = True
+            metrics.increment('events.dropped')
+            return
+        self.queue.put_nowait(message)
+
+    def _lose(self):
+        self.overflowed = True
+        # Пустая очередь не разбудила бы соединение
+        if self.queue.empty():
+            self.queue.put_nowait(None)
+
+    def _call(self, callback, *args):
+        if threading.get_ident() == self.thread_id:
+            callback(*args)
+            return
+        try:
+            self.loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # Цикл событий соединения уже закрыт
+            pass
+
+    def put(self, message):
+        """Кладёт сообщение в очередь, можно вызывать из любого потока."""
+        self._call(self._put, message)
+
+    def lose(self):
+        """
+        Помечает подписчика отставшим, когда сообщения потеряны
+        не в его очереди, а в самом брокере. Можно вызывать из любого
+        потока.
+        """
+        self._call(self._lose)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def clear(self):
+        """Отбрасывает накопившиеся сообщения, вызывается в цикле событий."""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+
+class LocalBroker:
+    """Рассылка сообщений подписчикам текущего процесса."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, topics):
+        subscriber = Subscriber(topics)
+        with self._lock:
+            for topic in subscriber.topics:
+                self._subscribers.setdefault(topic, set()).add(subscriber)
+
+        return subscriber
+
+    def unsubscribe(self, subscriber, topics=None):
+        topics = subscriber.topics if topics is None else set(topics)
+        with self._lock:
+            for topic in topics:
+                subscribers = self._subscribers.get(topic)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[topic]
+        subscriber.topics -= topics
+
+    def add_topics(self, subscriber, topics):
+        topics = set(topics) - subscriber.topics
+        with self._lock:
+            for topic in topics:
+                self._subscribers.setdefault(topic, set()).add(subscriber)
+        subscriber.topics |= topics
+
+    def set_topics(self, subscriber, topics):
+        topics = set(topics)
+        self.unsubscribe(subscriber, subscriber.topics - topics)
+        self.add_topics(subscriber, topics)
+
+    def _deliver(self, topic, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(topic, ()))
+        for subscriber in subscribers:
+            subscriber.put(message)
+
+        return len(subscribers)
+
+    def publish(self, topic, message):
+        metrics.increment('events.published')
+        return self._deliver(topic, message)
+
+
+class PostgresBroker(LocalBroker):
+    """
+    Брокер для нескольких процессов: publish отправляет уведомление
+    через pg_notify, а поток-слушатель каждого процесса, в котором есть
+    подписчики, получает уведомления всех процессов по LISTEN и раздаёт
+    их своим подписчикам. Уведомления, отправленные в транзакции,
+    Postgres доставляет после коммита.
+
+    Если соединение слушателя оборвалось, уведомления за это время
+    потеряны, и все подписчики процесса помечаются отставшими.
+    """
+
+    channel = 'foodgram_events'
+
+    def __init__(self):
+        if connection.vendor != 'postgresql':
+            raise ImproperlyConfigured(
+                'PostgresBroker работает только с базой Postgres.'
+            )
+        super().__init__()
+        self._listener = None
+        self._listening = threading.Event()
+        self._stopped = threading.Event()
+
+    def subscribe(self, topics):
+        with self._lock:
+            started = self._listener is None
+            if started:
+                self._stopped.clear()
+                self._listener = threading.Thread(
+                    target=self._listen, name='events-listener', daemon=True
+                )
+                self._listener.start()
+        # Первый подписчик ждёт LISTEN, иначе уведомления, отправленные
+        # сразу после подписки, до него не дойдут
+        if started:
+            self._listening.wait(EVENTS_LISTEN_POLL_SECONDS)
+
+        return super().subscribe(topics)
+
+    def publish(self, topic, message):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [
+                self.channel,
+                json.dumps(
+                    {'topic': topic, 'message': message},
+                    ensure_ascii=False,
+                    separators=(',', ':')
+                )
+            ])
+        metrics.increment('events.published')
+
+    def close(self):
+        """Останавливает слушателя; подписка запустит его снова."""
+        with self._lock:
+            listener, self._listener = self._listener, None
+        if listener is not None:
+            self._stopped.set()
+            listener.join()
+
+    def _lose_all(self):
+        with self._lock:
+            subscribers = set().union(*self._subscribers.values())
+        for subscriber in subscribers:
+            subscriber.lose()
+
+    def _listen(self):
+        database = connections['default']
+        reconnect = False
+        while not self._stopped.is_set():
+            listener = None
+            try:
+                listener = database.Database.connect(
+                    **database.get_connection_params()
+                )
+                listener.autocommit = True
+                with listener.cursor() as cursor:
+                    cursor.execute(f'LISTEN {self.channel}')
+                self._listening.set()
+                if reconnect:
+                    self._lose_all()
+                reconnect = True
+
+                while not self._stopped.is_set():
+                    ready, _, _ = select.select(
+                        (listener,), (), (), EVENTS_LISTEN_POLL_SECONDS
+                    )
+                    if not ready:
+                        continue
+                    listener.poll()
+                    while listener.notifies:
+                        data = json.loads(listener.notifies.pop(0).payload)
+                        self._deliver(data['topic'], data['message'])
+            except database.Database.Error:
+                metrics.increment('events.listener_errors')
+                self._stopped.wait(EVENTS_LISTEN_RETRY_SECONDS)
+            finally:
+                self._listening.clear()
+                if listener is not None:
+                    listener.close()
+
+
+broker = import_string(settings.EVENTS_BROKER)()
+
+
+def author_topic(author_id):
+    return f'author:{author_id}'
+
+
+def user_topic(user_id):
+    return f'user:{user_id}'
@@ -0,0 +1,46 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+
+class LocalTTLCache:
+    """
+    Потокобезопасный кэш в памяти процесса.
+    Записи живут не дольше ttl секунд, а при превышении max_size
+    вытесняются самые давние из них.
+    """
+
+    def __init__(self, ttl, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+
+            expires_at, value = item
+            if expires_at < monotonic():
+                del self._data[key]
+                return default
+
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
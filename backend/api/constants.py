@@ -17,4 +17,83 @@ MAX_LENGTH_SHORT_LINK = 255
 
 MIN_COOKING_TIME = 1
 
+DEFAULT_SERVINGS = 1
+MIN_SERVINGS = 1
+MAX_SERVINGS = 100
+
 MIN_HASHIDS_LENGTH = 3
+
+MAX_WATERMARK_NAME_LENGTH = 64
+MAX_TOGGLE_EVENT_KIND_LENGTH = 16
+MAX_TOMBSTONE_KIND_LENGTH = 16
+MAX_MEAL_PLAN_NAME_LENGTH = 128
+
+# Вес одного добавления в избранное/список покупок в рейтинге популярности
+FAVOURITE_POPULARITY_WEIGHT = 1.0
+SHOPPING_CART_POPULARITY_WEIGHT = 0.5
+# За сколько часов вклад активности в рейтинг уменьшается вдвое
+POPULARITY_HALF_LIFE_HOURS = 72
+# Сколько секунд ждём незакоммиченные транзакции при пересчёте рейтинга
+POPULARITY_LAG_SECONDS = 60
+
+# Как часто индекс ингредиентов подтягивает изменённые рецепты
+# и как часто полностью перестраивается, секунды
+INGREDIENT_INDEX_REFRESH_SECONDS = 30
+INGREDIENT_INDEX_REBUILD_SECONDS = 60 * 60
+WHAT_TO_COOK_LIMIT = 20
+MAX_WHAT_TO_COOK_LIMIT = 100
+
+# Сколько похожих рецептов хранить для каждого рецепта
+RELATED_RECIPES_TOP_K = 6
+# Вес совпадения тега относительно совпадения ингредиента
+RELATED_RECIPES_TAG_WEIGHT = 0.5
+
+# Вес добавления в избранное/список покупок для рекомендаций
+FAVOURITE_INTERACTION_WEIGHT = 1.0
+SHOPPING_CART_INTERACTION_WEIGHT = 0.5
+# Сколько рекомендаций хранить для пользователя и сколько похожих
+# рецептов учитывать для каждого рецепта при их расчёте
+RECOMMENDATIONS_TOP_N = 20
+RECOMMENDATIONS_NEIGHBOURS = 50
+
+# Сколько id можно передать в одном пакетном запросе
+MAX_BULK_IDS = 100
+# Допустимые id: первичные ключи - BigAutoField
+MIN_ID = 1
+MAX_ID = 2 ** 63 - 1
+
+# Сколько секунд ждём незакоммиченные транзакции при синхронизации
+# и сколько дней хранятся записи об удалениях для неё
+SYNC_LAG_SECONDS = 5
+SYNC_TOMBSTONE_RETENTION_DAYS = 30
+
+# Сколько уведомлений копится в очереди одного соединения потока событий,
+# как часто отправлять в него пустой комментарий, секунды, и сколько
+# пропущенных рецептов досылать при переподключении
+EVENTS_QUEUE_SIZE = 100
+EVENTS_KEEPALIVE_SECONDS = 15
+EVENTS_REPLAY_LIMIT = 50
+# Сколько секунд действует одноразовый билет для подключения к потоку
+EVENTS_TICKET_SECONDS = 30
+# Как часто слушатель PostgresBroker проверяет, не пора ли остановиться,
+# и через сколько секунд переподключается к базе после ошибки
+EVENTS_LISTEN_POLL_SECONDS = 1
+EVENTS_LISTEN_RETRY_SECONDS = 1
+
+# Как часто перечитывать справочник единиц измерения ингредиентов, секунды
+UNITS_CATALOG_TTL_SECONDS = 5 * 60
+
+# Начиная с какого количества строк админка показывает примерное
+# количество записей из статистики Postgres вместо COUNT(*)
+ESTIMATED_COUNT_THRESHOLD = 100000
+
+# Сколько отложенных событий избранного и списка покупок
+# применять за одну транзакцию
+TOGGLE_EVENTS_BATCH_SIZE = 1000
+
+# Сколько секунд хранится пересчитанный на другое число порций
+# список ингредиентов рецепта
+SCALED_INGREDIENTS_CACHE_SECONDS = 24 * 60 * 60
+
+# Сколько секунд хранится список покупок по плану питания
+MEAL_PLAN_SHOPPING_LIST_CACHE_SECONDS = 24 * 60 * 60
@@ -0,0 +1,273 @@
+"""
+Поток событий (Server-Sent Events) о новых рецептах авторов, на которых
+подписан пользователь: /api/events/.
+
+Обслуживается напрямую как ASGI-приложение (см. foodgram/asgi.py),
+потому что Django 3.2 не умеет отдавать бесконечный асинхронный ответ.
+Пока событий нет, соединение - это одна ожидающая корутина и пустая
+очередь, поэтому тысячи простаивающих клиентов почти ничего не стоят.
+Запросы к базе выполняются только при подключении, об изменении
+подписок поток узнаёт из тех же уведомлений. Эти служебные уведомления
+клиенту не отправляются. Если уведомления потеряны, подписки могли
+измениться незаметно для потока, поэтому они перечитываются из базы,
+а клиент получает resync.
+
+Аутентификация - тем же токеном, что и в API, в заголовке
+Authorization. EventSource в браузере заголовки не передаёт, поэтому
+для него есть параметр ?ticket= с одноразовым билетом из
+POST /api/events/ticket/: URL с ним попадает в логи, но билет
+действует EVENTS_TICKET_SECONDS и только для одного подключения.
+При переподключении с заголовком Last-Event-ID клиенту досылаются
+пропущенные рецепты.
+"""
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import cache
+from django.utils.crypto import get_random_string
+from rest_framework.exceptions import AuthenticationFailed
+
+from api import metrics
+from api.async_views import run_query
+from api.authentication import CachedTokenAuthentication
+from api.broker import author_topic, broker, user_topic
+from api.constants import (EVENTS_KEEPALIVE_SECONDS,
+                           EVENTS_REPLAY_LIMIT,
+                           EVENTS_TICKET_SECONDS)
+from recipes.models import Recipe
+from users.models import Subscription
+
+User = get_user_model()
+
+TICKET_SALT = 'api.events.ticket'
+
+RECIPE_EVENT = 'recipe'
+SUBSCRIBED_EVENT = 'subscribed'
+UNSUBSCRIBED_EVENT = 'unsubscribed'
+# Клиент пропустил уведомления и должен перезапросить ленту
+RESYNC_EVENT = 'resync'
+
+
+def get_recipe_message(recipe):
+    return {
+        'event': RECIPE_EVENT,
+        'id': recipe.pk,
+        'data': {
+            'id': recipe.pk,
+            'name': recipe.name,
+            'author': recipe.author_id,
+            'created_at': recipe.created_at.isoformat(),
+        }
+    }
+
+
+def format_event(message):
+    lines = [f'event: {message["event"]}']
+    if 'id' in message:
+        lines.append(f'id: {message["id"]}')
+    lines.append(
+        'data: ' + json.dumps(
+            message.get('data', {}), ensure_ascii=False, separators=(',', ':')
+        )
+    )
+
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+def create_ticket(user):
+    return signing.dumps(
+        {'user': user.pk, 'nonce': get_random_string(16)}, salt=TICKET_SALT
+    )
+
+
+def get_ticket_user(ticket):
+    """Проверяет билет и отмечает его использованным."""
+    try:
+        data = signing.loads(
+            ticket, salt=TICKET_SALT, max_age=EVENTS_TICKET_SECONDS
+        )
+    except signing.BadSignature:
+        raise AuthenticationFailed('Недействительный или просроченный билет.')
+    if not cache.add(
+        f'events-ticket:{data["nonce"]}', True, EVENTS_TICKET_SECONDS
+    ):
+        raise AuthenticationFailed('Билет уже использован.')
+    try:
+        return User.objects.get(pk=data['user'], is_active=True)
+    except User.DoesNotExist:
+        raise AuthenticationFailed('Пользователь неактивен или удалён.')
+
+
+def get_token(scope):
+    for name, value in scope['headers']:
+        if name == b'authorization':
+            keyword, _, key = value.decode('latin-1').partition(' ')
+            if keyword == CachedTokenAuthentication.keyword and key:
+                return key
+
+    return None
+
+
+def get_ticket(scope):
+    tickets = parse_qs(scope['query_string'].decode()).get('ticket')
+
+    return tickets[0] if tickets else None
+
+
+def get_last_event_id(scope):
+    values = [
+        value for name, value in scope['headers'] if name == b'last-event-id'
+    ]
+    # Со своим билетом переподключается новый EventSource, а он
+    # заголовок не передаёт
+    values += parse_qs(scope['query_string'].decode()).get('last_event_id', [])
+    for value in values:
+        try:
+            return int(value)
+        except ValueError:
+            return None
+
+    return None
+
+
+def get_author_ids(user):
+    return set(
+        Subscription.objects.filter(user=user).values_list(
+            'author_id', flat=True
+        )
+    )
+
+
+def get_topics(user, author_ids):
+    return {user_topic(user.pk), *map(author_topic, author_ids)}
+
+
+def get_missed_recipes(author_ids, last_event_id):
+    return list(
+        Recipe.objects.filter(
+            author_id__in=author_ids, pk__gt=last_event_id
+        ).order_by('pk').only(
+            'pk', 'name', 'author_id', 'created_at'
+        )[:EVENTS_REPLAY_LIMIT]
+    )
+
+
+async def send_json(send, status, data):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json')],
+    })
+    await send({
+        'type': 'http.response.body',
+        'body': json.dumps(data, ensure_ascii=False).encode(),
+    })
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def events_application(scope, receive, send):
+    if scope['method'] != 'GET':
+        return await send_json(send, 405, {'detail': 'Метод не разрешён.'})
+
+    key = get_token(scope)
+    ticket = get_ticket(scope)
+    if key is None and ticket is None:
+        return await send_json(
+            send, 401, {'detail': 'Учетные данные не были предоставлены.'}
+        )
+    try:
+        if key is not None:
+            user, _ = await run_query(
+                CachedTokenAuthentication().authenticate_credentials, key
+            )
+        else:
+            user = await run_query(get_ticket_user, ticket)
+    except AuthenticationFailed as error:
+        return await send_json(send, 401, {'detail': str(error.detail)})
+
+    author_ids = await run_query(get_author_ids, user)
+    # Подписываемся до досылки пропущенного, чтобы ничего не потерять
+    # между ними; повтор рецепта клиент отсеет по id
+    subscriber = broker.subscribe(get_topics(user, author_ids))
+    metrics.increment('events.connections')
+    disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                # Чтобы nginx не буферизовал поток
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': b'retry: 5000\n\n',
+            'more_body': True,
+        })
+
+        last_event_id = get_last_event_id(scope)
+        if last_event_id is not None and author_ids:
+            for recipe in await run_query(
+                get_missed_recipes, author_ids, last_event_id
+            ):
+                await send({
+                    'type': 'http.response.body',
+                    'body': format_event(get_recipe_message(recipe)),
+                    'more_body': True,
+                })
+
+        while not disconnect.done():
+            message = asyncio.ensure_future(subscriber.get())
+            await asyncio.wait(
+                (message, disconnect),
+                timeout=EVENTS_KEEPALIVE_SECONDS,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if not message.done():
+                message.cancel()
+                if not disconnect.done():
+                    await send({
+                        'type': 'http.response.body',
+                        'body': b': keepalive\n\n',
+                        'more_body': True,
+                    })
+                continue
+
+            message = message.result()
+            if subscriber.overflowed:
+                # Старые изменения подписок из очереди применять нельзя:
+                # после потерянных они вернули бы устаревшее состояние
+                subscriber.overflowed = False
+                subscriber.clear()
+                author_ids = await run_query(get_author_ids, user)
+                broker.set_topics(subscriber, get_topics(user, author_ids))
+                message = {'event': RESYNC_EVENT}
+            elif message['event'] == SUBSCRIBED_EVENT:
+                broker.add_topics(
+                    subscriber, (author_topic(message['data']['author']),)
+                )
+                continue
+            elif message['event'] == UNSUBSCRIBED_EVENT:
+                broker.unsubscribe(
+                    subscriber, (author_topic(message['data']['author']),)
+                )
+                continue
+            await send({
+                'type': 'http.response.body',
+                'body': format_event(message),
+                'more_body': True,
+            })
+    finally:
+        broker.unsubscribe(subscriber)
+        disconnect.cancel()
+        metrics.increment('events.disconnections')
@@ -2,6 +2,7 @@ from django_filters import rest_framework as filters
 from django_filters import CharFilter, ModelMultipleChoiceFilter
 
 from recipes.models import Ingredient, Recipe, Tag
+from recipes.search import search_recipes
 
 
 class RecipeFilter(filters.FilterSet):
@@ -16,16 +17,30 @@ class RecipeFilter(filters.FilterSet):
         field_name='tags__slug',
         to_field_name='slug',
     )
+    search = CharFilter(method='filter_by_search')
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'По популярности'),),
+        method='order_by_popularity'
+    )
 
     class Meta:
         model = Recipe
-        fields = ('author', 'is_favorited', 'is_in_shopping_cart', 'tags')
+        fields = (
+            'author',
+            'is_favorited',
+            'is_in_shopping_cart',
+            'tags',
+            'search',
+            'ordering'
+        )
 
+    # Фильтры опираются на аннотации вьюсета, в которых уже учтены
+    # непримененные события избранного и списка покупок
     def filter_by_is_favorited(self, queryset, name, value):
         user = self.request.user
 
         if value and user.is_authenticated:
-            return queryset.filter(favourites__user=user)
+            return queryset.filter(is_favorited=True)
 
         return queryset
 
@@ -33,10 +48,17 @@ class RecipeFilter(filters.FilterSet):
         user = self.request.user
 
         if value and user.is_authenticated:
-            return queryset.filter(purchases__user=user)
+            return queryset.filter(is_in_shopping_cart=True)
 
         return queryset
 
+    def filter_by_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
+
+    def order_by_popularity(self, queryset, name, value):
+        # Порядок совпадает с индексом recipe_popularity_idx
+        return queryset.order_by('-popularity_score', '-created_at')
+
 
 class IngredientFilter(filters.FilterSet):
     name = CharFilter(field_name='name', lookup_expr='istartswith')
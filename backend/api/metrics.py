@@ -0,0 +1,18 @@
+import threading
+from collections import Counter
+
+
+_lock = threading.Lock()
+_counters = Counter()
+
+
+def increment(name, value=1):
+    """Увеличивает счётчик метрики в рамках текущего процесса."""
+    with _lock:
+        _counters[name] += value
+
+
+def snapshot():
+    """Возвращает копию всех счётчиков текущего процесса."""
+    with _lock:
+        return dict(_counters)
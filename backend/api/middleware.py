@@ -0,0 +1,80 @@
+import random
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import cache
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import SAFE_METHODS
+
+from api import metrics
+from api.authentication import CachedTokenAuthentication
+from foodgram.db_router import reset_read_database, set_read_database
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Отправляет чтение в безопасных запросах в одну из реплик.
+
+    После любого изменяющего запроса пользователь на REPLICA_PIN_SECONDS
+    закрепляется за основной базой, чтобы сразу видеть свои изменения,
+    пока они доезжают до реплик. Пользователь определяется по токену,
+    а без токена - по сессии (админка): за nginx у всех клиентов один
+    REMOTE_ADDR, и закрепление по IP отправило бы в основную базу всех
+    сразу. Закрепляется пользователь, а не токен, поэтому изменения
+    видны и с других его токенов и в админке. Анонимные запросы
+    не закрепляются, а только что выданный при логине токен
+    CachedTokenAuthentication при необходимости ищет в основной базе.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    @staticmethod
+    def get_pin_key(request):
+        """
+        Ключ закрепления по id пользователя из токена или из сессии.
+        Токен ищется через кэш CachedTokenAuthentication, так что DRF
+        потом найдёт его там же без запроса к базе.
+        """
+        try:
+            credentials = CachedTokenAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            credentials = None
+        if credentials is not None:
+            user_id = credentials[0].pk
+        elif hasattr(request, 'session'):
+            user_id = request.session.get(SESSION_KEY)
+        else:
+            user_id = None
+
+        if user_id is None:
+            return None
+        return f'replica-pin:user:{user_id}'
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        alias = None
+        if request.method in SAFE_METHODS:
+            pin_key = self.get_pin_key(request)
+            if pin_key and cache.get(pin_key):
+                metrics.increment('replica_routing.pinned')
+            else:
+                alias = random.choice(settings.DATABASE_REPLICAS)
+                metrics.increment('replica_routing.replica')
+
+        token = set_read_database(alias)
+        try:
+            response = self.get_response(request)
+        finally:
+            reset_read_database(token)
+
+        if request.method not in SAFE_METHODS:
+            # Ключ считаем после ответа: при входе в админку
+            # пользователь появляется в сессии только в этом запросе
+            pin_key = self.get_pin_key(request)
+            if pin_key:
+                cache.set(pin_key, True, settings.REPLICA_PIN_SECONDS)
+
+        return response
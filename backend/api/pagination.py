@@ -1,6 +1,68 @@
-from rest_framework.pagination import PageNumberPagination
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (Cursor,
+                                       CursorPagination,
+                                       PageNumberPagination)
 
 
 class PageLimitPagination(PageNumberPagination):
     page_size_query_param = 'limit'
     page_size = 6
+
+
+class FeedCursorPagination(CursorPagination):
+    """
+    Курсорная пагинация для ленты рецептов.
+    Позиция курсора - пара (created_at, id) последнего рецепта страницы,
+    поэтому листать можно только вперёд.
+    """
+
+    page_size_query_param = 'limit'
+    page_size = 6
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+
+    def decode_position(self):
+        if self.cursor is None or self.cursor.position is None:
+            return None
+
+        try:
+            created_at, pk = self.cursor.position.split('|')
+            created_at, pk = parse_datetime(created_at), int(pk)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+
+        return created_at, pk
+
+    def paginate_feed(self, request, get_page):
+        """
+        get_page(before, limit) должна вернуть не больше limit рецептов,
+        опубликованных раньше позиции before, в порядке ordering.
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+
+        results = get_page(self.decode_position(), self.page_size + 1)
+        self.page = results[:self.page_size]
+        self.has_next = len(results) > self.page_size
+        self.has_previous = False
+
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+
+        last = self.page[-1]
+        return self.encode_cursor(Cursor(
+            offset=0,
+            reverse=False,
+            position=f'{last.created_at.isoformat()}|{last.pk}'
+        ))
+
+    def get_previous_link(self):
+        return None
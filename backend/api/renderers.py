@@ -0,0 +1,148 @@
+"""
+Компактные форматы ответа для клиентов, которые выкачивают списки
+целиком (аналитика, синхронизация мобильного приложения).
+
+Формат выбирается заголовком Accept, по умолчанию остаётся JSON:
+
+- application/msgpack - те же данные, что и в JSON, в MessagePack;
+- application/vnd.foodgram.columnar+json и
+  application/vnd.foodgram.columnar+msgpack - колоночное представление
+  списка: вместо массива объектов по массиву значений на каждое поле,
+  а повторяющиеся вложенные объекты (автор, теги) хранятся один раз
+  на страницу в interned, в колонках же остаются их номера. Поля,
+  не раскрытые через ?expand=, и так содержат id и остаются в колонках.
+"""
+import json
+
+import msgpack
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+# Вложенные объекты, которые в колоночном формате хранятся один раз
+INTERNED_FIELDS = ('author', 'tags')
+
+
+def is_nested(rows, field):
+    """
+    Лежат ли в поле вложенные объекты: без ?expand= там только id,
+    и хранить их отдельно незачем.
+    """
+    for row in rows:
+        value = row[field]
+        if isinstance(value, list):
+            value = value[0] if value else None
+        if value is not None:
+            return isinstance(value, dict)
+
+    return False
+
+
+def to_columns(rows, interned_fields=INTERNED_FIELDS):
+    """
+    Превращает список словарей с одинаковыми ключами в словарь
+    {'length', 'columns', 'interned'}. Поля из interned_fields
+    попадают в interned, только если в них вложенные объекты.
+    """
+    if not rows:
+        return {'length': 0, 'columns': {}, 'interned': {}}
+
+    columns = {field: [] for field in rows[0]}
+    interned = {
+        field: {} for field in interned_fields
+        if field in columns and is_nested(rows, field)
+    }
+    for row in rows:
+        for field, values in columns.items():
+            value = row[field]
+            if field in interned:
+                objects = interned[field]
+                if isinstance(value, list):
+                    value = [
+                        objects.setdefault(item['id'], (len(objects), item))[0]
+                        for item in value
+                    ]
+                elif value is not None:
+                    value = objects.setdefault(
+                        value['id'], (len(objects), value)
+                    )[0]
+            values.append(value)
+
+    return {
+        'length': len(rows),
+        'columns': columns,
+        'interned': {
+            field: [item for _, item in objects.values()]
+            for field, objects in interned.items()
+        }
+    }
+
+
+def to_columnar(data):
+    """
+    Переводит в колоночный вид список объектов или страницу пагинации,
+    остальные ответы (один объект, ошибки) возвращает как есть.
+    """
+    if isinstance(data, list) and all(isinstance(row, dict) for row in data):
+        return to_columns(data)
+    if isinstance(data, dict) and isinstance(data.get('results'), list):
+        return {**data, 'results': to_columns(data['results'])}
+
+    return data
+
+
+def pack(data):
+    # Decimal, даты и прочие не поддерживаемые MessagePack типы
+    # переводим так же, как JSONRenderer
+    return msgpack.packb(data, default=JSONEncoder().default)
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        return pack(data)
+
+
+class ColumnarJSONRenderer(BaseRenderer):
+    media_type = 'application/vnd.foodgram.columnar+json'
+    format = 'columnar'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        return json.dumps(
+            to_columnar(data),
+            cls=JSONEncoder,
+            ensure_ascii=False,
+            separators=(',', ':')
+        ).encode()
+
+
+class ColumnarMessagePackRenderer(BaseRenderer):
+    media_type = 'application/vnd.foodgram.columnar+msgpack'
+    format = 'columnar-msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        return pack(to_columnar(data))
+
+
+# Форматы, которые выбираются только явно, по заголовку Accept
+COMPACT_RENDERERS = (
+    MessagePackRenderer,
+    ColumnarJSONRenderer,
+    ColumnarMessagePackRenderer,
+)
@@ -1,17 +1,26 @@
 from drf_extra_fields.fields import Base64ImageField
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from djoser.serializers import UserSerializer as BaseUserSerializer
 
 from recipes.models import (FavouriteRecipe,
                             Ingredient,
+                            MealPlan,
+                            MealPlanEntry,
                             Recipe,
                             RecipeIngredient,
                             ShoppingList,
                             Tag)
+from recipes.servings import get_scaled_ingredients, get_target_servings
 from users.models import Subscription
-from api.constants import MIN_INGREDIENT_AMOUNT_QUANTITY
+from api.constants import (MAX_BULK_IDS,
+                           MAX_ID,
+                           MAX_SERVINGS,
+                           MIN_ID,
+                           MIN_INGREDIENT_AMOUNT_QUANTITY,
+                           MIN_SERVINGS)
 
 
 User = get_user_model()
@@ -57,6 +66,11 @@ class UserSerializer(BaseUserSerializer):
         )
 
     def get_is_subscribed(self, obj):
+        # Если подписки уже известны заранее, не делаем запрос на каждого
+        subscribed_author_ids = self.context.get('subscribed_author_ids')
+        if subscribed_author_ids is not None:
+            return obj.id in subscribed_author_ids
+
         request = self.context.get('request', False)
 
         return (
@@ -185,8 +199,62 @@ class RecipeReadSerializer(serializers.ModelSerializer):
             'name',
             'image',
             'text',
-            'cooking_time'
+            'cooking_time',
+            'servings',
+            'calories',
+            'proteins',
+            'fats',
+            'carbohydrates',
+            'cost'
         )
+        # Вложенные объекты, которые без ?expand= отдаются только как id
+        expandable_fields = ('author', 'tags')
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # Ингредиенты, пересчитанные по ?servings=, берутся из кэша
+        if self.context.get('servings') is not None:
+            fields['ingredients'] = serializers.SerializerMethodField(
+                method_name='get_scaled_ingredients'
+            )
+
+        # Набор полей выбирает вьюсет по ?fields=, ?omit= и ?expand=
+        requested_fields = self.context.get('requested_fields')
+        if requested_fields is None:
+            return fields
+
+        selected, expanded = requested_fields
+        for name in self.Meta.expandable_fields:
+            if name not in expanded:
+                fields[name] = serializers.PrimaryKeyRelatedField(
+                    read_only=True, many=name == 'tags'
+                )
+
+        return {
+            name: field for name, field in fields.items() if name in selected
+        }
+
+    def get_scaled_ingredients(self, recipe):
+        servings = get_target_servings(recipe, self.context['servings'])
+        return get_scaled_ingredients(
+            (recipe,), {recipe.pk: servings}
+        )[recipe.pk]
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if self.context.get('servings') is None:
+            return data
+
+        # Порции и итоги рецепта тоже пересчитываем
+        servings = get_target_servings(instance, self.context['servings'])
+        if 'servings' in data:
+            data['servings'] = servings
+        factor = servings / instance.servings
+        for field in Ingredient.nutrition_fields.values():
+            if data.get(field) is not None:
+                data[field] = round(data[field] * factor, 2)
+
+        return data
 
 
 class RecipeWriteSerializer(serializers.ModelSerializer):
@@ -216,7 +284,8 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
             'name',
             'image',
             'text',
-            'cooking_time'
+            'cooking_time',
+            'servings'
         )
 
     def to_representation(self, instance):
@@ -240,6 +309,7 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         ]
         RecipeIngredient.objects.bulk_create(recipe_ingredients)
 
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags', [])
         ingredients_data = validated_data.pop('ingredients', [])
@@ -250,6 +320,7 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
 
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         tags = validated_data.pop('tags', [])
         ingredients_data = validated_data.pop('ingredients', [])
@@ -341,6 +412,34 @@ class RecipeShortSerializer(serializers.ModelSerializer):
         return None
 
 
+class CookableRecipeSerializer(RecipeShortSerializer):
+    """
+    Сериализатор рецепта для подбора по имеющимся ингредиентам.
+    """
+
+    coverage = serializers.FloatField(read_only=True)
+    missing_ingredients = IngredientSerializer(many=True, read_only=True)
+
+    class Meta(RecipeShortSerializer.Meta):
+        fields = RecipeShortSerializer.Meta.fields + (
+            'coverage',
+            'missing_ingredients'
+        )
+
+
+class BulkIdsSerializer(serializers.Serializer):
+    """
+    Список id для пакетных операций с избранным, списком покупок
+    и подписками.
+    """
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=MIN_ID, max_value=MAX_ID),
+        allow_empty=False,
+        max_length=MAX_BULK_IDS
+    )
+
+
 class BaseFavouriteAndShoppingListSerializer(serializers.ModelSerializer):
     """
     Базовый класс для Избранного и Списка покупок.
@@ -351,6 +450,7 @@ class BaseFavouriteAndShoppingListSerializer(serializers.ModelSerializer):
             'user',
             'recipe'
         )
+        read_only_fields = fields
 
     def to_representation(self, instance):
         return RecipeShortSerializer(
@@ -358,12 +458,13 @@ class BaseFavouriteAndShoppingListSerializer(serializers.ModelSerializer):
             context=self.context
         ).data
 
-    def validate(self, data):
-        recipe = data['recipe']
-
-        if self.Meta.model.objects.filter(
-                user=data['user'], recipe=recipe
-        ).exists():
+    def create(self, validated_data):
+        # Повторы отсекает уникальное ограничение в базе, без лишнего
+        # запроса и без гонки между проверкой и вставкой
+        try:
+            with transaction.atomic():
+                return super().create(validated_data)
+        except IntegrityError:
             raise ValidationError(
                 {
                     'detail': 'Рецепт уже '
@@ -372,8 +473,6 @@ class BaseFavouriteAndShoppingListSerializer(serializers.ModelSerializer):
                 }
             )
 
-        return data
-
 
 class FavouriteSerializer(BaseFavouriteAndShoppingListSerializer):
     class Meta(BaseFavouriteAndShoppingListSerializer.Meta):
@@ -424,24 +523,71 @@ class SubscriptionsWriteSerializer(serializers.ModelSerializer):
             'user',
             'author'
         )
+        read_only_fields = fields
 
-    def validate(self, data):
-        user = self.context['request'].user
-        author = data['author']
-
-        if user == author:
+    def create(self, validated_data):
+        if validated_data['user'] == validated_data['author']:
             raise ValidationError(
                 {'author': 'Вы не можете подписаться на себя.'}
             )
-        if author.subscriptions_to_author.filter(user=user).exists():
+        try:
+            with transaction.atomic():
+                return super().create(validated_data)
+        except IntegrityError:
             raise ValidationError(
                 {'author': 'Вы уже подписаны на этого пользователя.'}
             )
 
-        return data
-
     def to_representation(self, instance):
         return SubscriptionsReadSerializer(
             instance.author,
             context=self.context
         ).data
+
+
+class MealPlanEntrySerializer(serializers.ModelSerializer):
+    """
+    Сериализатор для модели MealPlanEntry.
+    Без servings рецепт планируется на столько порций, на сколько
+    он рассчитан.
+    """
+
+    servings = serializers.IntegerField(
+        min_value=MIN_SERVINGS,
+        max_value=MAX_SERVINGS,
+        required=False
+    )
+
+    class Meta:
+        model = MealPlanEntry
+        fields = (
+            'id',
+            'date',
+            'recipe',
+            'servings'
+        )
+
+    def validate(self, data):
+        data.setdefault('servings', data['recipe'].servings)
+
+        return data
+
+
+class MealPlanSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор для модели MealPlan.
+    """
+
+    entries = MealPlanEntrySerializer(
+        many=True,
+        read_only=True
+    )
+
+    class Meta:
+        model = MealPlan
+        fields = (
+            'id',
+            'name',
+            'version',
+            'entries'
+        )
@@ -1,27 +1,120 @@
 from io import BytesIO
 
+from django.db.models import Exists, OuterRef, Sum
 
-def get_shopping_cart_file_buffer(recipes, total_ingredients):
-    content = ''
+from recipes import toggles
+from recipes.models import Recipe, RecipeIngredient, ShoppingList
+from recipes.nutrition import get_totals
+from recipes.servings import get_scaled_ingredients, get_target_servings
+from recipes.units import format_amount, unit_catalog
 
+
+def get_shopping_cart(user, servings=None):
+    """
+    Возвращает рецепты из списка покупок пользователя, сводный список
+    их ингредиентов и итоговые пищевую ценность и стоимость.
+    servings - разобранный ?servings= (см. recipes.servings), чтобы
+    пересчитать рецепты на другое число порций.
+    """
+    in_shopping_cart = Exists(
+        ShoppingList.objects.filter(user=user, recipe=OuterRef('pk'))
+    )
+    if toggles.is_enabled():
+        in_shopping_cart = toggles.overlay_pending(
+            in_shopping_cart, toggles.get_pending(user), ShoppingList
+        )
+    cart = Recipe.objects.annotate(
+        is_in_shopping_cart=in_shopping_cart
+    ).filter(is_in_shopping_cart=True)
+
+    if servings is not None:
+        return get_scaled_shopping_cart(cart, servings)
+
+    recipes = list(cart.values('name', 'cooking_time', 'servings'))
+    # Суммы по ингредиентам считает база, а сводит единицы
+    # измерения и похожие ингредиенты unit_catalog
+    rows = list(
+        RecipeIngredient.objects.filter(
+            recipe__in=cart.values('pk')
+        ).values('ingredient_id').annotate(
+            total_amount=Sum('amount')
+        ).order_by().values_list('ingredient_id', 'total_amount')
+    )
+
+    return recipes, unit_catalog.aggregate(rows), get_totals(rows)
+
+
+def get_scaled_shopping_cart(cart, servings):
+    """
+    То же, что get_shopping_cart, но по ингредиентам рецептов,
+    пересчитанным на запрошенное число порций. Списки ингредиентов
+    берутся из кэша recipes.servings, поэтому повторное скачивание
+    обходится без запросов к ингредиентам.
+    """
+    cart = list(cart.only('pk', 'name', 'cooking_time', 'servings',
+                          'updated_at'))
+    targets = {
+        recipe.pk: get_target_servings(recipe, servings) for recipe in cart
+    }
+    scaled = get_scaled_ingredients(cart, targets)
+
+    recipes = [
+        {
+            'name': recipe.name,
+            'cooking_time': recipe.cooking_time,
+            'servings': targets[recipe.pk]
+        }
+        for recipe in cart
+    ]
+    rows = [
+        (item['id'], item['amount'])
+        for recipe in cart
+        for item in scaled[recipe.pk]
+    ]
+
+    return recipes, unit_catalog.aggregate(rows), get_totals(rows)
+
+
+def iter_shopping_cart_lines(recipes, total_ingredients, totals=None):
+    """
+    Текст файла списка покупок по частям: блок на каждый рецепт
+    и строка на каждый ингредиент, уже в utf-8.
+    """
     for recipe in recipes:
-        content += (
-            f'Название: {recipe["recipe__name"]}\n'
-            f'Время приготовления: {recipe["recipe__cooking_time"]}\n\n'
+        block = ''
+        if 'date' in recipe:
+            block += f'Дата: {recipe["date"]:%d.%m.%Y}\n'
+        block += (
+            f'Название: {recipe["name"]}\n'
+            f'Время приготовления: {recipe["cooking_time"]}\n'
+            f'Порций: {recipe["servings"]}\n\n'
         )
+        yield block.encode('utf-8')
 
-    content += 'Список всех ингредиентов:\n'
+    yield 'Список всех ингредиентов:\n'.encode('utf-8')
 
     for item in total_ingredients:
-        content += (
-            f'  - {item["ingredient__name"]} '
-            f'({item["ingredient__measurement_unit"]}) — '
-            f'{item["total_amount"]}\n'
-        )
+        yield (
+            f'  - {item["name"]} '
+            f'({item["measurement_unit"]}) — '
+            f'{item["amount"]}\n'
+        ).encode('utf-8')
+
+    # Итог выводим, только если он известен по всем ингредиентам
+    totals = {
+        field: value for field, value in (totals or {}).items()
+        if value is not None
+    }
+    if totals:
+        yield '\nИтого:\n'.encode('utf-8')
+    for field, value in totals.items():
+        yield (
+            f'  - {Recipe._meta.get_field(field).verbose_name}: '
+            f'{format_amount(value)}\n'
+        ).encode('utf-8')
 
-    text_content = content
-    file_buffer = BytesIO()
-    file_buffer.write(text_content.encode('utf-8'))
-    file_buffer.seek(0)
 
-    return file_buffer
+def get_shopping_cart_file_buffer(recipes, total_ingredients, totals=None):
+    return BytesIO(b''.join(
+        iter_shopping_cart_lines(recipes, total_ingredients, totals)
+    ))
@@ -0,0 +1,106 @@
+from time import monotonic
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.signals import request_finished, request_started
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api import metrics
+from api.authentication import token_cache
+from api.broker import author_topic, broker, user_topic
+from api.events import (SUBSCRIBED_EVENT,
+                        UNSUBSCRIBED_EVENT,
+                        get_recipe_message)
+from recipes.models import Recipe
+from users.models import Subscription
+
+
+User = get_user_model()
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    """
+    Сбрасывает токен из кэша при его удалении,
+    в том числе при выходе через token/logout в djoser.
+    """
+    token_cache.delete(instance.key)
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, created, **kwargs):
+    """
+    Сбрасывает токены пользователя при любом изменении пользователя:
+    смене пароля, деактивации или обновлении профиля.
+    """
+    if created:
+        return
+
+    keys = Token.objects.filter(user=instance).values_list('key', flat=True)
+    if keys:
+        token_cache.delete(*keys)
+
+
+@receiver(request_started)
+def check_database_connections(**kwargs):
+    """
+    Закрывает переиспользуемые соединения, которые перестали отвечать
+    (например, после перезапуска базы), чтобы запрос открыл новое,
+    а не упал на первом же SQL. Проверка стоит лишнего запроса к базе,
+    поэтому проверяются только соединения, простоявшие дольше
+    DB_CONN_HEALTH_CHECK_IDLE_SECONDS: у занятого воркера соединения
+    живые, а после ошибки неработающее соединение и так закрывает
+    сам Django в конце запроса.
+    """
+    now = monotonic()
+    for connection in connections.all():
+        if (
+            connection.connection is not None
+            and connection.settings_dict.get('CONN_HEALTH_CHECKS')
+            and not connection.in_atomic_block
+            and now - getattr(connection, 'idle_since', now)
+            > settings.DB_CONN_HEALTH_CHECK_IDLE_SECONDS
+        ):
+            metrics.increment('db.health_checks')
+            if not connection.is_usable():
+                connection.close()
+            else:
+                connection.idle_since = now
+
+
+@receiver(request_finished)
+def mark_database_connections_idle(**kwargs):
+    now = monotonic()
+    for connection in connections.all():
+        if connection.connection is not None:
+            connection.idle_since = now
+
+
+@receiver(post_save, sender=Recipe)
+def publish_new_recipe(sender, instance, created, **kwargs):
+    """Уведомляет подписчиков автора о новом рецепте."""
+    if not created:
+        return
+
+    message = get_recipe_message(instance)
+    transaction.on_commit(
+        lambda: broker.publish(author_topic(instance.author_id), message)
+    )
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def publish_subscription_change(sender, instance, **kwargs):
+    """Добавляет или убирает автора в открытых потоках пользователя."""
+    message = {
+        'event': (
+            SUBSCRIBED_EVENT if kwargs.get('created') else UNSUBSCRIBED_EVENT
+        ),
+        'data': {'author': instance.author_id},
+    }
+    transaction.on_commit(
+        lambda: broker.publish(user_topic(instance.user_id), message)
+    )
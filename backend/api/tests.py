@@ -0,0 +1,2396 @@
+"""
+Тесты API: python manage.py test api. Идут и на Postgres, и на sqlite
+(DB_ENGINE=sqlite); тесты, которым нужен именно Postgres, на sqlite
+пропускаются.
+"""
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from time import monotonic, time
+from unittest import mock, skipUnless
+
+import msgpack
+import numpy as np
+import psycopg2.extensions
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.http import Http404, HttpResponse
+from django.test import (RequestFactory,
+                         SimpleTestCase,
+                         TestCase,
+                         TransactionTestCase)
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework import viewsets
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory
+
+from api import async_views, metrics, throttling
+from api.authentication import CachedTokenAuthentication, token_cache
+from api.broker import PostgresBroker, author_topic, broker, user_topic
+from api.constants import (EVENTS_TICKET_SECONDS,
+                           MAX_BULK_IDS,
+                           RELATED_RECIPES_TAG_WEIGHT,
+                           SYNC_TOMBSTONE_RETENTION_DAYS)
+from api.events import events_application
+from api.middleware import ReplicaRoutingMiddleware
+from api.renderers import (ColumnarJSONRenderer,
+                           ColumnarMessagePackRenderer,
+                           to_columns)
+from api.throttling import (SlidingWindowLimiter,
+                            SlidingWindowThrottle,
+                            get_rate,
+                            get_request_ident,
+                            throttle)
+from foodgram.db_backends.postgresql_pool.base import (
+    ConnectionPool,
+    DatabaseWrapper as PooledDatabaseWrapper,
+    _pools
+)
+from foodgram.db_router import set_read_database
+from recipes.feed import get_feed_ids
+from recipes.ingredient_index import IngredientIndex, ingredient_index
+from recipes.models import (FavouriteRecipe,
+                            Ingredient,
+                            MealPlan,
+                            Recipe,
+                            RecipeIngredient,
+                            RelatedRecipe,
+                            ShoppingList,
+                            Tag,
+                            ToggleEvent)
+from recipes.paginators import EstimatedCountPaginator
+from recipes.related import build_feature_matrix, compute_related
+from recipes.sync import encode_token
+from recipes.units import normalize_unit, unit_catalog
+from recipes.views import redirect_to_recipe_async
+from users.models import Subscription
+
+
+User = get_user_model()
+
+PNG = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAA'
+    'ADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=='
+)
+
+
+class APITestCase(TestCase):
+    """
+    Пользователи, тег и ингредиенты для тестов API. Кэши процесса
+    и общий кэш очищаются перед каждым тестом, файлы пишутся во
+    временный MEDIA_ROOT.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.settings_override = override_settings(
+            MEDIA_ROOT=cls.media_root, THROTTLE_ENABLED=False
+        )
+        cls.settings_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        # Раньше super(): override_settings на самом классе снимается
+        # там, и настройки должны восстанавливаться в обратном порядке
+        cls.settings_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = Tag.objects.create(name='Завтрак', slug='breakfast')
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit=unit)
+            for name, unit in (
+                ('мука', 'г'),
+                ('молоко', 'мл'),
+                ('яйца', 'шт.'),
+                ('сахар', 'г'),
+            )
+        )
+        cls.ingredients = list(Ingredient.objects.order_by('pk'))
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        token_cache.local.clear()
+        unit_catalog.invalidate()
+
+    def create_user(self, name):
+        return User.objects.create_user(
+            username=name,
+            email=f'{name}@example.com',
+            password='password',
+            first_name=name,
+            last_name=name
+        )
+
+    def get_client(self, user=None):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        return client
+
+    def create_recipe(self, author, ingredients=(), name='Блины', **kwargs):
+        """Рецепт через ORM, ingredients - пары (ингредиент, количество)."""
+        recipe = Recipe.objects.create(
+            author=author,
+            name=name,
+            text=kwargs.pop('text', 'Описание'),
+            cooking_time=kwargs.pop('cooking_time', 10),
+            image='recipes/images/test.png',
+            **kwargs
+        )
+        recipe.tags.set([self.tag])
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=recipe, ingredient=ingredient, amount=amount
+            )
+            for ingredient, amount in ingredients
+        )
+        return recipe
+
+    def post_recipe(self, client, ingredients, name='Блины', **kwargs):
+        """Рецепт через API, ingredients - пары (ингредиент, количество)."""
+        return client.post('/api/recipes/', {
+            'tags': [self.tag.pk],
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': amount}
+                for ingredient, amount in ingredients
+            ],
+            'name': name,
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': PNG,
+            **kwargs
+        }, format='json')
+
+
+class CachedTokenAuthenticationTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('user')
+        self.key = Token.objects.create(user=self.user).key
+
+    def authenticate(self):
+        return CachedTokenAuthentication().authenticate_credentials(self.key)
+
+    def test_second_lookup_skips_database(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.authenticate()[0], self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authenticate()[0], self.user)
+
+        # Из общего кэша, когда кэш процесса уже истёк
+        token_cache.local.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authenticate()[0], self.user)
+
+    def test_deleted_token_rejected(self):
+        self.authenticate()
+        Token.objects.get(key=self.key).delete()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_deactivated_user_rejected(self):
+        self.authenticate()
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_logout_invalidates_token(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.key}')
+        self.assertEqual(client.get('/api/users/me/').status_code, 200)
+
+        client.post('/api/auth/token/logout/')
+
+        self.assertEqual(client.get('/api/users/me/').status_code, 401)
+
+
+class CountersTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.user = self.create_user('user')
+        self.client = self.get_client(self.user)
+
+    def test_recipe_count(self):
+        client = self.get_client(self.author)
+        response = self.post_recipe(client, [(self.ingredients[0], 100)])
+        self.assertEqual(response.status_code, 201)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 1)
+
+        client.delete(f'/api/recipes/{response.data["id"]}/')
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 0)
+
+    def test_favourite_and_cart_counts(self):
+        recipe = self.create_recipe(self.author)
+        for url, field in (
+            (f'/api/recipes/{recipe.pk}/favorite/', 'favourites_count'),
+            (f'/api/recipes/{recipe.pk}/shopping_cart/',
+             'shopping_cart_count'),
+        ):
+            self.assertEqual(self.client.post(url).status_code, 201)
+            # Повторное добавление счётчик не меняет
+            self.assertEqual(self.client.post(url).status_code, 400)
+            recipe.refresh_from_db()
+            self.assertEqual(getattr(recipe, field), 1)
+
+            self.assertEqual(self.client.delete(url).status_code, 204)
+            self.assertEqual(self.client.delete(url).status_code, 400)
+            recipe.refresh_from_db()
+            self.assertEqual(getattr(recipe, field), 0)
+
+    def test_subscribers_count(self):
+        url = f'/api/users/{self.author.pk}/subscribe/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.subscribers_count, 1)
+
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.subscribers_count, 0)
+
+    def test_recount_fixes_drift(self):
+        recipe = self.create_recipe(self.author)
+        FavouriteRecipe.objects.create(user=self.user, recipe=recipe)
+        User.objects.filter(pk=self.author.pk).update(subscribers_count=5)
+
+        call_command('recount_counters', stdout=StringIO())
+
+        recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(recipe.favourites_count, 1)
+        self.assertEqual(self.author.recipes_count, 1)
+        self.assertEqual(self.author.subscribers_count, 0)
+
+
+class PopularityTest(APITestCase):
+    """Время в тестах - минуты от self.now, см. at()."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.users = [self.create_user(f'user{n}') for n in range(3)]
+        self.first = self.create_recipe(self.author, name='Первый')
+        self.second = self.create_recipe(self.author, name='Второй')
+        self.now = timezone.now()
+
+    def at(self, minutes):
+        return mock.patch.object(
+            timezone, 'now',
+            return_value=self.now + timedelta(minutes=minutes)
+        )
+
+    def add(self, model, user, recipe, minutes=0):
+        with self.at(minutes):
+            return model.objects.create(user=user, recipe=recipe)
+
+    def remove(self, relation, minutes):
+        with self.at(minutes):
+            relation.delete()
+
+    def update_popularity(self, *args, minutes=10):
+        with self.at(minutes):
+            call_command('update_popularity', *args, stdout=StringIO())
+
+    def get_scores(self):
+        return dict(Recipe.objects.values_list('name', 'popularity_score'))
+
+    def test_ordering_by_popularity(self):
+        for user in self.users:
+            self.add(FavouriteRecipe, user, self.second)
+        self.add(ShoppingList, self.users[0], self.first)
+        self.update_popularity()
+
+        scores = self.get_scores()
+        self.assertGreater(scores['Второй'], scores['Первый'])
+        self.assertGreater(scores['Первый'], 0)
+        response = self.get_client().get('/api/recipes/?ordering=popular')
+        self.assertEqual(
+            [recipe['name'] for recipe in response.data['results']],
+            ['Второй', 'Первый']
+        )
+
+    def test_incremental_matches_full(self):
+        self.add(FavouriteRecipe, self.users[0], self.first)
+        self.update_popularity(minutes=10)
+        self.add(FavouriteRecipe, self.users[1], self.first, minutes=20)
+        self.add(ShoppingList, self.users[1], self.second, minutes=20)
+        self.update_popularity(minutes=30)
+        incremental = self.get_scores()
+
+        self.update_popularity('--full', minutes=30)
+
+        for name, score in self.get_scores().items():
+            self.assertAlmostEqual(score, incremental[name])
+
+    def test_removal_lowers_score(self):
+        kept = self.add(FavouriteRecipe, self.users[0], self.first)
+        removed = self.add(FavouriteRecipe, self.users[1], self.first)
+        cart = self.add(ShoppingList, self.users[2], self.first)
+        self.update_popularity(minutes=10)
+        before = self.get_scores()['Первый']
+
+        self.remove(removed, minutes=20)
+        self.update_popularity(minutes=30)
+        after = self.get_scores()['Первый']
+        self.assertLess(after, before)
+
+        self.update_popularity('--full', minutes=30)
+        self.assertAlmostEqual(self.get_scores()['Первый'], after)
+
+        self.remove(kept, minutes=40)
+        self.remove(cart, minutes=40)
+        self.update_popularity(minutes=50)
+        self.assertEqual(self.get_scores()['Первый'], 0)
+
+
+class FeedTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('user')
+        self.authors = [self.create_user(f'author{n}') for n in range(3)]
+        for author in self.authors[:2]:
+            Subscription.objects.create(user=self.user, author=author)
+        now = timezone.now()
+        self.expected = []
+        for number in range(9):
+            author = self.authors[number % 3]
+            recipe = self.create_recipe(author, name=f'Рецепт {number}')
+            # Одинаковое время у пар рецептов проверяет порядок по id
+            Recipe.objects.filter(pk=recipe.pk).update(
+                created_at=now - timedelta(minutes=number // 2)
+            )
+            if author != self.authors[2]:
+                self.expected.append(recipe.pk)
+        self.expected = [
+            pk for _, pk in sorted(
+                Recipe.objects.filter(
+                    pk__in=self.expected
+                ).values_list('created_at', 'pk'),
+                reverse=True
+            )
+        ]
+
+    def test_pages_follow_cursor(self):
+        client = self.get_client(self.user)
+        url = '/api/recipes/feed/?limit=4'
+        seen = []
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 4)
+            seen += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+
+        self.assertEqual(seen, self.expected)
+
+    def test_feed_ids_merge(self):
+        self.assertEqual(
+            get_feed_ids([author.pk for author in self.authors[:2]], 3),
+            self.expected[:3]
+        )
+        self.assertEqual(get_feed_ids([], 3), [])
+
+    def test_subscribed_flag_and_auth(self):
+        response = self.get_client(self.user).get('/api/recipes/feed/')
+        self.assertTrue(all(
+            recipe['author']['is_subscribed']
+            for recipe in response.data['results']
+        ))
+        self.assertEqual(
+            self.get_client().get('/api/recipes/feed/').status_code, 401
+        )
+
+    def test_invalid_cursor(self):
+        response = self.get_client(self.user).get(
+            '/api/recipes/feed/?cursor=broken'
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class SearchTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.in_name = self.create_recipe(
+                self.author, name='Сырники', text='Завтрак из творога'
+            )
+            self.in_text = self.create_recipe(
+                self.author, name='Запеканка', text='Почти как сырники'
+            )
+            self.in_ingredients = self.create_recipe(
+                self.author, [(self.ingredients[1], 200)],
+                name='Каша', text='Просто каша'
+            )
+
+    def search(self, query):
+        response = self.get_client().get(
+            '/api/recipes/', {'search': query, 'limit': 10}
+        )
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_name_ranks_above_text(self):
+        self.assertEqual(
+            self.search('сырники'), [self.in_name.pk, self.in_text.pk]
+        )
+
+    def test_ingredients_are_searchable(self):
+        self.assertEqual(self.search('молоко'), [self.in_ingredients.pk])
+        self.assertEqual(self.search('!!!'), [])
+
+    def test_index_follows_edits(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.in_ingredients.name = 'Омлет'
+            self.in_ingredients.save()
+
+        self.assertEqual(self.search('омлет'), [self.in_ingredients.pk])
+        self.assertEqual(self.search('каша'), [self.in_ingredients.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.in_ingredients.delete()
+        self.assertEqual(self.search('омлет'), [])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Стемминг есть в Postgres')
+    def test_russian_stemming(self):
+        self.assertEqual(
+            self.search('сырник'), [self.in_name.pk, self.in_text.pk]
+        )
+
+
+class WhatToCookTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        author = self.create_user('author')
+        flour, milk, eggs, sugar = self.ingredients
+        self.pancakes = self.create_recipe(
+            author, [(flour, 200), (milk, 300), (eggs, 2)], name='Блины'
+        )
+        self.omelette = self.create_recipe(
+            author, [(milk, 100), (eggs, 3)], name='Омлет'
+        )
+        self.syrup = self.create_recipe(
+            author, [(sugar, 100), (milk, 50)], name='Сироп'
+        )
+        ingredient_index.rebuild()
+
+    def what_to_cook(self, *ingredients, limit=10):
+        response = self.get_client().get('/api/recipes/what-to-cook/', {
+            'ingredients': ','.join(str(item.pk) for item in ingredients),
+            'limit': limit
+        })
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_ranked_by_coverage(self):
+        flour, milk, eggs, sugar = self.ingredients
+        data = self.what_to_cook(milk, eggs)
+
+        self.assertEqual(
+            [(recipe['name'], recipe['coverage']) for recipe in data],
+            [('Омлет', 1.0), ('Блины', 2 / 3), ('Сироп', 0.5)]
+        )
+        self.assertEqual(
+            [item['id'] for item in data[1]['missing_ingredients']],
+            [flour.pk]
+        )
+
+    def test_deleted_elsewhere_does_not_shorten_page(self):
+        _, milk, eggs, _ = self.ingredients
+        # Удаление в другом процессе: индекс этого о нём не знает
+        Recipe.objects.filter(pk=self.omelette.pk).delete()
+
+        data = self.what_to_cook(milk, eggs, limit=2)
+
+        self.assertEqual(
+            [recipe['name'] for recipe in data], ['Блины', 'Сироп']
+        )
+
+    def test_refresh_applies_tombstones(self):
+        _, milk, _, _ = self.ingredients
+        index = IngredientIndex()
+        index.rebuild()
+        Recipe.objects.filter(pk=self.syrup.pk).delete()
+
+        index.refresh()
+
+        self.assertEqual(
+            [recipe_id for recipe_id, _, _ in index.search([milk.pk], 10)],
+            [self.omelette.pk, self.pancakes.pk]
+        )
+
+    def test_refresh_picks_up_edits(self):
+        flour, _, _, sugar = self.ingredients
+        index = IngredientIndex()
+        index.rebuild()
+        RecipeIngredient.objects.create(
+            recipe=self.omelette, ingredient=flour, amount=10
+        )
+        self.omelette.save()
+
+        index.refresh()
+
+        self.assertEqual(
+            index.search([flour.pk, sugar.pk], 10),
+            [
+                (self.syrup.pk, 0.5, [self.ingredients[1].pk]),
+                (self.omelette.pk, 1 / 3, [
+                    self.ingredients[1].pk, self.ingredients[2].pk
+                ]),
+                (self.pancakes.pk, 1 / 3, [
+                    self.ingredients[1].pk, self.ingredients[2].pk
+                ]),
+            ]
+        )
+
+    def test_requires_ingredients(self):
+        response = self.get_client().get('/api/recipes/what-to-cook/')
+        self.assertEqual(response.status_code, 400)
+
+
+class RelatedRecipesTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        author = self.create_user('author')
+        flour, milk, eggs, sugar = self.ingredients
+        self.pancakes = self.create_recipe(
+            author, [(flour, 200), (milk, 300), (eggs, 2)], name='Блины'
+        )
+        self.omelette = self.create_recipe(
+            author, [(milk, 100), (eggs, 3)], name='Омлет'
+        )
+        self.syrup = self.create_recipe(
+            author, [(sugar, 100), (milk, 50)], name='Сироп'
+        )
+
+    def build(self, *args):
+        call_command(
+            'build_related_recipes', '--workers', '1', '--chunk-size', '2',
+            *args, stdout=StringIO()
+        )
+
+    def related(self, recipe):
+        response = self.get_client().get(
+            f'/api/recipes/{recipe.pk}/related/'
+        )
+        self.assertEqual(response.status_code, 200)
+        return [item['name'] for item in response.data]
+
+    def test_ordered_by_similarity(self):
+        self.build()
+
+        self.assertEqual(self.related(self.pancakes), ['Омлет', 'Сироп'])
+        self.assertEqual(self.related(self.syrup), ['Омлет', 'Блины'])
+
+    def test_top_k(self):
+        self.build('--top-k', '1')
+
+        self.assertEqual(self.related(self.pancakes), ['Омлет'])
+        self.assertEqual(
+            RelatedRecipe.objects.filter(recipe=self.pancakes).count(), 1
+        )
+
+    def test_rebuild_replaces_pairs(self):
+        self.build()
+        self.syrup.delete()
+
+        self.build()
+
+        self.assertEqual(self.related(self.pancakes), ['Омлет'])
+
+    def test_workers_give_same_result(self):
+        _, features = build_feature_matrix(RELATED_RECIPES_TAG_WEIGHT)
+
+        sequential = compute_related(features, 2, 1, workers=1)
+        parallel = compute_related(features, 2, 1, workers=2)
+
+        for expected, actual in zip(sequential, parallel):
+            np.testing.assert_allclose(actual, expected)
+
+    def test_empty_for_recipe_without_pairs(self):
+        self.assertEqual(self.related(self.pancakes), [])
+
+    def test_missing_recipe(self):
+        response = self.get_client().get('/api/recipes/0/related/')
+        self.assertEqual(response.status_code, 404)
+
+
+class RecommendationsTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        author = self.create_user('author')
+        self.first, self.second, self.third = (
+            self.create_user(name) for name in ('first', 'second', 'third')
+        )
+        self.pancakes, self.omelette, self.syrup = (
+            self.create_recipe(author, name=name)
+            for name in ('Блины', 'Омлет', 'Сироп')
+        )
+        for user, recipes in (
+            (self.first, (self.pancakes, self.omelette)),
+            (self.second, (self.pancakes, self.omelette, self.syrup)),
+            (self.third, (self.pancakes,)),
+        ):
+            FavouriteRecipe.objects.bulk_create(
+                FavouriteRecipe(user=user, recipe=recipe)
+                for recipe in recipes
+            )
+
+    def build(self, *args):
+        call_command(
+            'build_recommendations', '--workers', '1', '--chunk-size', '2',
+            *args, stdout=StringIO()
+        )
+
+    def recommended(self, user):
+        response = self.get_client(user).get('/api/recipes/recommended/')
+        self.assertEqual(response.status_code, 200)
+        return [item['name'] for item in response.data]
+
+    def test_ordered_by_score(self):
+        self.build()
+
+        self.assertEqual(self.recommended(self.third), ['Омлет', 'Сироп'])
+        self.assertEqual(self.recommended(self.first), ['Сироп'])
+
+    def test_excludes_added_recipes(self):
+        self.build()
+
+        self.assertEqual(self.recommended(self.second), [])
+
+    def test_shopping_cart_counts(self):
+        ShoppingList.objects.create(user=self.third, recipe=self.omelette)
+
+        self.build()
+
+        self.assertEqual(self.recommended(self.third), ['Сироп'])
+
+    def test_top_n(self):
+        self.build('--top-n', '1')
+
+        self.assertEqual(self.recommended(self.third), ['Омлет'])
+
+    def test_requires_authentication(self):
+        response = self.get_client().get('/api/recipes/recommended/')
+        self.assertEqual(response.status_code, 401)
+
+
+# id, которого нет ни у одного объекта
+MISSING_ID = 10 ** 6
+
+
+class BulkTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.user = self.create_user('user')
+        self.client = self.get_client(self.user)
+        self.first = self.create_recipe(self.author, name='Блины')
+        self.second = self.create_recipe(self.author, name='Омлет')
+
+    def statuses(self, response):
+        self.assertEqual(response.status_code, 200)
+        return {
+            item['id']: item['status'] for item in response.data['results']
+        }
+
+    def test_favourites_and_cart(self):
+        for url, model, field in (
+            ('/api/recipes/favorite/bulk/', FavouriteRecipe,
+             'favourites_count'),
+            ('/api/recipes/shopping_cart/bulk/', ShoppingList,
+             'shopping_cart_count'),
+        ):
+            model.objects.create(user=self.user, recipe=self.first)
+            ids = [self.first.pk, self.second.pk, MISSING_ID, self.second.pk]
+
+            response = self.client.post(url, {'ids': ids}, format='json')
+
+            self.assertEqual(self.statuses(response), {
+                self.first.pk: 'exists',
+                self.second.pk: 'created',
+                MISSING_ID: 'not_found',
+            })
+            self.second.refresh_from_db()
+            self.assertEqual(getattr(self.second, field), 1)
+
+            response = self.client.delete(
+                url, {'ids': [self.second.pk, MISSING_ID]}, format='json'
+            )
+
+            self.assertEqual(self.statuses(response), {
+                self.second.pk: 'deleted', MISSING_ID: 'not_found'
+            })
+            self.assertEqual(
+                list(model.objects.values_list('recipe_id', flat=True)),
+                [self.first.pk]
+            )
+            self.second.refresh_from_db()
+            self.assertEqual(getattr(self.second, field), 0)
+
+    def test_subscriptions(self):
+        url = '/api/users/subscribe/bulk/'
+        ids = [self.author.pk, self.user.pk, MISSING_ID]
+
+        response = self.client.post(url, {'ids': ids}, format='json')
+
+        self.assertEqual(self.statuses(response), {
+            self.author.pk: 'created',
+            self.user.pk: 'forbidden',
+            MISSING_ID: 'not_found',
+        })
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.subscribers_count, 1)
+
+        response = self.client.delete(url, {'ids': ids}, format='json')
+
+        self.assertEqual(self.statuses(response), {
+            self.author.pk: 'deleted',
+            self.user.pk: 'not_found',
+            MISSING_ID: 'not_found',
+        })
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.subscribers_count, 0)
+
+    @skipUnless(connection.vendor == 'postgresql', 'RETURNING есть в Postgres')
+    def test_single_insert(self):
+        ids = [
+            self.create_recipe(self.author, name=f'Рецепт {number}').pk
+            for number in range(10)
+        ]
+        with self.assertNumQueries(6):
+            self.client.post(
+                '/api/recipes/favorite/bulk/', {'ids': ids}, format='json'
+            )
+
+    def test_validation(self):
+        url = '/api/recipes/favorite/bulk/'
+        for ids in ([], ['a'], [-1], list(range(1, MAX_BULK_IDS + 2))):
+            with self.subTest(ids=ids[:3]):
+                response = self.client.post(url, {'ids': ids}, format='json')
+                self.assertEqual(response.status_code, 400)
+
+    def test_requires_authentication(self):
+        response = self.get_client().post(
+            '/api/recipes/favorite/bulk/', {'ids': [1]}, format='json'
+        )
+        self.assertEqual(response.status_code, 401)
+
+
+class ConstraintWritesTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.user = self.create_user('user')
+        self.client = self.get_client(self.user)
+        self.recipe = self.create_recipe(self.author)
+
+    def test_duplicate_favourite_and_cart(self):
+        for url, detail in (
+            (f'/api/recipes/{self.recipe.pk}/favorite/', 'избранное'),
+            (f'/api/recipes/{self.recipe.pk}/shopping_cart/',
+             'список покупок'),
+        ):
+            self.assertEqual(self.client.post(url).status_code, 201)
+
+            response = self.client.post(url)
+
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('detail', response.data)
+            # Ошибка уникальности откатывает только точку сохранения
+            self.assertEqual(self.client.delete(url).status_code, 204)
+
+    def test_duplicate_subscription(self):
+        url = f'/api/users/{self.author.pk}/subscribe/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+
+        response = self.client.post(url)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.data['author'], 'Вы уже подписаны на этого пользователя.'
+        )
+        self.assertEqual(Subscription.objects.count(), 1)
+
+    def test_self_subscription(self):
+        response = self.client.post(f'/api/users/{self.user.pk}/subscribe/')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Subscription.objects.exists())
+
+    def test_missing_targets(self):
+        for url in (
+            f'/api/recipes/{MISSING_ID}/favorite/',
+            f'/api/recipes/{MISSING_ID}/shopping_cart/',
+            f'/api/users/{MISSING_ID}/subscribe/',
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.post(url).status_code, 404)
+                self.assertEqual(self.client.delete(url).status_code, 404)
+
+    def test_delete_without_relation(self):
+        for url in (
+            f'/api/recipes/{self.recipe.pk}/favorite/',
+            f'/api/recipes/{self.recipe.pk}/shopping_cart/',
+            f'/api/users/{self.author.pk}/subscribe/',
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.delete(url).status_code, 400)
+
+    def test_delete_without_lookup(self):
+        FavouriteRecipe.objects.create(user=self.user, recipe=self.recipe)
+        Recipe.objects.filter(pk=self.recipe.pk).update(favourites_count=1)
+
+        # Точка сохранения, выборка и удаление связи, запись о её
+        # удалении, счётчик - без отдельного поиска рецепта
+        with self.assertNumQueries(6):
+            response = self.client.delete(
+                f'/api/recipes/{self.recipe.pk}/favorite/'
+            )
+
+        self.assertEqual(response.status_code, 204)
+
+
+class UnitCatalogTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('user')
+
+    def create_ingredients(self, *pairs):
+        return [
+            Ingredient.objects.create(name=name, measurement_unit=unit)
+            for name, unit in pairs
+        ]
+
+    def test_merges_compatible_units(self):
+        grams, kilograms, cans = self.create_ingredients(
+            ('Мука ржаная', 'г'),
+            ('мука  ржаная', 'кг'),
+            ('мука ржаная', 'банка')
+        )
+
+        self.assertEqual(
+            unit_catalog.aggregate([
+                (grams.pk, 500), (kilograms.pk, 1), (cans.pk, 2)
+            ]),
+            [
+                {'name': 'Мука ржаная', 'measurement_unit': 'кг',
+                 'amount': '1.5'},
+                {'name': 'мука ржаная', 'measurement_unit': 'банка',
+                 'amount': '2'},
+            ]
+        )
+
+    def test_keeps_uniform_unit(self):
+        spoons, millilitres = self.create_ingredients(
+            ('масло', 'ст. л.'), ('масло', 'мл')
+        )
+
+        self.assertEqual(
+            unit_catalog.aggregate([(spoons.pk, 2), (spoons.pk, 1)]),
+            [{'name': 'масло', 'measurement_unit': 'ст. л.', 'amount': '3'}]
+        )
+        self.assertEqual(
+            unit_catalog.aggregate([(spoons.pk, 2), (millilitres.pk, 10)]),
+            [{'name': 'масло', 'measurement_unit': 'мл', 'amount': '40'}]
+        )
+
+    def test_aliases(self):
+        self.assertEqual(normalize_unit(' Гр. '), 'г')
+        self.assertEqual(normalize_unit('ст.л.'), 'ст. л.')
+        self.assertEqual(normalize_unit('банка'), 'банка')
+
+    def test_reloads_for_new_ingredient(self):
+        flour = self.ingredients[0]
+        unit_catalog.aggregate([(flour.pk, 1)])
+        grams, = self.create_ingredients(('соль', 'г'))
+
+        self.assertEqual(
+            unit_catalog.aggregate([(grams.pk, 5)]),
+            [{'name': 'соль', 'measurement_unit': 'г', 'amount': '5'}]
+        )
+
+    def test_missing_ingredient(self):
+        with self.assertRaises(Ingredient.DoesNotExist):
+            unit_catalog.aggregate([(MISSING_ID, 1)])
+
+    def test_download(self):
+        grams, kilograms = self.create_ingredients(
+            ('мука ржаная', 'г'), ('мука ржаная', 'кг')
+        )
+        milk = self.ingredients[1]
+        author = self.create_user('author')
+        for recipe in (
+            self.create_recipe(
+                author, [(grams, 300), (milk, 200)]
+            ),
+            self.create_recipe(
+                author, [(kilograms, 2), (milk, 900)], name='Оладьи'
+            ),
+        ):
+            ShoppingList.objects.create(user=self.user, recipe=recipe)
+
+        response = self.get_client(self.user).get(
+            '/api/recipes/download_shopping_cart/'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content).decode()
+        self.assertIn(
+            'Список всех ингредиентов:\n'
+            '  - молоко (л) — 1.1\n'
+            '  - мука ржаная (кг) — 2.3\n',
+            content
+        )
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('user')
+        self.token = Token.objects.create(user=self.user)
+        self.factory = RequestFactory()
+        self.middleware = ReplicaRoutingMiddleware(
+            lambda request: HttpResponse()
+        )
+
+    def token_request(self, method='get'):
+        return getattr(self.factory, method)(
+            '/api/recipes/', HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+
+    def session_request(self, method='get'):
+        self.client.force_login(self.user)
+        request = getattr(self.factory, method)('/admin/')
+        request.session = self.client.session
+        return request
+
+    def route(self, request):
+        """Возвращает алиас, в который ушло чтение во время запроса."""
+        with mock.patch(
+            'api.middleware.set_read_database', wraps=set_read_database
+        ) as set_database:
+            self.middleware(request)
+        return set_database.call_args.args[0]
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.route(self.token_request()), 'replica')
+        self.assertEqual(self.route(self.factory.get('/')), 'replica')
+
+    def test_write_pins_user(self):
+        self.route(self.token_request('post'))
+
+        self.assertIsNone(self.route(self.token_request()))
+        # Закреплён пользователь, а не токен: админка тоже читает
+        # из основной базы
+        self.assertIsNone(self.route(self.session_request()))
+
+    def test_session_write_pins_user(self):
+        self.route(self.session_request('post'))
+
+        self.assertIsNone(self.route(self.token_request()))
+
+    def test_pin_key(self):
+        key = f'replica-pin:user:{self.user.pk}'
+        get_pin_key = ReplicaRoutingMiddleware.get_pin_key
+
+        self.assertEqual(get_pin_key(self.token_request()), key)
+        self.assertEqual(get_pin_key(self.session_request()), key)
+        self.assertIsNone(get_pin_key(self.factory.get('/')))
+        self.assertIsNone(get_pin_key(self.factory.get(
+            '/', HTTP_AUTHORIZATION='Token invalid'
+        )))
+
+    def test_anonymous_write_does_not_pin(self):
+        self.route(self.factory.post('/api/auth/token/login/'))
+
+        self.assertEqual(self.route(self.factory.get('/')), 'replica')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Пул только для Postgres')
+class ConnectionPoolTest(SimpleTestCase):
+    databases = {'default'}
+
+    def create_pool(self, **kwargs):
+        pool = ConnectionPool(**{
+            'min_size': 0,
+            'max_size': 2,
+            'timeout': 1,
+            'health_checks': True,
+            'health_check_idle_seconds': 30,
+            'conn_params': connection.get_connection_params(),
+            **kwargs
+        })
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_fresh_connection_ready_for_django(self):
+        pool = self.create_pool(min_size=1)
+
+        first, second = pool.get(), pool.get()
+
+        # Проверка соединения не оставила транзакцию, на которой
+        # упал бы set_autocommit
+        for pooled in (first, second):
+            self.assertEqual(
+                pooled.info.transaction_status,
+                psycopg2.extensions.TRANSACTION_STATUS_IDLE
+            )
+            pooled.autocommit = True
+            pooled.close()
+
+    def test_keeps_returned_connections(self):
+        pool = self.create_pool()
+        first, second = pool.get(), pool.get()
+        pool.put(first)
+        pool.put(second)
+
+        self.assertIs(pool.get(), second)
+        self.assertIs(pool.get(), first)
+
+    def test_exhausted(self):
+        pool = self.create_pool(max_size=1, timeout=0.01)
+        pool.put(pool.get())
+        pooled = pool.get()
+
+        with self.assertRaises(psycopg2.OperationalError):
+            pool.get()
+        pool.put(pooled)
+
+    def test_checks_only_idle_connections(self):
+        pool = self.create_pool()
+        pooled = pool.get()
+        pool.put(pooled)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_terminate_backend(%s)',
+                [pooled.get_backend_pid()]
+            )
+
+        # Недавно вернувшееся соединение выдаётся без проверки
+        self.assertIs(pool.get(), pooled)
+        pool.put(pooled)
+
+        with mock.patch(
+            'foodgram.db_backends.postgresql_pool.base.monotonic',
+            return_value=monotonic() + 60
+        ):
+            fresh = pool.get()
+
+        self.assertIsNot(fresh, pooled)
+        self.assertTrue(pooled.closed)
+        with fresh.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        pool.put(fresh)
+
+    def test_database_wrapper(self):
+        wrapper = PooledDatabaseWrapper(
+            {**connection.settings_dict, 'CONN_HEALTH_CHECKS': True,
+             'POOL': {'MIN_SIZE': 1, 'MAX_SIZE': 2}},
+            alias='pool_test'
+        )
+        self.addCleanup(lambda: _pools.pop('pool_test').close())
+
+        for _ in range(2):
+            with wrapper.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                self.assertEqual(cursor.fetchone(), (1,))
+            wrapper.close()
+
+        self.assertEqual(len(_pools['pool_test']._idle), 1)
+
+
+@override_settings(THROTTLE_ENABLED=False)
+class AsyncViewsTest(TransactionTestCase):
+    """
+    Асинхронные вьюхи ходят в базу из пула потоков, то есть через другие
+    соединения, поэтому данные должны быть закоммичены.
+    """
+
+    def setUp(self):
+        cache.clear()
+        token_cache.local.clear()
+        unit_catalog.invalidate()
+        # Соединения потоков пула закрываем сразу, а не по CONN_MAX_AGE:
+        # иначе они держат тестовую базу, и её не удалить
+        patcher = mock.patch(
+            'api.async_views.close_old_connections', connections.close_all
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user(
+            username='user', email='user@example.com', password='password'
+        )
+        self.token = Token.objects.create(user=self.user)
+        tag = Tag.objects.create(name='Завтрак', slug='breakfast')
+        flour, milk = (
+            Ingredient.objects.create(name=name, measurement_unit=unit)
+            for name, unit in (('мука', 'г'), ('молоко', 'мл'))
+        )
+        self.recipe = Recipe.objects.create(
+            author=self.user, name='Блины', text='Описание',
+            cooking_time=10, image='recipes/images/test.png'
+        )
+        self.recipe.tags.set([tag])
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe=self.recipe, ingredient=flour, amount=200),
+            RecipeIngredient(recipe=self.recipe, ingredient=milk, amount=300),
+        ])
+        ShoppingList.objects.create(user=self.user, recipe=self.recipe)
+
+    def call(self, view, *args, path='/', **headers):
+        return async_to_sync(view)(self.factory.get(path, **headers), *args)
+
+    def test_lists_match_sync_views(self):
+        client = APIClient()
+        for view, path in (
+            (async_views.tag_list, '/api/tags/'),
+            (async_views.ingredient_list, '/api/ingredients/?name=мо'),
+        ):
+            with self.subTest(path=path):
+                response = self.call(view, path=path)
+
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    json.loads(response.content), client.get(path).json()
+                )
+
+    def test_download_matches_sync_view(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        expected = b''.join(
+            client.get('/api/recipes/download_shopping_cart/')
+        )
+
+        response = self.call(
+            async_views.download_shopping_cart,
+            HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content), expected)
+
+    def test_download_requires_token(self):
+        for headers in ({}, {'HTTP_AUTHORIZATION': 'Token invalid'}):
+            response = self.call(async_views.download_shopping_cart, **headers)
+            self.assertEqual(response.status_code, 401)
+
+    def test_download_validates_servings(self):
+        response = self.call(
+            async_views.download_shopping_cart,
+            path='/?servings=0',
+            HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_redirect_to_recipe(self):
+        response = self.call(
+            redirect_to_recipe_async, self.recipe.short_link
+        )
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, f'/recipes/{self.recipe.pk}/')
+        with self.assertRaises(Http404):
+            self.call(redirect_to_recipe_async, 'missing')
+
+
+class AdminChangelistTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='password'
+        )
+        self.client.force_login(self.admin)
+
+    def add_rows(self, count):
+        flour, milk, _, _ = self.ingredients
+        for number in range(count):
+            author = self.create_user(f'author{User.objects.count()}')
+            self.create_recipe(
+                author, [(flour, 100), (milk, 200)], name=f'Рецепт {number}'
+            )
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context), response
+
+    def test_queries_do_not_depend_on_rows(self):
+        for url in ('/admin/recipes/recipe/', '/admin/users/user/'):
+            with self.subTest(url=url):
+                self.add_rows(2)
+                few, _ = self.count_queries(url)
+                self.add_rows(5)
+                many, _ = self.count_queries(url)
+
+                self.assertEqual(many, few)
+
+    def test_recipe_columns(self):
+        self.add_rows(1)
+
+        _, response = self.count_queries('/admin/recipes/recipe/')
+
+        self.assertContains(response, 'молоко, мука')
+        self.assertContains(response, 'Завтрак')
+
+    def test_recipe_search(self):
+        self.add_rows(1)
+        author = User.objects.get(username='author1')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_recipe(author, name='Сырники')
+
+        for query, expected in (('сырники', 1), ('author1', 2)):
+            with self.subTest(query=query):
+                response = self.client.get(
+                    '/admin/recipes/recipe/', {'q': query}
+                )
+                self.assertEqual(
+                    len(response.context['cl'].result_list), expected
+                )
+
+    @skipUnless(connection.vendor == 'postgresql', 'Статистика Postgres')
+    def test_estimated_count(self):
+        self.add_rows(3)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE recipes_recipe')
+
+        with mock.patch('recipes.paginators.ESTIMATED_COUNT_THRESHOLD', 0):
+            paginator = EstimatedCountPaginator(Recipe.objects.all(), 10)
+            # Одно чтение pg_class вместо COUNT(*)
+            with self.assertNumQueries(1):
+                self.assertEqual(paginator.count, 3)
+
+            paginator = EstimatedCountPaginator(
+                Recipe.objects.filter(name='Рецепт 0'), 10
+            )
+            self.assertEqual(paginator.count, 1)
+
+
+@override_settings(WRITE_BEHIND_TOGGLES=True)
+class WriteBehindTogglesTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('user')
+        self.client = self.get_client(self.user)
+        author = self.create_user('author')
+        self.recipe = self.create_recipe(
+            author, [(self.ingredients[0], 100)]
+        )
+        self.url = f'/api/recipes/{self.recipe.pk}/favorite/'
+
+    def apply(self):
+        call_command(
+            'apply_toggle_events', '--batch-size', '2', stdout=StringIO()
+        )
+
+    def get_recipe(self):
+        return self.client.get(f'/api/recipes/{self.recipe.pk}/').data
+
+    def test_toggle_is_deferred(self):
+        self.assertEqual(self.client.post(self.url).status_code, 201)
+
+        self.assertFalse(FavouriteRecipe.objects.exists())
+        self.assertTrue(self.get_recipe()['is_favorited'])
+        self.assertEqual(self.client.post(self.url).status_code, 400)
+
+        self.apply()
+
+        self.assertFalse(ToggleEvent.objects.exists())
+        self.assertTrue(FavouriteRecipe.objects.filter(
+            user=self.user, recipe=self.recipe
+        ).exists())
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favourites_count, 1)
+
+    def test_pending_removal_overlays_table(self):
+        FavouriteRecipe.objects.create(user=self.user, recipe=self.recipe)
+        Recipe.objects.filter(pk=self.recipe.pk).update(favourites_count=1)
+
+        self.assertEqual(self.client.delete(self.url).status_code, 204)
+
+        self.assertFalse(self.get_recipe()['is_favorited'])
+        self.assertEqual(self.client.delete(self.url).status_code, 400)
+        self.apply()
+        self.assertFalse(FavouriteRecipe.objects.exists())
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favourites_count, 0)
+
+    def test_add_and_remove_cancel_out(self):
+        for _ in range(2):
+            self.client.post(self.url)
+            self.client.delete(self.url)
+        self.assertEqual(ToggleEvent.objects.count(), 4)
+
+        self.apply()
+
+        self.assertFalse(FavouriteRecipe.objects.exists())
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favourites_count, 0)
+
+    def test_bulk(self):
+        url = '/api/recipes/shopping_cart/bulk/'
+        ids = [self.recipe.pk, MISSING_ID]
+
+        response = self.client.post(url, {'ids': ids}, format='json')
+
+        self.assertEqual(
+            [item['status'] for item in response.data['results']],
+            ['created', 'not_found']
+        )
+        self.assertTrue(self.get_recipe()['is_in_shopping_cart'])
+        response = self.client.post(url, {'ids': ids}, format='json')
+        self.assertEqual(response.data['results'][0]['status'], 'exists')
+
+        self.apply()
+
+        self.assertEqual(ShoppingList.objects.count(), 1)
+        response = self.client.delete(url, {'ids': ids}, format='json')
+        self.assertEqual(response.data['results'][0]['status'], 'deleted')
+
+    def test_download_sees_pending(self):
+        self.client.post(f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+
+        response = self.client.get('/api/recipes/download_shopping_cart/')
+
+        self.assertIn(
+            '  - мука (г) — 100\n', b''.join(response).decode()
+        )
+
+
+class ColumnarRendererTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.first = self.create_recipe(self.author, name='Блины')
+        self.second = self.create_recipe(self.author, name='Омлет')
+
+    def get_columnar(self, params=None, media_type=ColumnarJSONRenderer):
+        response = self.get_client().get(
+            '/api/recipes/', {'limit': 10, **(params or {})},
+            HTTP_ACCEPT=media_type.media_type
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], media_type.media_type)
+        if media_type is ColumnarJSONRenderer:
+            return json.loads(response.content)['results']
+        return msgpack.unpackb(response.content)['results']
+
+    def test_nested_objects_interned(self):
+        for renderer in (ColumnarJSONRenderer, ColumnarMessagePackRenderer):
+            with self.subTest(renderer=renderer.__name__):
+                results = self.get_columnar(media_type=renderer)
+
+                self.assertEqual(results['length'], 2)
+                self.assertEqual(results['columns']['name'],
+                                 ['Омлет', 'Блины'])
+                self.assertEqual(results['columns']['author'], [0, 0])
+                self.assertEqual(results['columns']['tags'], [[0], [0]])
+                self.assertEqual(
+                    [item['id'] for item in results['interned']['author']],
+                    [self.author.pk]
+                )
+                self.assertEqual(
+                    [item['slug'] for item in results['interned']['tags']],
+                    ['breakfast']
+                )
+
+    def test_not_expanded_fields_keep_ids(self):
+        results = self.get_columnar({'expand': 'tags'})
+
+        self.assertEqual(
+            results['columns']['author'], [self.author.pk, self.author.pk]
+        )
+        self.assertEqual(results['columns']['tags'], [[0], [0]])
+        self.assertEqual(list(results['interned']), ['tags'])
+
+    def test_to_columns(self):
+        self.assertEqual(
+            to_columns([
+                {'id': 1, 'author': 7, 'tags': []},
+                {'id': 2, 'author': None, 'tags': [3, 4]},
+            ]),
+            {
+                'length': 2,
+                'columns': {
+                    'id': [1, 2], 'author': [7, None], 'tags': [[], [3, 4]]
+                },
+                'interned': {}
+            }
+        )
+        self.assertEqual(
+            to_columns([]), {'length': 0, 'columns': {}, 'interned': {}}
+        )
+
+
+class SparseFieldsTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.recipe = self.create_recipe(
+            self.author, [(self.ingredients[0], 100)]
+        )
+        self.client = self.get_client()
+
+    def get_recipe(self, params):
+        response = self.client.get('/api/recipes/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data['results'][0]
+
+    def test_fields(self):
+        self.assertEqual(
+            set(self.get_recipe({'fields': 'id,name'})), {'id', 'name'}
+        )
+        response = self.client.get(
+            f'/api/recipes/{self.recipe.pk}/', {'fields': 'id, cost'}
+        )
+        self.assertEqual(set(response.data), {'id', 'cost'})
+
+    def test_omit(self):
+        recipe = self.get_recipe({'omit': 'text,image,ingredients'})
+
+        self.assertNotIn('text', recipe)
+        self.assertNotIn('ingredients', recipe)
+        self.assertIn('name', recipe)
+
+    def test_expand(self):
+        recipe = self.get_recipe({'fields': 'author,tags'})
+        self.assertEqual(recipe['author']['id'], self.author.pk)
+        self.assertEqual(recipe['tags'][0]['slug'], 'breakfast')
+
+        recipe = self.get_recipe({'fields': 'author,tags', 'expand': 'tags'})
+        self.assertEqual(recipe['author'], self.author.pk)
+        self.assertEqual(recipe['tags'][0]['slug'], 'breakfast')
+
+        recipe = self.get_recipe({'expand': ''})
+        self.assertEqual(recipe['tags'], [self.tag.pk])
+
+    def test_unknown_fields(self):
+        for params in (
+            {'fields': 'id,password'},
+            {'omit': 'secret'},
+            {'expand': 'ingredients'},
+        ):
+            with self.subTest(params=params):
+                response = self.client.get('/api/recipes/', params)
+                self.assertEqual(response.status_code, 400)
+
+    def test_skips_unrequested_relations(self):
+        with CaptureQueriesContext(connection) as context:
+            self.get_recipe({'fields': 'id,name'})
+
+        # Подсчёт для пагинации и сами рецепты, без тегов и ингредиентов
+        self.assertEqual(len(context), 2)
+        self.assertNotIn('"text"', context[-1]['sql'])
+
+
+class BatchTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.create_user('author')
+        self.user = self.create_user('user')
+        self.first = self.create_recipe(self.author, name='Блины')
+        self.second = self.create_recipe(self.author, name='Омлет')
+
+    def get_batch(self, url, ids, client=None):
+        response = (client or self.get_client()).get(
+            url, {'ids': ','.join(str(pk) for pk in ids)}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_recipes_in_requested_order(self):
+        data = self.get_batch(
+            '/api/recipes/',
+            [self.second.pk, MISSING_ID, self.first.pk, self.second.pk]
+        )
+
+        self.assertEqual(
+            [recipe['name'] for recipe in data['results']],
+            ['Омлет', 'Блины']
+        )
+        self.assertEqual(data['missing'], [MISSING_ID])
+
+    def test_recipes_respect_fields(self):
+        response = self.get_client().get(
+            '/api/recipes/', {'ids': self.first.pk, 'fields': 'id,name'}
+        )
+
+        self.assertEqual(
+            response.data['results'], [{'id': self.first.pk, 'name': 'Блины'}]
+        )
+
+    def test_users(self):
+        Subscription.objects.create(user=self.user, author=self.author)
+
+        data = self.get_batch(
+            '/api/users/', [self.author.pk, self.user.pk],
+            client=self.get_client(self.user)
+        )
+
+        self.assertEqual(
+            [(user['username'], user['is_subscribed'])
+             for user in data['results']],
+            [('author', True), ('user', False)]
+        )
+
+    def test_queries_do_not_depend_on_size(self):
+        # Рецепты, их теги и ингредиенты - по запросу на всю пачку
+        with self.assertNumQueries(3):
+            self.get_batch('/api/recipes/', [self.first.pk])
+        with self.assertNumQueries(3):
+            self.get_batch(
+                '/api/recipes/', [self.first.pk, self.second.pk]
+            )
+
+    def test_validation(self):
+        for ids in (
+            'a,b', '0', str(2 ** 63),
+            ','.join(str(pk) for pk in range(1, MAX_BULK_IDS + 2)),
+        ):
+            with self.subTest(ids=ids[:20]):
+                response = self.get_client().get(
+                    '/api/recipes/', {'ids': ids}
+                )
+                self.assertEqual(response.status_code, 400)
+
+
+@mock.patch('recipes.sync.SYNC_LAG_SECONDS', 0)
+class SyncTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('user')
+        self.author = self.create_user('author')
+        self.client = self.get_client(self.user)
+        self.own = self.create_recipe(self.user, name='Свой')
+        self.favourite = self.create_recipe(self.author, name='Избранный')
+        self.client.post(f'/api/recipes/{self.favourite.pk}/favorite/')
+
+    def sync(self, since=None):
+        response = self.client.get(
+            '/api/sync/', {'since': since} if since else {}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_full_state(self):
+        data = self.sync()
+
+        self.assertTrue(data['reset'])
+        self.assertEqual(
+            sorted(recipe['name'] for recipe in data['recipes']['updated']),
+            ['Избранный', 'Свой']
+        )
+        self.assertEqual(data['favorites']['added'], [self.favourite.pk])
+        self.assertEqual(data['shopping_cart']['added'], [])
+
+    def test_no_changes(self):
+        token = self.sync()['token']
+
+        # Удаления, изменённые рецепты и по запросу на каждую связь
+        with self.assertNumQueries(5):
+            data = self.sync(token)
+
+        self.assertFalse(data['reset'])
+        self.assertEqual(data['recipes'], {'updated': [], 'deleted': []})
+        for name in ('favorites', 'shopping_cart', 'subscriptions'):
+            self.assertEqual(data[name], {'added': [], 'deleted': []})
+
+    def test_changes_since_token(self):
+        token = self.sync()['token']
+        self.client.delete(f'/api/recipes/{self.favourite.pk}/favorite/')
+        self.client.post(f'/api/recipes/{self.favourite.pk}/shopping_cart/')
+        self.client.post(f'/api/users/{self.author.pk}/subscribe/')
+        Recipe.objects.filter(pk=self.own.pk).delete()
+
+        data = self.sync(token)
+
+        self.assertEqual(data['favorites'], {
+            'added': [], 'deleted': [self.favourite.pk]
+        })
+        self.assertEqual(data['shopping_cart']['added'], [self.favourite.pk])
+        self.assertEqual(data['subscriptions']['added'], [self.author.pk])
+        self.assertEqual(data['recipes']['deleted'], [self.own.pk])
+        self.assertEqual(
+            [recipe['name'] for recipe in data['recipes']['updated']],
+            ['Избранный']
+        )
+        self.assertEqual(self.sync(data['token'])['recipes']['deleted'], [])
+
+    def test_other_users_deletions_hidden(self):
+        token = self.sync()['token']
+        other = self.create_user('other')
+        FavouriteRecipe.objects.create(user=other, recipe=self.own)
+        FavouriteRecipe.objects.filter(user=other).delete()
+
+        self.assertEqual(self.sync(token)['favorites']['deleted'], [])
+
+    def test_expired_token(self):
+        token = encode_token(timezone.now() - timedelta(
+            days=SYNC_TOMBSTONE_RETENTION_DAYS + 1
+        ))
+
+        self.assertTrue(self.sync(token)['reset'])
+
+    def test_invalid_token(self):
+        response = self.client.get('/api/sync/', {'since': 'invalid'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_requires_authentication(self):
+        self.assertEqual(self.get_client().get('/api/sync/').status_code, 401)
+
+
+@skipUnless(
+    connection.vendor == 'postgresql', 'LISTEN/NOTIFY есть только в Postgres'
+)
+class PostgresBrokerTest(TransactionTestCase):
+    """Слушатель брокера получает уведомления по своему соединению."""
+
+    def setUp(self):
+        self.broker = PostgresBroker()
+        self.addCleanup(self.broker.close)
+
+    def receive(self, topics, action):
+        async def receive():
+            subscriber = self.broker.subscribe(topics)
+            await sync_to_async(action)()
+            message = await asyncio.wait_for(subscriber.get(), 5)
+            return message, subscriber.overflowed
+
+        return async_to_sync(receive)()
+
+    def test_publish_reaches_subscribers(self):
+        def publish():
+            self.broker.publish('author:2', {'event': 'recipe', 'id': 2})
+            self.broker.publish('author:1', {'event': 'recipe', 'id': 1})
+
+        message, overflowed = self.receive({'author:1'}, publish)
+
+        self.assertEqual(message, {'event': 'recipe', 'id': 1})
+        self.assertFalse(overflowed)
+
+    def test_reconnect_marks_subscribers_lost(self):
+        def disconnect_listener():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT pg_terminate_backend(pid) FROM pg_stat_activity '
+                    'WHERE query = %s', [f'LISTEN {PostgresBroker.channel}']
+                )
+
+        message, overflowed = self.receive({'author:1'}, disconnect_listener)
+
+        self.assertIsNone(message)
+        self.assertTrue(overflowed)
+
+
+class EventsTest(TransactionTestCase):
+    """
+    Поток событий проверяется целиком: ASGI-приложение получает
+    поддельные receive и send, а уведомления рассылает LocalBroker.
+    """
+
+    def setUp(self):
+        cache.clear()
+        token_cache.local.clear()
+        patcher = mock.patch(
+            'api.async_views.close_old_connections', connections.close_all
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user, self.author = (
+            User.objects.create_user(
+                username=name, email=f'{name}@example.com',
+                password='password'
+            )
+            for name in ('user', 'author')
+        )
+        self.token = Token.objects.create(user=self.user)
+
+    def create_recipe(self):
+        return Recipe.objects.create(
+            author=self.author, name='Блины', text='Описание',
+            cooking_time=10, image='recipes/images/test.png'
+        )
+
+    def stream(self, scenario):
+        """Открывает поток, выполняет scenario и возвращает события."""
+        async def run():
+            disconnected = asyncio.Event()
+            sent = []
+
+            async def receive():
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+
+            async def wait_for_events(count):
+                for _ in range(500):
+                    if len(get_events()) >= count:
+                        return
+                    await asyncio.sleep(0.01)
+                self.fail(f'Событий меньше {count}: {get_events()}')
+
+            def get_events():
+                return [
+                    line.split(': ', 1)[1]
+                    for message in sent[1:]
+                    for line in message['body'].decode().splitlines()
+                    if line.startswith('event: ')
+                ]
+
+            stream = asyncio.ensure_future(events_application({
+                'type': 'http',
+                'method': 'GET',
+                'headers': [
+                    (b'authorization', f'Token {self.token.key}'.encode())
+                ],
+                'query_string': b'',
+            }, receive, send))
+            while len(sent) < 2:
+                await asyncio.sleep(0.01)
+            try:
+                await scenario(
+                    broker._subscribers[user_topic(self.user.pk)].copy().pop(),
+                    wait_for_events
+                )
+            finally:
+                disconnected.set()
+                await stream
+
+            return get_events()
+
+        return async_to_sync(run)()
+
+    def test_subscription_changes_are_not_sent(self):
+        async def scenario(subscriber, wait_for_events):
+            subscription = await sync_to_async(Subscription.objects.create)(
+                user=self.user, author=self.author
+            )
+            while author_topic(self.author.pk) not in subscriber.topics:
+                await asyncio.sleep(0.01)
+            await sync_to_async(self.create_recipe)()
+            await wait_for_events(1)
+            await sync_to_async(subscription.delete)()
+            while author_topic(self.author.pk) in subscriber.topics:
+                await asyncio.sleep(0.01)
+
+        self.assertEqual(self.stream(scenario), ['recipe'])
+
+    def test_overflow_rereads_subscriptions(self):
+        async def scenario(subscriber, wait_for_events):
+            # Уведомление о подписке потеряно
+            with mock.patch.object(broker, 'publish'):
+                await sync_to_async(Subscription.objects.create)(
+                    user=self.user, author=self.author
+                )
+            # Устаревшее уведомление в очереди не должно её отменить
+            subscriber.put({
+                'event': 'unsubscribed', 'data': {'author': self.author.pk}
+            })
+            for _ in range(subscriber.queue.maxsize):
+                subscriber.put({'event': 'recipe', 'data': {}})
+            await wait_for_events(1)
+            await sync_to_async(self.create_recipe)()
+            await wait_for_events(2)
+
+        self.assertEqual(
+            self.stream(scenario), ['resync', 'recipe']
+        )
+
+    def connect(self, query):
+        """Подключается к потоку и сразу отключается, возвращает статус."""
+        sent = []
+
+        async def receive():
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        async_to_sync(events_application)({
+            'type': 'http',
+            'method': 'GET',
+            'headers': [],
+            'query_string': query.encode(),
+        }, receive, send)
+
+        return sent[0]['status']
+
+    def get_ticket(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post('/api/events/ticket/')
+        self.assertEqual(response.status_code, 201)
+
+        return response.json()['ticket']
+
+    def test_ticket_is_single_use(self):
+        ticket = self.get_ticket()
+
+        self.assertEqual(self.connect(f'ticket={ticket}'), 200)
+        self.assertEqual(self.connect(f'ticket={ticket}'), 401)
+
+    def test_ticket_expires(self):
+        with mock.patch(
+            'django.core.signing.time.time',
+            return_value=time() - EVENTS_TICKET_SECONDS - 1
+        ):
+            ticket = self.get_ticket()
+
+        self.assertEqual(self.connect(f'ticket={ticket}'), 401)
+
+    def test_token_in_url_is_rejected(self):
+        self.assertEqual(self.connect(f'token={self.token.key}'), 401)
+        self.assertEqual(
+            APIClient().post('/api/events/ticket/').status_code, 401
+        )
+
+
+class NutritionTest(APITestCase):
+    """Итоги рецептов пересчитываются после коммита, см. on_commit."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.flour, cls.milk, cls.eggs, cls.sugar = cls.ingredients
+        Ingredient.objects.filter(pk=cls.flour.pk).update(
+            calories=350, proteins=10, fats=1, carbohydrates=70, price=60
+        )
+        Ingredient.objects.filter(pk=cls.eggs.pk).update(
+            calories=70, proteins=6, fats=5, carbohydrates=0.5, price=10
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('user')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe = self.create_recipe(
+                self.user, [(self.flour, 200), (self.eggs, 2)]
+            )
+
+    def get_totals(self):
+        response = self.get_client().get(f'/api/recipes/{self.recipe.pk}/')
+        return {
+            field: response.json()[field]
+            for field in Ingredient.nutrition_fields.values()
+        }
+
+    def test_recipe_totals(self):
+        self.assertEqual(self.get_totals(), {
+            'calories': 840, 'proteins': 32, 'fats': 12,
+            'carbohydrates': 141, 'cost': 140
+        })
+
+    def test_unknown_value_leaves_total_empty(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            RecipeIngredient.objects.create(
+                recipe=self.recipe, ingredient=self.milk, amount=100
+            )
+
+        self.assertEqual(
+            self.get_totals(),
+            dict.fromkeys(Ingredient.nutrition_fields.values())
+        )
+
+    def test_ingredient_edit_refreshes_totals(self):
+        self.flour.calories = 400
+        with self.captureOnCommitCallbacks(execute=True):
+            self.flour.save()
+
+        self.assertEqual(self.get_totals()['calories'], 940)
+
+    def test_import_updates_only_present_fields(self):
+        path = os.path.join(self.media_root, 'nutrition.json')
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump([
+                {'name': 'мука', 'measurement_unit': 'г', 'price': 80},
+                {'name': 'яйца', 'measurement_unit': 'шт.', 'calories': 80},
+            ], file)
+
+        call_command(
+            'import_ingredients_json', '--file', path, stdout=StringIO()
+        )
+
+        self.flour.refresh_from_db()
+        self.eggs.refresh_from_db()
+        self.assertEqual((self.flour.calories, self.flour.price), (350, 80))
+        self.assertEqual((self.eggs.calories, self.eggs.price), (80, 10))
+        totals = self.get_totals()
+        self.assertEqual((totals['calories'], totals['cost']), (860, 180))
+
+    def test_shopping_cart_totals(self):
+        client = self.get_client(self.user)
+        client.post(f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+
+        content = b''.join(
+            client.get('/api/recipes/download_shopping_cart/')
+        ).decode()
+
+        self.assertIn('Калорийность, ккал: 840\n', content)
+        self.assertIn('Стоимость, руб.: 140\n', content)
+
+
+class ServingsTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('user')
+        self.flour, self.milk, self.eggs, self.sugar = self.ingredients
+        self.recipe = self.create_recipe(
+            self.user, [(self.flour, 200), (self.eggs, 3)], servings=2
+        )
+
+    def get_ingredients(self, servings):
+        response = self.get_client().get(
+            f'/api/recipes/{self.recipe.pk}/?servings={servings}'
+        )
+        self.assertEqual(response.status_code, 200)
+        return [
+            (item['name'], item['measurement_unit'], item['amount'])
+            for item in response.json()['ingredients']
+        ]
+
+    def test_amounts_are_scaled_and_rounded(self):
+        self.assertEqual(self.get_ingredients(3), [
+            ('мука', 'г', 300), ('яйца', 'шт.', 4.5)
+        ])
+        self.assertEqual(self.get_ingredients(1), [
+            ('мука', 'г', 100), ('яйца', 'шт.', 1.5)
+        ])
+
+    def test_invalid_servings(self):
+        for servings in ('0', 'abc', '1:x'):
+            with self.subTest(servings=servings):
+                response = self.get_client().get(
+                    f'/api/recipes/{self.recipe.pk}/?servings={servings}'
+                )
+                self.assertEqual(response.status_code, 400)
+
+    def test_ingredient_edit_invalidates_cache(self):
+        self.get_ingredients(4)
+        self.flour.name = 'мука пшеничная'
+        self.flour.measurement_unit = 'кг'
+        self.flour.save()
+
+        self.assertEqual(self.get_ingredients(4)[0], (
+            'мука пшеничная', 'кг', 400
+        ))
+
+    def test_recipe_edit_invalidates_cache(self):
+        self.get_ingredients(4)
+        RecipeIngredient.objects.filter(
+            recipe=self.recipe, ingredient=self.flour
+        ).update(amount=100)
+        self.recipe.save()
+
+        self.assertEqual(self.get_ingredients(4)[0], ('мука', 'г', 200))
+
+    def test_shopping_cart_per_recipe_servings(self):
+        other = self.create_recipe(
+            self.user, [(self.flour, 50)], name='Оладьи'
+        )
+        client = self.get_client(self.user)
+        for recipe in (self.recipe, other):
+            client.post(f'/api/recipes/{recipe.pk}/shopping_cart/')
+
+        content = b''.join(client.get(
+            '/api/recipes/download_shopping_cart/'
+            f'?servings=4,{other.pk}:2'
+        )).decode()
+
+        self.assertIn('  - мука (г) — 500\n', content)
+        self.assertIn('  - яйца (шт.) — 6\n', content)
+
+
+class MealPlanTest(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user('user')
+        self.client = self.get_client(self.user)
+        self.flour, self.milk, self.eggs, self.sugar = self.ingredients
+        self.recipe = self.create_recipe(
+            self.user, [(self.flour, 200), (self.eggs, 2)], servings=2
+        )
+        self.other = self.create_recipe(
+            self.user, [(self.flour, 100)], name='Оладьи'
+        )
+        response = self.client.post('/api/meal-plans/', {'name': 'Неделя'})
+        self.assertEqual(response.status_code, 201)
+        self.plan = MealPlan.objects.get(pk=response.json()['id'])
+
+    def add_entry(self, date, recipe, **data):
+        response = self.client.post(
+            f'/api/meal-plans/{self.plan.pk}/entries/',
+            {'date': date, 'recipe': recipe.pk, **data}
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def download(self, query=''):
+        response = self.client.get(
+            f'/api/meal-plans/{self.plan.pk}/download_shopping_list/{query}'
+        )
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_shopping_list_for_period(self):
+        self.add_entry('2026-10-19', self.recipe, servings=4)
+        self.add_entry('2026-10-20', self.other, servings=2)
+        entry = self.add_entry('2026-10-21', self.recipe)
+
+        self.assertEqual(entry['servings'], 2)
+        content = self.download('?start=2026-10-19&end=2026-10-20')
+        self.assertIn('Дата: 19.10.2026\n', content)
+        self.assertNotIn('Дата: 21.10.2026\n', content)
+        self.assertIn('  - мука (г) — 600\n', content)
+        self.assertIn('  - яйца (шт.) — 4\n', content)
+        content = self.download()
+        self.assertIn('  - мука (г) — 800\n', content)
+        self.assertIn('  - яйца (шт.) — 6\n', content)
+
+    def test_repeat_download_is_cached(self):
+        self.add_entry('2026-10-19', self.recipe)
+        self.download()
+        hits = metrics.snapshot().get('meal_plan_shopping_list.hit', 0)
+
+        self.download()
+
+        self.assertEqual(
+            metrics.snapshot()['meal_plan_shopping_list.hit'], hits + 1
+        )
+
+    def test_changes_rebuild_cached_list(self):
+        entry = self.add_entry('2026-10-19', self.recipe)
+        self.assertIn('  - мука (г) — 200\n', self.download())
+
+        self.add_entry('2026-10-20', self.other)
+        self.assertIn('  - мука (г) — 300\n', self.download())
+
+        self.client.delete(
+            f'/api/meal-plans/{self.plan.pk}/entries/{entry["id"]}/'
+        )
+        self.assertIn('  - мука (г) — 100\n', self.download())
+
+        RecipeIngredient.objects.filter(recipe=self.other).update(amount=50)
+        self.other.save()
+        self.assertIn('  - мука (г) — 50\n', self.download())
+
+        self.flour.measurement_unit = 'кг'
+        # Справочник единиц перечитывается после коммита
+        with self.captureOnCommitCallbacks(execute=True):
+            self.flour.save()
+        self.assertIn('  - мука (кг) — 50\n', self.download())
+
+    def test_saving_plan_keeps_version(self):
+        stale = MealPlan.objects.get(pk=self.plan.pk)
+        self.add_entry('2026-10-19', self.recipe)
+        version = MealPlan.objects.get(pk=self.plan.pk).version
+        self.assertGreater(version, stale.version)
+
+        stale.name = 'Выходные'
+        stale.save()
+        response = self.client.patch(
+            f'/api/meal-plans/{self.plan.pk}/', {'name': 'Праздники'}
+        )
+
+        self.assertEqual(response.json()['version'], version)
+        self.plan.refresh_from_db()
+        self.assertEqual(
+            (self.plan.name, self.plan.version), ('Праздники', version)
+        )
+
+    def test_plans_are_private(self):
+        client = self.get_client(self.create_user('other'))
+
+        self.assertEqual(
+            client.get(f'/api/meal-plans/{self.plan.pk}/').status_code, 404
+        )
+        self.assertEqual(client.get('/api/meal-plans/').json()['results'], [])
+
+
+THROTTLE_SETTINGS = {
+    'CACHES': {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'throttling-tests',
+        }
+    },
+    'THROTTLE_ENABLED': True,
+    'THROTTLE_RATES': {
+        'anon': '5/min',
+        'user': '10/min',
+        'things.list': '2/min',
+        'short_link': '2/min',
+    },
+}
+
+
+class ThrottlingTestMixin:
+    """
+    Свежий счётчик и свой лимитер на каждый тест, время - от начала
+    минутного окна.
+    """
+
+    lease_size = 10
+
+    def setUp(self):
+        super().setUp()
+        settings_override = override_settings(**THROTTLE_SETTINGS)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.now = 600.0
+        for patcher in (
+            mock.patch.object(throttling, 'time', lambda: self.now),
+            mock.patch.object(
+                throttling, 'limiter', SlidingWindowLimiter(self.lease_size)
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        cache.clear()
+
+
+class SlidingWindowLimiterTest(ThrottlingTestMixin, SimpleTestCase):
+
+    def consume(self, limiter=None, rate=(3, 60)):
+        limiter = limiter or throttling.limiter
+        return limiter.consume('scope', 'ip:127.0.0.1', rate)
+
+    def test_rejects_over_capacity_until_retry_after(self):
+        for _ in range(3):
+            self.assertIsNone(self.consume())
+
+        # В следующем окне прошлое весит 3, а нужно не больше 2:
+        # через треть окна после его начала
+        self.assertEqual(self.consume(), 80)
+        self.now += 45
+        self.assertEqual(self.consume(), 35)
+        self.now += 34
+        self.assertIsNotNone(self.consume())
+        self.now += 1
+        self.assertIsNone(self.consume())
+        self.assertIsNotNone(self.consume())
+
+    def test_allowance_recovers_after_two_windows(self):
+        for _ in range(3):
+            self.consume()
+        self.assertIsNotNone(self.consume())
+
+        self.now += 120
+        for _ in range(3):
+            self.assertIsNone(self.consume())
+        self.assertIsNotNone(self.consume())
+
+    def test_no_double_allowance_at_window_boundary(self):
+        self.now += 59
+        allowed = sum(
+            self.consume(rate=(100, 60)) is None for _ in range(150)
+        )
+        self.assertEqual(allowed, 100)
+
+        # Прошлое окно ещё целиком в оценке
+        self.now += 1
+        self.assertIsNotNone(self.consume(rate=(100, 60)))
+        # Через полокна от него осталась половина
+        self.now += 30
+        allowed = sum(
+            self.consume(rate=(100, 60)) is None for _ in range(150)
+        )
+        self.assertEqual(allowed, 50)
+
+    def test_rejected_client_does_not_reach_cache(self):
+        for _ in range(4):
+            self.consume()
+
+        with mock.patch.object(throttling, 'cache') as shared_cache:
+            for _ in range(10):
+                self.assertIsNotNone(self.consume())
+                self.now += 1
+
+        self.assertEqual(shared_cache.mock_calls, [])
+
+    def test_single_process_gets_whole_capacity(self):
+        allowed = sum(
+            self.consume(rate=(100, 60)) is None for _ in range(150)
+        )
+
+        self.assertEqual(allowed, 100)
+
+    def test_leases_never_exceed_capacity(self):
+        # Несколько процессов со своими пачками и общим счётчиком
+        limiters = [SlidingWindowLimiter(self.lease_size) for _ in range(7)]
+        allowed = 0
+        for _ in range(100):
+            for limiter in limiters:
+                allowed += self.consume(limiter, (100, 60)) is None
+
+        self.assertLessEqual(allowed, 100)
+        self.assertGreater(allowed, 0)
+
+
+class ThingViewSet(viewsets.ViewSet):
+    authentication_classes = ()
+    permission_classes = ()
+    throttle_classes = (SlidingWindowThrottle,)
+    throttle_scope = 'things'
+
+    def list(self, request):
+        return Response([])
+
+    def retrieve(self, request, pk):
+        return Response({})
+
+
+class SlidingWindowThrottleTest(ThrottlingTestMixin, SimpleTestCase):
+
+    def get(self, action):
+        view = ThingViewSet.as_view({'get': action})
+        kwargs = {'pk': 1} if action == 'retrieve' else {}
+        return view(APIRequestFactory().get('/things/'), **kwargs)
+
+    def test_action_rate_overrides_anon_rate(self):
+        self.assertEqual(get_rate('things.list', 'anon'), (2, 60))
+        self.assertEqual(get_rate('things.retrieve', 'anon'), (5, 60))
+        self.assertEqual(get_rate('things.retrieve', 'user'), (10, 60))
+
+        for _ in range(2):
+            self.assertEqual(self.get('list').status_code, 200)
+        response = self.get('list')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '90')
+
+        # У другого действия свой, общий для анонимов лимит
+        for _ in range(5):
+            self.assertEqual(self.get('retrieve').status_code, 200)
+        self.assertEqual(self.get('retrieve').status_code, 429)
+
+    @override_settings(THROTTLE_ENABLED=False)
+    def test_disabled(self):
+        for _ in range(5):
+            self.assertEqual(self.get('list').status_code, 200)
+
+
+@throttle('short_link')
+def sync_view(request):
+    return HttpResponse('ok')
+
+
+@throttle('short_link')
+async def async_view(request):
+    return HttpResponse('ok')
+
+
+class ThrottleDecoratorTest(ThrottlingTestMixin, SimpleTestCase):
+
+    def check_view(self, view):
+        for _ in range(2):
+            self.assertEqual(view(RequestFactory().get('/')).status_code, 200)
+        response = view(RequestFactory().get('/'))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '90')
+
+        self.now += 90
+        self.assertEqual(view(RequestFactory().get('/')).status_code, 200)
+
+    def test_sync_view(self):
+        self.check_view(sync_view)
+
+    def test_async_view(self):
+        self.check_view(async_to_sync(async_view))
+
+    def test_clients_limited_separately(self):
+        for _ in range(2):
+            sync_view(RequestFactory().get('/'))
+        response = sync_view(
+            RequestFactory().get('/', REMOTE_ADDR='10.0.0.2')
+        )
+
+        self.assertEqual(response.status_code, 200)
+
+
+class RequestIdentTest(ThrottlingTestMixin, TestCase):
+
+    def get_ident(self, **headers):
+        return get_request_ident(RequestFactory().get('/', **headers))
+
+    def test_valid_token_limits_user(self):
+        user = User.objects.create_user(
+            username='user', email='user@example.com', password='password'
+        )
+        token = Token.objects.create(user=user)
+
+        self.assertEqual(
+            self.get_ident(HTTP_AUTHORIZATION=f'Token {token.key}'),
+            ('user', f'user:{user.pk}')
+        )
+
+    def test_invalid_tokens_share_ip_limit(self):
+        for key in ('junk1', 'junk2', 'junk 3'):
+            self.assertEqual(
+                self.get_ident(HTTP_AUTHORIZATION=f'Token {key}'),
+                ('anon', 'ip:127.0.0.1')
+            )
+
+        for key in ('junk1', 'junk2'):
+            sync_view(RequestFactory().get(
+                '/', HTTP_AUTHORIZATION=f'Token {key}'
+            ))
+        response = sync_view(RequestFactory().get(
+            '/', HTTP_AUTHORIZATION='Token junk3'
+        ))
+        self.assertEqual(response.status_code, 429)
+
+    def test_forwarded_for_from_proxy(self):
+        self.assertEqual(
+            self.get_ident(HTTP_X_FORWARDED_FOR='203.0.113.7, 10.0.0.1'),
+            ('anon', 'ip:10.0.0.1')
+        )
+        self.assertEqual(
+            self.get_ident(HTTP_X_FORWARDED_FOR='203.0.113.7'),
+            ('anon', 'ip:203.0.113.7')
+        )
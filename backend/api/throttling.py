@@ -0,0 +1,284 @@
+"""
+Ограничение частоты запросов по пользователю или IP.
+
+Лимит считается скользящим окном по двум соседним окнам длиной period
+секунд (отсчитываются от начала эпохи): счётчик прошлого окна берётся
+с весом оставшейся от него доли, то есть оценка числа запросов за
+последние period секунд - prev * (1 - elapsed / period) + current.
+Запрос разрешён, пока оценка меньше capacity, поэтому на стыке окон
+клиент не получает двойной лимит. Счётчики общие для всех воркеров
+и лежат в кэше. Чтобы не ходить в кэш на каждый запрос, процесс
+берёт разрешения у счётчика текущего окна пачками по
+THROTTLE_LEASE_SIZE (один атомарный incr на пачку, счётчик прошлого
+окна читается раз за окно) и расходует их локально. Невыбранные
+разрешения пачки пропадают, так что лимит может только немного
+недодать, но не превысить. Отказ тоже запоминается в процессе до
+конца Retry-After: клиент, который продолжает слать запросы, не
+нагружает общий кэш.
+
+Лимиты задаются в THROTTLE_RATES в виде "число/период" (s, min,
+hour, day): для действия вьюсета - по ключу "<throttle_scope или
+basename>.<действие>", например "recipes.list", иначе общие "user"
+и "anon". None - без ограничений.
+"""
+import asyncio
+import threading
+from functools import lru_cache, wraps
+from math import ceil, floor
+from time import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+from rest_framework.exceptions import AuthenticationFailed, Throttled
+from rest_framework.throttling import BaseThrottle
+
+from api import metrics
+from api.authentication import CachedTokenAuthentication
+from api.cache import LocalTTLCache
+
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    """Разбирает "число/период" в (запросов за окно, длина окна в секундах)."""
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+
+def get_rate(scope, kind):
+    """Лимит для scope, а если его нет - общий для user или anon."""
+    rates = settings.THROTTLE_RATES
+    rate = rates[scope] if scope in rates else rates.get(kind)
+
+    return None if rate is None else parse_rate(rate)
+
+
+class SlidingWindowLimiter:
+    """
+    Выдаёт разрешения на запросы из общих счётчиков окон в кэше
+    пачками и хранит остаток пачки и отказы в памяти процесса.
+    """
+
+    key_prefix = 'throttle'
+
+    def __init__(self, lease_size):
+        self.lease_size = lease_size
+        self._lock = threading.Lock()
+        # Ключ -> (окно, остаток пачки, счётчик прошлого окна)
+        self._leases = LocalTTLCache(ttl=60)
+        # Ключ -> когда клиенту снова можно делать запросы
+        self._rejections = LocalTTLCache(ttl=60)
+
+    def get_retry_after(self, now, window, rate, previous, current):
+        """
+        Через сколько секунд оценка опустится до capacity - 1, если
+        новых запросов не будет.
+        """
+        capacity, period = rate
+        start = window * period
+        if current < capacity:
+            # Ждём, пока уменьшится вес прошлого окна
+            at = start + period * (1 - (capacity - 1 - current) / previous)
+        else:
+            # Ждём следующего окна, где текущее станет прошлым
+            at = start + period * (2 - (capacity - 1) / current)
+
+        return max(1, ceil(at - now))
+
+    def consume(self, scope, ident, rate):
+        """
+        Засчитывает запрос клиента ident. Возвращает None, если запрос
+        разрешён, иначе через сколько секунд стоит повторить запрос.
+        """
+        capacity, period = rate
+        now = time()
+        window = int(now // period)
+        key = f'{self.key_prefix}:{scope}:{ident}'
+
+        with self._lock:
+            allowed_at = self._rejections.get(key)
+            if allowed_at is not None and now < allowed_at:
+                metrics.increment('throttle.throttled')
+                metrics.increment(f'throttle.throttled.{scope}')
+                return max(1, ceil(allowed_at - now))
+            lease = self._leases.get(key)
+            if lease is not None and lease[0] == window and lease[1] > 0:
+                self._leases.set(key, (window, lease[1] - 1, lease[2]), period)
+                return None
+
+        if lease is not None and lease[0] == window:
+            previous = lease[2]
+        else:
+            # Прошлое окно закрыто, поэтому его счётчик читаем раз за окно
+            previous = cache.get(f'{key}:{window - 1}', 0)
+
+        # Пачка не больше десятой части лимита, иначе один процесс
+        # выберет почти весь лимит маленького окна
+        size = max(1, min(self.lease_size, capacity // 10))
+        shared_key = f'{key}:{window}'
+        # Счётчик нужен и в следующем окне как прошлый
+        cache.add(shared_key, 0, 2 * period)
+        try:
+            issued = cache.incr(shared_key, size)
+        except ValueError:
+            # Счётчик вытеснили из кэша между add и incr
+            cache.set(shared_key, size, 2 * period)
+            issued = size
+        metrics.increment('throttle.leases')
+
+        weight = previous * (1 - (now - window * period) / period)
+        granted = min(size, floor(capacity - weight) - (issued - size))
+        if granted < size:
+            # Невыданные разрешения не должны попасть в оценку
+            # ни этого, ни следующего окна
+            try:
+                cache.decr(shared_key, size - max(granted, 0))
+            except ValueError:
+                pass
+        if granted <= 0:
+            metrics.increment('throttle.throttled')
+            metrics.increment(f'throttle.throttled.{scope}')
+            retry_after = self.get_retry_after(
+                now, window, rate, previous, issued - size
+            )
+            with self._lock:
+                self._rejections.set(key, now + retry_after, retry_after)
+            return retry_after
+
+        with self._lock:
+            self._leases.set(key, (window, granted - 1, previous), period)
+
+        return None
+
+
+limiter = SlidingWindowLimiter(settings.THROTTLE_LEASE_SIZE)
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    Троттлинг DRF на SlidingWindowLimiter: авторизованные пользователи
+    ограничиваются по id, анонимные - по IP.
+    """
+
+    def get_scope(self, view):
+        prefix = (
+            getattr(view, 'throttle_scope', None)
+            or getattr(view, 'basename', None)
+            or type(view).__name__
+        )
+        action = getattr(view, 'action', None)
+
+        return f'{prefix}.{action}' if action else prefix
+
+    def allow_request(self, request, view):
+        self.retry_after = None
+        if not settings.THROTTLE_ENABLED:
+            return True
+
+        scope = self.get_scope(view)
+        if request.user.is_authenticated:
+            kind, ident = 'user', f'user:{request.user.pk}'
+        else:
+            kind, ident = 'anon', f'ip:{self.get_ident(request)}'
+        rate = get_rate(scope, kind)
+        if rate is None:
+            return True
+
+        self.retry_after = limiter.consume(scope, ident, rate)
+        return self.retry_after is None
+
+    def wait(self):
+        return self.retry_after
+
+
+def get_request_ident(request):
+    """
+    Клиент обычной вьюхи Django: пользователь, если токен действителен,
+    иначе IP. Недействительный токен не даёт отдельного лимита, чтобы
+    нельзя было получать новый лимит, меняя заголовок Authorization.
+    """
+    try:
+        result = CachedTokenAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        result = None
+    if result is not None:
+        return 'user', f'user:{result[0].pk}'
+
+    return 'anon', f'ip:{BaseThrottle().get_ident(request)}'
+
+
+async def get_request_ident_async(request):
+    """get_request_ident для асинхронных вьюх."""
+    if 'HTTP_AUTHORIZATION' not in request.META:
+        return get_request_ident(request)
+
+    # Импорт здесь: async_views сами используют декоратор throttle
+    from api.async_views import run_query
+
+    return await run_query(get_request_ident, request)
+
+
+def check_ident(scope, kind, ident):
+    """Возвращает ответ 429, если клиент ident превысил лимит scope."""
+    rate = get_rate(scope, kind)
+    if rate is None:
+        return None
+
+    retry_after = limiter.consume(scope, ident, rate)
+    if retry_after is None:
+        return None
+
+    error = Throttled(retry_after)
+    response = JsonResponse(
+        {'detail': str(error.detail)},
+        status=error.status_code,
+        json_dumps_params={'ensure_ascii': False}
+    )
+    response['Retry-After'] = str(retry_after)
+
+    return response
+
+
+def check_rate(request, scope):
+    """Возвращает ответ 429, если клиент превысил лимит scope."""
+    if not settings.THROTTLE_ENABLED:
+        return None
+
+    return check_ident(scope, *get_request_ident(request))
+
+
+def throttle(scope):
+    """
+    Декоратор для обычных и асинхронных вьюх Django вне DRF.
+    В асинхронных вьюхах лимит проверяется прямо в цикле событий:
+    в общий кэш проверка обращается только раз на пачку. Токен же
+    проверяется в пуле потоков: без кэша токенов это запрос к базе.
+    """
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                response = None
+                if settings.THROTTLE_ENABLED:
+                    response = check_ident(
+                        scope, *await get_request_ident_async(request)
+                    )
+                if response is not None:
+                    return response
+                return await view(request, *args, **kwargs)
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = check_rate(request, scope)
+            if response is not None:
+                return response
+            return view(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -1,9 +1,15 @@
+from django.conf import settings
 from django.urls import path, include
 from django.contrib.auth import get_user_model
 from rest_framework.routers import DefaultRouter
 
-from api.views import (IngredientViewSet,
+from api import async_views
+from api.views import (EventsTicketView,
+                       IngredientViewSet,
+                       MealPlanViewSet,
+                       MetricsView,
                        RecipeViewSet,
+                       SyncView,
                        TagViewSet,
                        UserViewSet)
 
@@ -13,15 +19,39 @@ router.register('users', UserViewSet)
 router.register('recipes', RecipeViewSet, basename='recipes')
 router.register('ingredients', IngredientViewSet)
 router.register('tags', TagViewSet, basename='tags')
+router.register('meal-plans', MealPlanViewSet, basename='meal-plans')
 
 User = get_user_model()
 
 
-urlpatterns = [
+urlpatterns = []
+
+# В ASGI-режиме самые нагруженные эндпоинты обслуживают асинхронные
+# вьюхи, они перекрывают маршруты вьюсетов
+if settings.ASYNC_VIEWS:
+    urlpatterns += [
+        path('tags/', async_views.tag_list),
+        path('ingredients/', async_views.ingredient_list),
+        path(
+            'recipes/download_shopping_cart/',
+            async_views.download_shopping_cart
+        ),
+    ]
+
+urlpatterns += [
     path(
         'auth/',
         include('djoser.urls.authtoken')
     ),
+    path(
+        'events/ticket/', EventsTicketView.as_view(), name='events-ticket'
+    ),
+    path(
+        'metrics/', MetricsView.as_view(), name='metrics'
+    ),
+    path(
+        'sync/', SyncView.as_view(), name='sync'
+    ),
     path(
         '', include(router.urls)
     )
@@ -1,35 +1,291 @@
+import os
+
+from django.db import transaction
 from django.http import FileResponse
+from django.utils.dateparse import parse_date
 from django.shortcuts import get_object_or_404
-from django.db.models import Sum, OuterRef, Exists, Count
+from django.db.models import F, OuterRef, Exists, Prefetch
+from rest_framework.exceptions import ValidationError
 from rest_framework.reverse import reverse
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework import status, permissions
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 from djoser.views import UserViewSet as BaseUserViewSet
 from django_filters.rest_framework import DjangoFilterBackend
 
+from recipes import toggles
 from recipes.models import (FavouriteRecipe,
                             Ingredient,
+                            MealPlanEntry,
                             Recipe,
                             RecipeIngredient,
                             ShoppingList,
                             Tag,
                             User)
+from recipes.feed import get_feed_ids
+from recipes.ingredient_index import ingredient_index
+from recipes.meal_plans import get_shopping_list
+from recipes.relations import insert_relations
+from recipes.servings import parse_servings
+from recipes.sync import decode_token, get_changes, get_retention_start
 from users.models import Subscription
+from api import metrics
+from api.constants import (MAX_BULK_IDS,
+                           MAX_ID,
+                           MAX_WHAT_TO_COOK_LIMIT,
+                           MIN_ID,
+                           WHAT_TO_COOK_LIMIT)
+from api.events import create_ticket
 from api.filters import IngredientFilter, RecipeFilter
+from api.pagination import FeedCursorPagination
 from api.permissions import IsAuthorOrReadOnly
 from api.serializers import (AvatarSerializer,
+                             BulkIdsSerializer,
+                             CookableRecipeSerializer,
                              FavouriteSerializer,
                              IngredientSerializer,
+                             MealPlanEntrySerializer,
+                             MealPlanSerializer,
                              RecipeReadSerializer,
+                             RecipeShortSerializer,
                              RecipeWriteSerializer,
                              ShoppingListSerializer,
                              SubscriptionsReadSerializer,
                              SubscriptionsWriteSerializer,
                              TagSerializer,
                              UserSerializer)
-from api.shopping_cart import get_shopping_cart_file_buffer
+from api.shopping_cart import (get_shopping_cart,
+                               get_shopping_cart_file_buffer)
+
+
+# Результаты пакетных операций для отдельных id
+BULK_CREATED = 'created'
+BULK_DELETED = 'deleted'
+BULK_EXISTS = 'exists'
+BULK_FORBIDDEN = 'forbidden'
+BULK_NOT_FOUND = 'not_found'
+
+
+def get_id_list(request, param):
+    """
+    Разбирает параметр запроса вида 1,2,3 в список id. Id вне
+    диапазона первичных ключей отклоняются: база их не примет.
+    """
+    try:
+        ids = [
+            int(value)
+            for value in request.query_params.get(param, '').split(',')
+            if value.strip()
+        ]
+    except ValueError:
+        raise ValidationError(
+            {param: 'Ожидается список id через запятую.'}
+        )
+    if any(not MIN_ID <= pk <= MAX_ID for pk in ids):
+        raise ValidationError(
+            {param: f'Id должны быть от {MIN_ID} до {MAX_ID}.'}
+        )
+
+    return ids
+
+
+def get_name_list(request, param, allowed):
+    """
+    Разбирает параметр запроса вида a,b,c в множество имён из allowed.
+    """
+    names = {
+        name.strip()
+        for name in request.query_params.get(param, '').split(',')
+        if name.strip()
+    }
+    unknown = names.difference(allowed)
+    if unknown:
+        raise ValidationError(
+            {param: f'Неизвестные поля: {", ".join(sorted(unknown))}.'}
+        )
+
+    return names
+
+
+def get_date(request, param):
+    """
+    Разбирает параметр запроса с датой в формате ГГГГ-ММ-ДД,
+    None - если его нет.
+    """
+    value = request.query_params.get(param)
+    if not value:
+        return None
+    try:
+        date = parse_date(value)
+    except ValueError:
+        date = None
+    if date is None:
+        raise ValidationError(
+            {param: 'Ожидается дата в формате ГГГГ-ММ-ДД.'}
+        )
+
+    return date
+
+
+def get_servings(request):
+    """
+    Разбирает параметр ?servings= (см. recipes.servings.parse_servings),
+    None - если его нет.
+    """
+    if 'servings' not in request.query_params:
+        return None
+    try:
+        return parse_servings(request.query_params['servings'])
+    except ValueError as error:
+        raise ValidationError({'servings': str(error)})
+
+
+def get_batch(request, queryset):
+    """
+    Загружает объекты по параметру ?ids= одним запросом и возвращает
+    (объекты в порядке запрошенных id, id ненайденных объектов).
+    """
+    ids = list(dict.fromkeys(get_id_list(request, 'ids')))
+    if len(ids) > MAX_BULK_IDS:
+        raise ValidationError(
+            {'ids': f'Не больше {MAX_BULK_IDS} id за один запрос.'}
+        )
+
+    objects = queryset.in_bulk(ids)
+    return (
+        [objects[pk] for pk in ids if pk in objects],
+        [pk for pk in ids if pk not in objects]
+    )
+
+
+def get_batch_response(data, missing):
+    return Response({'results': data, 'missing': missing})
+
+
+def update_counter(queryset, field, delta):
+    """
+    Атомарно меняет денормализованный счётчик у всех объектов queryset.
+    """
+    return queryset.update(**{field: F(field) + delta})
+
+
+def get_bulk_ids(request):
+    """
+    Возвращает список id без повторов из тела пакетного запроса.
+    """
+    serializer = BulkIdsSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+
+    return list(dict.fromkeys(serializer.validated_data['ids']))
+
+
+def get_bulk_response(results):
+    return Response({
+        'results': [
+            {'id': pk, 'status': result} for pk, result in results.items()
+        ]
+    })
+
+
+def bulk_add(user, model, field, targets, ids, counter_field, excluded=()):
+    """
+    Связывает пользователя с объектами targets из списка ids через model
+    одним INSERT. Существование объектов и уже имеющиеся связи проверяются
+    двумя запросами на весь список, а не по запросу на каждый id.
+    Счётчики увеличиваются и created возвращается только для строк,
+    которые вставил именно этот запрос.
+    """
+    found = set(targets.filter(pk__in=ids).values_list('pk', flat=True))
+    existing = set(
+        model.objects.filter(
+            user=user, **{f'{field}_id__in': found}
+        ).values_list(f'{field}_id', flat=True)
+    )
+
+    results = {}
+    for pk in ids:
+        if pk not in found:
+            results[pk] = BULK_NOT_FOUND
+        elif pk in excluded:
+            results[pk] = BULK_FORBIDDEN
+        elif pk in existing:
+            results[pk] = BULK_EXISTS
+        else:
+            results[pk] = BULK_CREATED
+
+    created = [pk for pk, result in results.items() if result == BULK_CREATED]
+    if created:
+        with transaction.atomic():
+            inserted = {
+                pk for _, pk in insert_relations(
+                    model, field, [(user.pk, pk) for pk in created]
+                )
+            }
+            # Связи, которые успел вставить параллельный запрос,
+            # уже учтены в счётчике им самим
+            if inserted:
+                update_counter(
+                    targets.filter(pk__in=inserted), counter_field, 1
+                )
+        for pk in created:
+            if pk not in inserted:
+                results[pk] = BULK_EXISTS
+
+    return get_bulk_response(results)
+
+
+def bulk_remove(user, model, field, targets, ids, counter_field):
+    """
+    Удаляет связи пользователя с объектами из списка ids одним DELETE.
+    """
+    with transaction.atomic():
+        relations = model.objects.filter(
+            user=user, **{f'{field}_id__in': ids}
+        )
+        # Блокируем строки, чтобы счётчики уменьшились ровно на удалённое
+        deleted = set(
+            relations.select_for_update().values_list(
+                f'{field}_id', flat=True
+            )
+        )
+        if deleted:
+            relations.filter(**{f'{field}_id__in': deleted}).delete()
+            update_counter(targets.filter(pk__in=deleted), counter_field, -1)
+
+    return get_bulk_response({
+        pk: BULK_DELETED if pk in deleted else BULK_NOT_FOUND for pk in ids
+    })
+
+
+def bulk_toggle(user, model, ids, added):
+    """
+    То же, что bulk_add и bulk_remove для избранного и списка покупок,
+    в режиме отложенной записи: изменения не трогают таблицы, а одним
+    INSERT дописываются в журнал recipes.toggles, как и одиночные.
+    """
+    found = set(Recipe.objects.filter(pk__in=ids).values_list('pk', flat=True))
+    active = toggles.get_active(user, model, found)
+    toggles.record_many(
+        user, model,
+        [pk for pk in ids if pk in found and (pk in active) != added],
+        added
+    )
+
+    if not added:
+        return get_bulk_response({
+            pk: BULK_DELETED if pk in active else BULK_NOT_FOUND
+            for pk in ids
+        })
+    return get_bulk_response({
+        pk: (
+            BULK_NOT_FOUND if pk not in found
+            else BULK_EXISTS if pk in active
+            else BULK_CREATED
+        )
+        for pk in ids
+    })
 
 
 class UserViewSet(BaseUserViewSet):
@@ -37,6 +293,27 @@ class UserViewSet(BaseUserViewSet):
     Вьюсет для модели User, наследуется от стандартного вьюсета из djoser.
     """
 
+    throttle_scope = 'users'
+
+    def list(self, request, *args, **kwargs):
+        if 'ids' not in request.query_params:
+            return super().list(request, *args, **kwargs)
+
+        # Пачка видна так же, как страницы пользователей, а не как список,
+        # который djoser по умолчанию сужает до текущего пользователя
+        users, missing = get_batch(request, User.objects.all())
+        context = self.get_serializer_context()
+        if request.user.is_authenticated:
+            # Подписки на всю пачку узнаём одним запросом
+            context['subscribed_author_ids'] = set(
+                request.user.user_subscriptions.filter(
+                    author__in=users
+                ).values_list('author_id', flat=True)
+            )
+        serializer = UserSerializer(users, many=True, context=context)
+
+        return get_batch_response(serializer.data, missing)
+
     @action(
         detail=True,
         methods=('put',),
@@ -76,8 +353,6 @@ class UserViewSet(BaseUserViewSet):
     def subscriptions(self, request):
         subscriptions = User.objects.filter(
             subscriptions_to_author__user=request.user
-        ).annotate(
-            recipes_count=Count('recipes')
         ).order_by('username')
         page = self.paginate_queryset(subscriptions)
         serializer = SubscriptionsReadSerializer(
@@ -95,11 +370,14 @@ class UserViewSet(BaseUserViewSet):
         author = get_object_or_404(User, id=id)
 
         serializer = SubscriptionsWriteSerializer(
-            data={'user': request.user.id, 'author': author.id},
-            context={'request': request}
+            data={}, context={'request': request}
         )
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        with transaction.atomic():
+            serializer.save(user=request.user, author=author)
+            update_counter(
+                User.objects.filter(pk=author.pk), 'subscribers_count', 1
+            )
 
         return Response(
             data=serializer.data,
@@ -108,19 +386,54 @@ class UserViewSet(BaseUserViewSet):
 
     @subscribe.mapping.delete
     def delete_subscribe(self, request, id):
-        author = get_object_or_404(
-            User,
-            id=id,
-        )
-        deleted, _ = Subscription.objects.filter(
-            user=request.user, author__id=author.id
-        ).delete()
+        with transaction.atomic():
+            deleted, _ = Subscription.objects.filter(
+                user=request.user, author_id=id
+            ).delete()
+            if deleted:
+                update_counter(
+                    User.objects.filter(pk=id), 'subscribers_count', -1
+                )
+        # Существование автора проверяем, только если удалять было нечего
+        if not deleted:
+            get_object_or_404(User, id=id)
 
         return Response(
             status=status.HTTP_204_NO_CONTENT if deleted
             else status.HTTP_400_BAD_REQUEST
         )
 
+    @action(
+        detail=False,
+        methods=('post',),
+        url_path='subscribe/bulk',
+        permission_classes=(permissions.IsAuthenticated,)
+    )
+    def subscribe_bulk(self, request):
+        """
+        Подписка сразу на несколько авторов: {"ids": [1, 2, 3]}.
+        """
+        return bulk_add(
+            request.user,
+            Subscription,
+            'author',
+            User.objects.all(),
+            get_bulk_ids(request),
+            'subscribers_count',
+            excluded=(request.user.pk,)
+        )
+
+    @subscribe_bulk.mapping.delete
+    def delete_subscribe_bulk(self, request):
+        return bulk_remove(
+            request.user,
+            Subscription,
+            'author',
+            User.objects.all(),
+            get_bulk_ids(request),
+            'subscribers_count'
+        )
+
     @action(
         detail=False,
         methods=('get',),
@@ -159,26 +472,87 @@ class RecipeViewSet(ModelViewSet):
     )
     filterset_class = RecipeFilter
 
+    def get_requested_fields(self):
+        """
+        Возвращает (поля ответа, развёрнутые вложенные объекты) по
+        параметрам ?fields=, ?omit= и ?expand=. Без параметров ответ
+        полный, как раньше.
+        """
+        params = self.request.query_params
+        all_fields = RecipeReadSerializer.Meta.fields
+        expandable_fields = RecipeReadSerializer.Meta.expandable_fields
+
+        selected = set(all_fields)
+        if 'fields' in params:
+            selected = get_name_list(self.request, 'fields', all_fields)
+        selected -= get_name_list(self.request, 'omit', all_fields)
+        expanded = set(expandable_fields)
+        if 'expand' in params:
+            expanded = get_name_list(
+                self.request, 'expand', expandable_fields
+            )
+
+        return selected, expanded & selected
+
+    def is_sparse(self):
+        return self.action in ('list', 'retrieve', 'feed')
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.is_sparse():
+            context['requested_fields'] = self.get_requested_fields()
+        if self.action == 'retrieve':
+            context['servings'] = get_servings(self.request)
+
+        return context
+
     def get_queryset(self):
         user = self.request.user
+        selected = set(RecipeReadSerializer.Meta.fields)
+        expanded = set(RecipeReadSerializer.Meta.expandable_fields)
+        if self.is_sparse():
+            selected, expanded = self.get_requested_fields()
+        # Фильтры по избранному и списку покупок опираются на аннотации
+        annotated = {'is_favorited', 'is_in_shopping_cart'} & (
+            selected | set(self.request.query_params)
+        )
 
-        queryset = Recipe.objects.all().select_related(
-            'author'
-        ).prefetch_related('tags', 'ingredients')
+        # Не запрошенные тяжёлые поля и связи не загружаем вовсе
+        queryset = Recipe.objects.defer('search_vector', *(
+            {'text', 'image'} - selected
+        ))
+        if 'author' in expanded:
+            queryset = queryset.select_related('author')
+        if 'tags' in selected:
+            queryset = queryset.prefetch_related('tags')
+        # Пересчитанные по ?servings= ингредиенты берутся из кэша
+        scaled = (
+            self.action == 'retrieve'
+            and 'servings' in self.request.query_params
+        )
+        if 'ingredients' in selected and not scaled:
+            queryset = queryset.prefetch_related(Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            ))
 
-        if user.is_authenticated:
-            queryset = queryset.annotate(
-                is_favorited=Exists(
-                    FavouriteRecipe.objects.filter(
-                        user=user, recipe=OuterRef('pk')
-                    )
-                ),
-                is_in_shopping_cart=Exists(
-                    ShoppingList.objects.filter(
-                        user=user, recipe=OuterRef('pk')
+        if user.is_authenticated and annotated:
+            # Ещё не примененные события пользователь должен видеть сразу
+            pending = toggles.get_pending(user) if toggles.is_enabled() else {}
+            annotations = {}
+            for name, model in (
+                ('is_favorited', FavouriteRecipe),
+                ('is_in_shopping_cart', ShoppingList)
+            ):
+                if name in annotated:
+                    annotations[name] = toggles.overlay_pending(
+                        Exists(model.objects.filter(
+                            user=user, recipe=OuterRef('pk')
+                        )),
+                        pending,
+                        model
                     )
-                )
-            )
+            queryset = queryset.annotate(**annotations)
 
         return queryset
 
@@ -187,8 +561,168 @@ class RecipeViewSet(ModelViewSet):
             return RecipeReadSerializer
         return RecipeWriteSerializer
 
+    def list(self, request, *args, **kwargs):
+        # ?ids= - пачка рецептов в заданном порядке, без фильтров
+        # и пагинации
+        if 'ids' not in request.query_params:
+            return super().list(request, *args, **kwargs)
+
+        recipes, missing = get_batch(request, self.get_queryset())
+        context = self.get_serializer_context()
+        _, expanded = context['requested_fields']
+        if request.user.is_authenticated and 'author' in expanded:
+            context['subscribed_author_ids'] = set(
+                request.user.user_subscriptions.filter(
+                    author_id__in={recipe.author_id for recipe in recipes}
+                ).values_list('author_id', flat=True)
+            )
+        serializer = RecipeReadSerializer(recipes, many=True, context=context)
+
+        return get_batch_response(serializer.data, missing)
+
+    @transaction.atomic
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
+        update_counter(
+            User.objects.filter(pk=self.request.user.pk), 'recipes_count', 1
+        )
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        author_id = instance.author_id
+        instance.delete()
+        update_counter(
+            User.objects.filter(pk=author_id), 'recipes_count', -1
+        )
+
+    @action(
+        detail=False,
+        methods=('get',),
+        permission_classes=(permissions.IsAuthenticated,)
+    )
+    def feed(self, request):
+        """
+        Лента рецептов авторов, на которых подписан пользователь.
+        """
+        author_ids = list(
+            request.user.user_subscriptions.values_list(
+                'author_id', flat=True
+            )
+        )
+
+        def get_page(before, limit):
+            recipe_ids = get_feed_ids(author_ids, limit, before)
+            recipes = self.get_queryset().in_bulk(recipe_ids)
+
+            return [recipes[pk] for pk in recipe_ids if pk in recipes]
+
+        paginator = FeedCursorPagination()
+        page = paginator.paginate_feed(request, get_page)
+        serializer = RecipeReadSerializer(
+            page,
+            many=True,
+            context={
+                **self.get_serializer_context(),
+                'subscribed_author_ids': set(author_ids)
+            }
+        )
+
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=('get',), url_path='what-to-cook')
+    def what_to_cook(self, request):
+        """
+        Рецепты, которые можно приготовить из имеющихся ингредиентов,
+        по убыванию доли уже имеющихся ингредиентов.
+        """
+        ingredient_ids = get_id_list(request, 'ingredients')
+        if not ingredient_ids:
+            raise ValidationError(
+                {'ingredients': 'Укажите хотя бы 1 ингредиент.'}
+            )
+        try:
+            limit = min(
+                int(request.query_params.get('limit', WHAT_TO_COOK_LIMIT)),
+                MAX_WHAT_TO_COOK_LIMIT
+            )
+        except ValueError:
+            limit = WHAT_TO_COOK_LIMIT
+
+        matches = ingredient_index.search(ingredient_ids, max(limit, 1))
+        recipes = Recipe.objects.in_bulk(
+            [recipe_id for recipe_id, _, _ in matches]
+        )
+        # Рецепт могли удалить в другом процессе после обновления индекса:
+        # убираем такие из индекса и добираем страницу повторным поиском
+        deleted = [
+            recipe_id for recipe_id, _, _ in matches
+            if recipe_id not in recipes
+        ]
+        if deleted:
+            for recipe_id in deleted:
+                ingredient_index.remove(recipe_id)
+            matches = ingredient_index.search(ingredient_ids, max(limit, 1))
+            recipes = Recipe.objects.in_bulk(
+                [recipe_id for recipe_id, _, _ in matches]
+            )
+        ingredients = Ingredient.objects.in_bulk({
+            ingredient_id
+            for _, _, missing in matches
+            for ingredient_id in missing
+        })
+
+        results = []
+        for recipe_id, coverage, missing in matches:
+            recipe = recipes.get(recipe_id)
+            if recipe is None:
+                continue
+            recipe.coverage = coverage
+            recipe.missing_ingredients = [
+                ingredients[ingredient_id] for ingredient_id in missing
+            ]
+            results.append(recipe)
+
+        return Response(CookableRecipeSerializer(
+            results, many=True, context=self.get_serializer_context()
+        ).data)
+
+    @action(detail=True, methods=('get',))
+    def related(self, request, pk):
+        """
+        Похожие рецепты, заранее рассчитанные build_related_recipes.
+        """
+        recipes = Recipe.objects.filter(
+            related_to__recipe_id=pk
+        ).order_by('-related_to__score')
+        serializer = RecipeShortSerializer(
+            recipes, many=True, context=self.get_serializer_context()
+        )
+        data = serializer.data
+
+        # Лишний запрос только если похожих рецептов нет
+        if not data:
+            get_object_or_404(Recipe, pk=pk)
+
+        return Response(data)
+
+    @action(
+        detail=False,
+        methods=('get',),
+        permission_classes=(permissions.IsAuthenticated,)
+    )
+    def recommended(self, request):
+        """
+        Персональные рекомендации, заранее рассчитанные
+        build_recommendations.
+        """
+        recipes = Recipe.objects.filter(
+            recommendations__user=request.user
+        ).order_by('-recommendations__score')
+        serializer = RecipeShortSerializer(
+            recipes, many=True, context=self.get_serializer_context()
+        )
+
+        return Response(serializer.data)
 
     @action(detail=True, methods=('get',), url_path='get-link')
     def get_link(self, request, pk):
@@ -206,23 +740,10 @@ class RecipeViewSet(ModelViewSet):
         permission_classes=(permissions.IsAuthenticated,)
     )
     def download_shopping_cart(self, request):
-        user = request.user
-
-        recipes = user.purchases.select_related(
-            'recipe'
-        ).values(
-            'recipe__name', 'recipe__cooking_time'
-        )
-
-        total_ingredients = RecipeIngredient.objects.filter(
-            recipe__purchases__user=user
-        ).values(
-            'ingredient__name',
-            'ingredient__measurement_unit'
-        ).annotate(total_amount=Sum('amount')).order_by('ingredient__name')
-
         response = FileResponse(
-            get_shopping_cart_file_buffer(recipes, total_ingredients),
+            get_shopping_cart_file_buffer(*get_shopping_cart(
+                request.user, get_servings(request)
+            )),
             as_attachment=True,
             filename='shopping_cart.txt',
             content_type='text/plain; charset=utf-8',
@@ -234,18 +755,61 @@ class RecipeViewSet(ModelViewSet):
         recipe = get_object_or_404(Recipe, id=pk)
         request = self.request
 
-        serializer = serializer(
-            data={'user': request.user.id, 'recipe': recipe.pk},
-            context={'request': request}
-        )
+        if toggles.is_enabled():
+            model = serializer.Meta.model
+            if toggles.is_active(request.user, model, recipe.pk):
+                raise ValidationError({
+                    'detail': 'Рецепт уже есть в '
+                              + model._meta.verbose_name_plural
+                })
+            toggles.record(request.user, model, recipe.pk, added=True)
+            return Response(
+                data=RecipeShortSerializer(
+                    recipe, context={'request': request}
+                ).data,
+                status=status.HTTP_201_CREATED
+            )
+
+        serializer = serializer(data={}, context={'request': request})
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        with transaction.atomic():
+            serializer.save(user=request.user, recipe=recipe)
+            update_counter(
+                Recipe.objects.filter(pk=recipe.pk),
+                serializer.Meta.model.counter_field,
+                1
+            )
 
         return Response(
             data=serializer.data,
             status=status.HTTP_201_CREATED
         )
 
+    def remove_from_favorite_or_shopping_list(self, model, pk):
+        if toggles.is_enabled():
+            recipe = get_object_or_404(Recipe, pk=pk)
+            if not toggles.is_active(self.request.user, model, recipe.pk):
+                return Response(status=status.HTTP_400_BAD_REQUEST)
+            toggles.record(self.request.user, model, recipe.pk, added=False)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+
+        with transaction.atomic():
+            deleted, _ = model.objects.filter(
+                user=self.request.user, recipe_id=pk
+            ).delete()
+            if deleted:
+                update_counter(
+                    Recipe.objects.filter(pk=pk), model.counter_field, -1
+                )
+        # Существование рецепта проверяем, только если удалять было нечего
+        if not deleted:
+            get_object_or_404(Recipe, pk=pk)
+
+        return Response(
+            status=status.HTTP_204_NO_CONTENT if deleted
+            else status.HTTP_400_BAD_REQUEST
+        )
+
     @action(detail=True, methods=('post',))
     def favorite(self, request, pk):
         return self.add_in_favorite_or_in_shopping_list(
@@ -260,37 +824,203 @@ class RecipeViewSet(ModelViewSet):
 
     @favorite.mapping.delete
     def delete_favorite(self, request, pk):
-        recipe = get_object_or_404(Recipe, pk=pk)
-        deleted, _ = FavouriteRecipe.objects.filter(
-            user=request.user, recipe_id=recipe.pk
-        ).delete()
-
-        return Response(
-            status=status.HTTP_204_NO_CONTENT if deleted
-            else status.HTTP_400_BAD_REQUEST
+        return self.remove_from_favorite_or_shopping_list(
+            FavouriteRecipe, pk
         )
 
     @shopping_cart.mapping.delete
     def delete_shopping_cart(self, request, pk):
-        recipe = get_object_or_404(Recipe, pk=pk)
-        deleted, _ = ShoppingList.objects.filter(
-            user=request.user, recipe_id=recipe.pk
-        ).delete()
+        return self.remove_from_favorite_or_shopping_list(
+            ShoppingList, pk
+        )
 
-        return Response(
-            status=status.HTTP_204_NO_CONTENT if deleted
-            else status.HTTP_400_BAD_REQUEST
+    def bulk_add_or_remove(self, model):
+        ids = get_bulk_ids(self.request)
+        if toggles.is_enabled():
+            return bulk_toggle(
+                self.request.user, model, ids,
+                added=self.request.method != 'DELETE'
+            )
+        if self.request.method == 'DELETE':
+            return bulk_remove(
+                self.request.user, model, 'recipe', Recipe.objects.all(),
+                ids, model.counter_field
+            )
+
+        return bulk_add(
+            self.request.user, model, 'recipe', Recipe.objects.all(),
+            ids, model.counter_field
         )
 
+    @action(detail=False, methods=('post', 'delete'), url_path='favorite/bulk')
+    def favorite_bulk(self, request):
+        """
+        Добавление и удаление сразу нескольких рецептов в избранном:
+        {"ids": [1, 2, 3]}.
+        """
+        return self.bulk_add_or_remove(FavouriteRecipe)
+
+    @action(
+        detail=False,
+        methods=('post', 'delete'),
+        url_path='shopping_cart/bulk'
+    )
+    def shopping_cart_bulk(self, request):
+        """
+        Добавление и удаление сразу нескольких рецептов в списке покупок:
+        {"ids": [1, 2, 3]}.
+        """
+        return self.bulk_add_or_remove(ShoppingList)
+
 
 class IngredientViewSet(ReadOnlyModelViewSet):
     """
     Вьюсет для модели Ingredient.
     """
 
+    throttle_scope = 'ingredients'
+
     pagination_class = None
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (permissions.AllowAny, )
     filter_backends = (DjangoFilterBackend, )
     filterset_class = IngredientFilter
+
+
+class MealPlanViewSet(ModelViewSet):
+    """
+    Вьюсет для планов питания текущего пользователя.
+    """
+
+    serializer_class = MealPlanSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get_queryset(self):
+        queryset = self.request.user.meal_plans.all()
+        if self.action in ('list', 'retrieve'):
+            queryset = queryset.prefetch_related('entries')
+
+        return queryset
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+    @action(detail=True, methods=('post',))
+    def entries(self, request, pk):
+        """
+        Добавляет в план рецепт на дату: {"date", "recipe", "servings"}.
+        """
+        plan = self.get_object()
+        serializer = MealPlanEntrySerializer(
+            data=request.data, context=self.get_serializer_context()
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save(plan=plan)
+
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(
+        detail=True,
+        methods=('delete',),
+        url_path=r'entries/(?P<entry_id>\d+)'
+    )
+    def delete_entry(self, request, pk, entry_id):
+        deleted, _ = MealPlanEntry.objects.filter(
+            plan=self.get_object(), pk=entry_id
+        ).delete()
+        if not deleted:
+            return Response(
+                {'detail': 'Записи нет в плане питания'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=True, methods=('get',))
+    def download_shopping_list(self, request, pk):
+        """
+        Список покупок по записям плана с ?start= по ?end= включительно
+        (по умолчанию - по всему плану).
+        """
+        shopping_list = get_shopping_list(
+            self.get_object(),
+            get_date(request, 'start'),
+            get_date(request, 'end')
+        )
+
+        return FileResponse(
+            get_shopping_cart_file_buffer(*shopping_list),
+            as_attachment=True,
+            filename='shopping_list.txt',
+            content_type='text/plain; charset=utf-8',
+        )
+
+
+class MetricsView(APIView):
+    """
+    Счётчики метрик текущего процесса, доступны только администраторам.
+    """
+
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request):
+        return Response({
+            'pid': os.getpid(),
+            'counters': metrics.snapshot()
+        })
+
+
+class EventsTicketView(APIView):
+    """
+    Одноразовый билет для подключения к потоку событий /api/events/
+    из браузера, где EventSource не передаёт заголовок с токеном.
+    """
+
+    def post(self, request):
+        return Response(
+            {'ticket': create_ticket(request.user)},
+            status=status.HTTP_201_CREATED
+        )
+
+
+class SyncView(APIView):
+    """
+    Изменения рецептов, избранного, списка покупок и подписок
+    пользователя после токена ?since= для офлайн-клиентов. Без токена
+    или с устаревшим токеном возвращается всё состояние и reset = true.
+    """
+
+    def get(self, request):
+        since = None
+        if request.query_params.get('since'):
+            try:
+                since = decode_token(request.query_params['since'])
+            except ValueError:
+                raise ValidationError(
+                    {'since': 'Неверный токен синхронизации.'}
+                )
+        # Записи об удалениях старше срока хранения уже удалены
+        if since is not None and since < get_retention_start():
+            since = None
+
+        changes = get_changes(request.user, since)
+        recipes = list(changes['recipes']['updated'])
+        context = {'request': request}
+        if recipes:
+            context['subscribed_author_ids'] = set(
+                request.user.user_subscriptions.values_list(
+                    'author_id', flat=True
+                )
+            )
+
+        return Response({
+            **changes,
+            'reset': since is None,
+            'recipes': {
+                'updated': RecipeReadSerializer(
+                    recipes, many=True, context=context
+                ).data,
+                'deleted': changes['recipes']['deleted']
+            }
+        })
@@ -13,4 +13,18 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Импортируется после настройки Django, потому что использует модели
+from api.events import events_application  # noqa: E402
+
+
+# Поток событий обслуживается в обход Django, см. api/events.py
+EVENTS_PATH = '/api/events/'
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == EVENTS_PATH:
+        return await events_application(scope, receive, send)
+
+    return await django_application(scope, receive, send)
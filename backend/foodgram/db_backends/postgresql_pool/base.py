@@ -0,0 +1,168 @@
+"""
+Бэкенд Postgres с пулом соединений внутри процесса.
+
+Для потоковых воркеров gunicorn (gthread): вместо открытия соединения
+на каждый запрос поток берёт готовое соединение из общего для процесса
+пула и возвращает его после запроса (CONN_MAX_AGE должен быть 0).
+Размер пула задаётся ключом POOL в настройках базы:
+{'MIN_SIZE': 1, 'MAX_SIZE': 10, 'TIMEOUT': 10}.
+"""
+import threading
+from time import monotonic
+
+import psycopg2.extensions
+import psycopg2.extras
+from django.conf import settings
+from django.db.backends.postgresql.base import (
+    Database,
+    DatabaseWrapper as PostgresDatabaseWrapper
+)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """
+    Потокобезопасный пул соединений. Если свободных соединений нет,
+    ждёт освобождения не дольше timeout секунд.
+
+    Вернувшиеся соединения хранятся в пуле все, а не только min_size
+    штук, как в psycopg2.pool, иначе под нагрузкой большая часть
+    запросов открывала бы соединение заново. При health_checks
+    соединение проверяется перед выдачей, только если пролежало
+    в пуле дольше health_check_idle_seconds: только что открытое
+    или недавно вернувшееся соединение живо и без лишнего SELECT 1.
+    """
+
+    def __init__(self, min_size, max_size, timeout, health_checks,
+                 health_check_idle_seconds, conn_params):
+        self._conn_params = conn_params
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self.timeout = timeout
+        self.health_checks = health_checks
+        self.health_check_idle_seconds = health_check_idle_seconds
+        # Свободные соединения и время их возврата в пул,
+        # последнее вернувшееся - в конце
+        self._idle = [
+            (self._connect(), monotonic()) for _ in range(min_size)
+        ]
+
+    def _connect(self):
+        return Database.connect(**self._conn_params)
+
+    def _is_usable(self, connection, returned_at):
+        if connection.closed:
+            return False
+        if (
+            not self.health_checks
+            or monotonic() - returned_at <= self.health_check_idle_seconds
+        ):
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            # Проверка не должна оставлять открытую транзакцию:
+            # на ней упал бы set_autocommit в Django
+            connection.rollback()
+        except Database.Error:
+            return False
+        return True
+
+    def _get_idle(self):
+        """Свободное рабочее соединение из пула или None."""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                connection, returned_at = self._idle.pop()
+            if self._is_usable(connection, returned_at):
+                return connection
+            connection.close()
+
+    def get(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise Database.OperationalError(
+                'Нет свободных соединений в пуле.'
+            )
+        try:
+            connection = self._get_idle()
+            if connection is None:
+                connection = self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+        return connection
+
+    def put(self, connection):
+        close = connection.closed
+        if not close and connection.info.transaction_status != (
+            psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        ):
+            # Незавершённая транзакция не должна достаться другому запросу
+            try:
+                connection.rollback()
+            except Database.Error:
+                close = True
+        try:
+            if close:
+                connection.close()
+            else:
+                with self._lock:
+                    self._idle.append((connection, monotonic()))
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """Закрывает свободные соединения пула."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            connection.close()
+
+
+class DatabaseWrapper(PostgresDatabaseWrapper):
+
+    def get_pool(self):
+        with _pools_lock:
+            if self.alias not in _pools:
+                options = self.settings_dict.get('POOL', {})
+                _pools[self.alias] = ConnectionPool(
+                    min_size=options.get('MIN_SIZE', 1),
+                    max_size=options.get('MAX_SIZE', 10),
+                    timeout=options.get('TIMEOUT', 10),
+                    health_checks=self.settings_dict.get(
+                        'CONN_HEALTH_CHECKS', False
+                    ),
+                    health_check_idle_seconds=(
+                        settings.DB_CONN_HEALTH_CHECK_IDLE_SECONDS
+                    ),
+                    conn_params=self.get_connection_params()
+                )
+            return _pools[self.alias]
+
+    def get_new_connection(self, conn_params):
+        connection = self.get_pool().get()
+
+        # Как в стандартном бэкенде, но для соединения из пула
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        psycopg2.extras.register_default_jsonb(
+            conn_or_curs=connection, loads=lambda x: x
+        )
+
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                return self.get_pool().put(self.connection)
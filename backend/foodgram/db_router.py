@@ -0,0 +1,43 @@
+"""
+Маршрутизация чтения на реплики базы данных.
+
+Какую базу использовать для чтения, решает ReplicaRoutingMiddleware
+в начале запроса и кладёт её алиас в contextvar. Запись, чтение внутри
+транзакций и всё, что выполняется вне запросов (миграции, команды),
+всегда идёт в основную базу.
+"""
+import contextvars
+
+from django.db import connections
+
+
+_read_database = contextvars.ContextVar('read_database', default=None)
+
+
+def set_read_database(alias):
+    """
+    Направляет чтение в текущем контексте в базу alias
+    (None - в основную). Возвращает токен для reset_read_database.
+    """
+    return _read_database.set(alias)
+
+
+def reset_read_database(token):
+    _read_database.reset(token)
+
+
+class ReplicaRouter:
+    """Роутер, отправляющий чтение в выбранную для запроса реплику."""
+
+    def db_for_read(self, model, **hints):
+        alias = _read_database.get()
+        # В транзакции читаем из основной базы то, что в неё же и пишем
+        if alias is None or connections['default'].in_atomic_block:
+            return 'default'
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
@@ -37,8 +37,21 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'api.renderers.MessagePackRenderer',
+        'api.renderers.ColumnarJSONRenderer',
+        'api.renderers.ColumnarMessagePackRenderer',
+    ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'api.throttling.SlidingWindowThrottle',
+    ],
+    # IP клиента для лимитов анонимов берётся из X-Forwarded-For,
+    # который дописывает nginx перед бэкендом
+    'NUM_PROXIES': 1,
     'DEFAULT_PAGINATION_CLASS': 'api.pagination.PageLimitPagination',
     'PAGE_SIZE': 6
 }
@@ -51,6 +64,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'foodgram.urls'
@@ -72,6 +86,11 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'foodgram.wsgi.application'
+ASGI_APPLICATION = 'foodgram.asgi.application'
+
+# wsgi или asgi; в ASGI-режиме часть эндпоинтов обслуживают async-вьюхи
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')
+ASYNC_VIEWS = SERVER_MODE == 'asgi'
 
 
 if os.getenv('DB_ENGINE') == 'sqlite':
@@ -92,6 +111,93 @@ else:
             'PORT': os.getenv('DB_PORT', 5432)
         }
     }
+    # Пул соединений внутри процесса для потоковых воркеров gunicorn
+    if os.getenv('DB_POOL', 'False') == 'True':
+        DATABASES['default'].update({
+            'ENGINE': 'foodgram.db_backends.postgresql_pool',
+            'POOL': {
+                'MIN_SIZE': int(os.getenv('DB_POOL_MIN_SIZE', 1)),
+                'MAX_SIZE': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+                'TIMEOUT': int(os.getenv('DB_POOL_TIMEOUT', 10)),
+            },
+        })
+
+# Сколько секунд держать соединение открытым между запросами
+# (с пулом соединения возвращаются в пул после каждого запроса)
+DATABASES['default']['CONN_MAX_AGE'] = (
+    0 if 'POOL' in DATABASES['default']
+    else int(os.getenv('DB_CONN_MAX_AGE', 60))
+)
+# Проверять соединение перед повторным использованием
+DATABASES['default']['CONN_HEALTH_CHECKS'] = (
+    os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True'
+)
+# Проверяется только соединение, простоявшее без запросов дольше
+# стольких секунд: проверка - это лишний SELECT 1 перед запросом
+DB_CONN_HEALTH_CHECK_IDLE_SECONDS = int(
+    os.getenv('DB_CONN_HEALTH_CHECK_IDLE_SECONDS', 30)
+)
+
+# Реплики только для чтения: для sqlite - пути к файлам,
+# для postgres - адреса вида host или host:port через запятую
+DATABASE_REPLICAS = []
+for number, location in enumerate(
+    filter(None, os.getenv('DB_REPLICAS', '').split(',')), start=1
+):
+    replica = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+    if os.getenv('DB_ENGINE') == 'sqlite':
+        replica['NAME'] = BASE_DIR / location.strip()
+    else:
+        host, _, port = location.strip().partition(':')
+        replica['HOST'], replica['PORT'] = host, port or replica['PORT']
+    DATABASES[f'replica_{number}'] = replica
+    DATABASE_REPLICAS.append(f'replica_{number}')
+
+DATABASE_ROUTERS = ['foodgram.db_router.ReplicaRouter']
+# Сколько секунд после изменения данных клиент читает из основной базы
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 5))
+
+# Избранное и список покупок пишутся в журнал событий, а в таблицы
+# их переносит команда apply_toggle_events
+WRITE_BEHIND_TOGGLES = os.getenv('WRITE_BEHIND_TOGGLES', 'False') == 'True'
+
+# Брокер уведомлений для потока событий /api/events/
+EVENTS_BROKER = os.getenv('EVENTS_BROKER', 'api.broker.LocalBroker')
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Время жизни закэшированных токенов в памяти процесса и в общем кэше
+TOKEN_CACHE_LOCAL_TTL = int(os.getenv('TOKEN_CACHE_LOCAL_TTL', 5))
+TOKEN_CACHE_SHARED_TTL = int(os.getenv('TOKEN_CACHE_SHARED_TTL', 300))
+
+# Ограничение частоты запросов скользящим окном (см.
+# api/throttling.py): лимиты по действиям вьюсетов и общие для пользователей и анонимов, их можно
+# переопределить в THROTTLE_RATES вида recipes.list=60/min,anon=none
+THROTTLE_ENABLED = os.getenv('THROTTLE_ENABLED', 'True') == 'True'
+THROTTLE_LEASE_SIZE = int(os.getenv('THROTTLE_LEASE_SIZE', 10))
+THROTTLE_RATES = {
+    'anon': '120/min',
+    'user': '600/min',
+    'recipes.list': '120/min',
+    'ingredients.list': '120/min',
+    'short_link': '60/min',
+}
+THROTTLE_RATES.update(
+    (scope.strip(), None if rate.strip() == 'none' else rate.strip())
+    for scope, rate in (
+        item.split('=', 1)
+        for item in os.getenv('THROTTLE_RATES', '').split(',')
+        if item.strip()
+    )
+)
 
 
 AUTH_PASSWORD_VALIDATORS = [
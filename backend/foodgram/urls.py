@@ -3,7 +3,7 @@ from django.urls import path, include
 from django.conf.urls.static import static
 from django.conf import settings
 
-from recipes.views import redirect_to_recipe
+from recipes.views import redirect_to_recipe, redirect_to_recipe_async
 
 
 urlpatterns = [
@@ -16,7 +16,8 @@ urlpatterns = [
     ),
     path(
         's/<slug:short_link>/',
-        redirect_to_recipe,
+        redirect_to_recipe_async if settings.ASYNC_VIEWS
+        else redirect_to_recipe,
         name='redirect_to_recipe'
     ),
 ]
@@ -0,0 +1,43 @@
+import multiprocessing
+import os
+
+
+# SERVER_MODE=asgi запускает foodgram.asgi на воркерах uvicorn,
+# иначе - foodgram.wsgi на потоковых воркерах gthread
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')
+
+if SERVER_MODE == 'asgi':
+    wsgi_app = 'foodgram.asgi:application'
+    default_worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'foodgram.wsgi:application'
+    # gthread позволяет обслуживать несколько запросов в одном процессе
+    # и переиспользовать соединения с базой (см. DB_CONN_MAX_AGE и DB_POOL)
+    default_worker_class = 'gthread'
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', default_worker_class)
+# LocalBroker рассылает уведомления /api/events/ только внутри своего
+# процесса: с несколькими воркерами подписчик не получит события,
+# опубликованные в другом. Поэтому в asgi-режиме с ним по умолчанию
+# один воркер, а больше - только с общим брокером в EVENTS_BROKER.
+# В docker-compose.production.yml поток событий обслуживает отдельный
+# сервис events с PostgresBroker, а API остаётся на воркерах wsgi
+LOCAL_BROKER = 'api.broker.LocalBroker'
+local_events = (
+    SERVER_MODE == 'asgi'
+    and os.getenv('EVENTS_BROKER', LOCAL_BROKER) == LOCAL_BROKER
+)
+workers = int(os.getenv(
+    'GUNICORN_WORKERS',
+    1 if local_events else multiprocessing.cpu_count() * 2 + 1
+))
+if local_events and workers > 1:
+    raise RuntimeError(
+        f'SERVER_MODE=asgi с {LOCAL_BROKER} работает только с одним '
+        f'воркером, а GUNICORN_WORKERS={workers}: укажите общий брокер '
+        f'в EVENTS_BROKER или GUNICORN_WORKERS=1'
+    )
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
@@ -1,8 +1,13 @@
 from django.contrib import admin
 from django.contrib.auth.models import Group
+from django.contrib.postgres.aggregates import StringAgg
+from django.db import connection
+from django.db.models import OuterRef, Prefetch, Q, Subquery
 from django.utils.safestring import mark_safe
 
 from recipes.models import (
+    MealPlan,
+    MealPlanEntry,
     Recipe,
     RecipeIngredient,
     Tag,
@@ -10,6 +15,8 @@ from recipes.models import (
     FavouriteRecipe,
     ShoppingList
 )
+from recipes.paginators import EstimatedCountPaginator
+from recipes.search import search_recipes
 
 
 class RecipeIngredientInline(admin.StackedInline):
@@ -29,12 +36,16 @@ class RecipeAdmin(admin.ModelAdmin):
         'get_image'
     )
     readonly_fields = (
-        'get_favorite_count',
+        'favourites_count',
+        'shopping_cart_count',
+        'calories',
+        'cost',
         'get_short_link'
     )
     exclude = (
         'short_link',
     )
+    # Поиск идёт по полнотекстовому индексу (см. get_search_results)
     search_fields = (
         'name',
         'author__username'
@@ -43,11 +54,56 @@ class RecipeAdmin(admin.ModelAdmin):
         'tags',
     )
     inlines = (RecipeIngredientInline,)
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
 
     def get_queryset(self, request):
         self.request = request
-
-        return super().get_queryset(request).select_related('author')
+        queryset = super().get_queryset(request).defer(
+            'search_vector'
+        ).select_related('author')
+
+        if connection.vendor == 'postgresql':
+            # Названия ингредиентов и тегов собирает сама база
+            return queryset.annotate(
+                ingredient_names=Subquery(
+                    RecipeIngredient.objects.filter(
+                        recipe=OuterRef('pk')
+                    ).order_by().values('recipe').annotate(
+                        names=StringAgg(
+                            'ingredient__name', ', ',
+                            ordering='ingredient__name'
+                        )
+                    ).values('names')
+                ),
+                tag_names=Subquery(
+                    Recipe.tags.through.objects.filter(
+                        recipe=OuterRef('pk')
+                    ).order_by().values('recipe').annotate(
+                        names=StringAgg(
+                            'tag__name', ', ', ordering='tag__name'
+                        )
+                    ).values('names')
+                )
+            )
+
+        return queryset.prefetch_related(
+            Prefetch('ingredients', queryset=Ingredient.objects.only('name')),
+            Prefetch('tags', queryset=Tag.objects.only('name'))
+        )
+
+    def get_search_results(self, request, queryset, search_term):
+        # icontains по названию не может использовать индекс, поэтому
+        # ищем по поисковому индексу, а автора - по точному username
+        if not search_term:
+            return queryset, False
+
+        found = search_recipes(
+            Recipe.objects.all(), search_term
+        ).order_by().values('pk')
+        return queryset.filter(
+            Q(pk__in=found) | Q(author__username=search_term)
+        ), False
 
     @admin.display(description='Короткая ссылка')
     def get_short_link(self, obj):
@@ -55,17 +111,19 @@ class RecipeAdmin(admin.ModelAdmin):
             return self.request.build_absolute_uri(f'/s/{obj.short_link}')
         return 'Ссылка появится после сохранения'
 
-    @admin.display(description='В избранном')
-    def get_favorite_count(self, obj):
-        return obj.favourites.count()
-
     @admin.display(description='Ингредиенты')
     def get_ingredients(self, obj):
-        return ', '.join(obj.ingredients.values_list('name', flat=True))
+        if hasattr(obj, 'ingredient_names'):
+            return obj.ingredient_names or ''
+        return ', '.join(
+            sorted(ingredient.name for ingredient in obj.ingredients.all())
+        )
 
     @admin.display(description='Теги')
     def get_tags(self, obj):
-        return ', '.join(obj.tags.values_list('name', flat=True))
+        if hasattr(obj, 'tag_names'):
+            return obj.tag_names or ''
+        return ', '.join(sorted(tag.name for tag in obj.tags.all()))
 
     @admin.display(description='Картинка')
     def get_image(self, obj):
@@ -74,11 +132,29 @@ class RecipeAdmin(admin.ModelAdmin):
 
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
-    list_display = ('name', 'measurement_unit')
+    list_display = ('name', 'measurement_unit', 'calories', 'price')
+
+
+@admin.register(FavouriteRecipe, ShoppingList)
+class UserRecipeRelationAdmin(admin.ModelAdmin):
+    list_select_related = ('user', 'recipe')
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+
+
+class MealPlanEntryInline(admin.TabularInline):
+    model = MealPlanEntry
+    raw_id_fields = ('recipe',)
+    extra = 1
+
+
+@admin.register(MealPlan)
+class MealPlanAdmin(admin.ModelAdmin):
+    list_display = ('name', 'user', 'version')
+    list_select_related = ('user',)
+    inlines = (MealPlanEntryInline,)
 
 
 admin.site.register(Tag)
-admin.site.register(FavouriteRecipe)
-admin.site.register(ShoppingList)
 
 admin.site.unregister(Group)
@@ -0,0 +1,69 @@
+import heapq
+from itertools import groupby, islice
+from operator import itemgetter
+
+from django.db import connection
+from django.db.models import Q
+
+from recipes.models import Recipe
+
+
+# Сколько авторов обрабатывается одним SQL-запросом
+AUTHORS_PER_QUERY = 100
+
+
+def get_author_streams(author_ids, limit, before):
+    """
+    Возвращает по каждому автору до limit его последних рецептов
+    в виде отсортированных по убыванию списков (created_at, id).
+
+    Если база умеет сортировать и ограничивать части UNION, для каждого
+    автора делается отдельный проход по индексу (author, -created_at),
+    и всё это склеивается в один запрос на пачку авторов.
+    """
+    recipes = Recipe.objects.order_by('-created_at', '-id')
+    if before is not None:
+        created_at, pk = before
+        recipes = recipes.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+        )
+
+    streams = []
+    for start in range(0, len(author_ids), AUTHORS_PER_QUERY):
+        chunk = author_ids[start:start + AUTHORS_PER_QUERY]
+
+        if connection.features.supports_slicing_ordering_in_compound:
+            parts = [
+                recipes.filter(author_id=author_id).values_list(
+                    'author_id', 'created_at', 'id'
+                )[:limit]
+                for author_id in chunk
+            ]
+            rows = parts[0]
+            if len(parts) > 1:
+                rows = rows.union(*parts[1:], all=True)
+            rows = sorted(rows)
+        else:
+            rows = recipes.filter(author_id__in=chunk).values_list(
+                'author_id', 'created_at', 'id'
+            )[:limit]
+            rows = sorted(rows)
+
+        for _, author_rows in groupby(rows, key=itemgetter(0)):
+            streams.append(
+                [(created_at, pk) for _, created_at, pk in author_rows][::-1]
+            )
+
+    return streams
+
+
+def get_feed_ids(author_ids, limit, before=None):
+    """
+    Возвращает id не более чем limit последних рецептов указанных авторов,
+    опубликованных раньше позиции before = (created_at, id).
+    Потоки рецептов отдельных авторов сливаются k-way merge.
+    """
+    streams = get_author_streams(author_ids, limit, before)
+    merged = heapq.merge(*streams, reverse=True)
+
+    return [pk for _, pk in islice(merged, limit)]
@@ -0,0 +1,253 @@
+"""
+Инвертированный индекс ингредиент -> рецепты для поиска
+"что приготовить из того, что есть".
+
+Индекс хранится в памяти процесса в виде CSR-массивов NumPy:
+для каждого ингредиента - отсортированный массив позиций рецептов,
+для каждого рецепта - массив его ингредиентов. Запрос обходит только
+списки рецептов запрошенных ингредиентов, поэтому его стоимость
+зависит от их длины, а не от общего количества рецептов.
+
+Изменённые рецепты подтягиваются по Recipe.updated_at, а удалённые
+в других процессах - по записям Tombstone, и хранятся поверх основного
+индекса, пока тот не будет перестроен целиком.
+"""
+import threading
+from datetime import timedelta
+from time import monotonic
+
+import numpy as np
+from django.db.models import Max
+
+from api.constants import (INGREDIENT_INDEX_REBUILD_SECONDS,
+                           INGREDIENT_INDEX_REFRESH_SECONDS)
+from recipes.models import Recipe, RecipeIngredient, Tombstone
+
+
+# Насколько назад смотреть по updated_at, чтобы не пропустить
+# долгие транзакции, закоммиченные уже после прошлой проверки
+REFRESH_OVERLAP = timedelta(seconds=INGREDIENT_INDEX_REFRESH_SECONDS)
+# Если изменённых рецептов слишком много, дешевле перестроить индекс
+MAX_OVERRIDES = 5000
+
+
+def build_csr(keys, values):
+    """
+    Группирует values по keys и возвращает (уникальные keys, indptr,
+    values), где значения для keys[i] лежат в values[indptr[i]:indptr[i+1]].
+    """
+    order = np.argsort(keys, kind='stable')
+    keys, values = keys[order], values[order]
+    unique_keys, starts = np.unique(keys, return_index=True)
+    indptr = np.append(starts, len(keys))
+
+    return unique_keys, indptr, values
+
+
+class IngredientIndex:
+    """
+    Индекс рецептов по ингредиентам с ранжированием по покрытию:
+    доле ингредиентов рецепта, которые уже есть у пользователя.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built_at = None
+        self._checked_at = None
+        self._watermark = None
+        self._deleted_watermark = None
+        self._stale = False
+
+    def _load(self, recipe_ids=None):
+        rows = RecipeIngredient.objects.order_by()
+        if recipe_ids is not None:
+            rows = rows.filter(recipe_id__in=recipe_ids)
+        rows = np.array(
+            list(rows.values_list('recipe_id', 'ingredient_id')),
+            dtype=np.int64
+        ).reshape(-1, 2)
+
+        return rows[:, 0], rows[:, 1]
+
+    def _get_deleted(self):
+        return Tombstone.objects.filter(kind=Tombstone.RECIPE)
+
+    def rebuild(self):
+        watermark = Recipe.objects.order_by('-updated_at').values_list(
+            'updated_at', flat=True
+        ).first()
+        deleted_watermark = self._get_deleted().aggregate(
+            latest=Max('deleted_at')
+        )['latest']
+        recipe_column, ingredient_column = self._load()
+
+        # Позиции рецептов вместо их id, чтобы массивы были плотными
+        recipe_ids, recipe_positions = np.unique(
+            recipe_column, return_inverse=True
+        )
+        recipe_positions = recipe_positions.astype(np.int32)
+        _, recipe_indptr, recipe_ingredients = build_csr(
+            recipe_positions, ingredient_column
+        )
+        ingredient_ids, ingredient_indptr, postings = build_csr(
+            ingredient_column, recipe_positions
+        )
+
+        self.recipe_ids = recipe_ids
+        self.recipe_sizes = np.diff(recipe_indptr).astype(np.int32)
+        self.recipe_indptr = recipe_indptr
+        self.recipe_ingredients = recipe_ingredients
+        self.ingredient_ids = ingredient_ids
+        self.ingredient_indptr = ingredient_indptr
+        self.postings = postings
+        # id рецепта -> его актуальные ингредиенты (пустой массив - удалён)
+        self.overrides = {}
+
+        self._watermark = watermark
+        self._deleted_watermark = deleted_watermark
+        self._built_at = self._checked_at = monotonic()
+        self._stale = False
+
+    def refresh(self):
+        """Подтягивает рецепты, изменённые и удалённые с прошлой проверки."""
+        changed = Recipe.objects.all()
+        if self._watermark is not None:
+            changed = changed.filter(
+                updated_at__gte=self._watermark - REFRESH_OVERLAP
+            )
+        changed = dict(changed.values_list('id', 'updated_at'))
+        deleted = self._get_deleted()
+        if self._deleted_watermark is not None:
+            deleted = deleted.filter(
+                deleted_at__gte=self._deleted_watermark - REFRESH_OVERLAP
+            )
+        deleted = dict(deleted.values_list('object_id', 'deleted_at'))
+        self._checked_at = monotonic()
+        self._stale = False
+        if not changed and not deleted:
+            return
+
+        if len(self.overrides) + len(changed) + len(deleted) > MAX_OVERRIDES:
+            self.rebuild()
+            return
+
+        recipe_column, ingredient_column = self._load(list(changed))
+        for recipe_id in changed:
+            self.overrides[recipe_id] = np.unique(
+                ingredient_column[recipe_column == recipe_id]
+            )
+        for recipe_id in deleted:
+            self.overrides[recipe_id] = np.empty(0, dtype=np.int64)
+        if changed:
+            latest = max(changed.values())
+            if self._watermark is None or latest > self._watermark:
+                self._watermark = latest
+        if deleted:
+            latest = max(deleted.values())
+            if (
+                self._deleted_watermark is None
+                or latest > self._deleted_watermark
+            ):
+                self._deleted_watermark = latest
+
+    def ensure_fresh(self):
+        with self._lock:
+            if self._built_at is None:
+                self.rebuild()
+                return
+
+            now = monotonic()
+            if now - self._built_at > INGREDIENT_INDEX_REBUILD_SECONDS:
+                self.rebuild()
+            elif self._stale or (
+                now - self._checked_at > INGREDIENT_INDEX_REFRESH_SECONDS
+            ):
+                self.refresh()
+
+    def mark_stale(self):
+        """Просит подтянуть изменения при следующем запросе."""
+        self._stale = True
+
+    def remove(self, recipe_id):
+        with self._lock:
+            if self._built_at is not None:
+                self.overrides[recipe_id] = np.empty(0, dtype=np.int64)
+
+    def _base_candidates(self, have):
+        found = np.isin(have, self.ingredient_ids)
+        slots = np.searchsorted(self.ingredient_ids, have[found])
+        if not len(slots):
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        positions = np.concatenate([
+            self.postings[self.ingredient_indptr[slot]:
+                          self.ingredient_indptr[slot + 1]]
+            for slot in slots
+        ])
+        positions, hits = np.unique(positions, return_counts=True)
+
+        recipe_ids = self.recipe_ids[positions]
+        if self.overrides:
+            actual = ~np.isin(
+                recipe_ids, np.fromiter(self.overrides, dtype=np.int64)
+            )
+            recipe_ids, positions, hits = (
+                recipe_ids[actual], positions[actual], hits[actual]
+            )
+
+        return recipe_ids, hits / self.recipe_sizes[positions]
+
+    def _override_candidates(self, have):
+        recipe_ids, coverage = [], []
+        for recipe_id, ingredients in self.overrides.items():
+            if not len(ingredients):
+                continue
+            hits = np.isin(ingredients, have).sum()
+            if hits:
+                recipe_ids.append(recipe_id)
+                coverage.append(hits / len(ingredients))
+
+        return np.array(recipe_ids, dtype=np.int64), np.array(coverage)
+
+    def _get_ingredients(self, recipe_id):
+        if recipe_id in self.overrides:
+            return self.overrides[recipe_id]
+
+        position = np.searchsorted(self.recipe_ids, recipe_id)
+        return self.recipe_ingredients[
+            self.recipe_indptr[position]:self.recipe_indptr[position + 1]
+        ]
+
+    def search(self, ingredient_ids, limit):
+        """
+        Возвращает до limit рецептов с наибольшим покрытием в виде
+        списка (id рецепта, покрытие, id недостающих ингредиентов).
+        """
+        self.ensure_fresh()
+        have = np.unique(np.asarray(ingredient_ids, dtype=np.int64))
+
+        with self._lock:
+            base_ids, base_coverage = self._base_candidates(have)
+            extra_ids, extra_coverage = self._override_candidates(have)
+            recipe_ids = np.concatenate((base_ids, extra_ids))
+            coverage = np.concatenate((base_coverage, extra_coverage))
+
+            if len(recipe_ids) > limit:
+                top = np.argpartition(-coverage, limit - 1)[:limit]
+                recipe_ids, coverage = recipe_ids[top], coverage[top]
+            # По убыванию покрытия, при равенстве - сначала новые рецепты
+            order = np.lexsort((-recipe_ids, -coverage))
+
+            return [
+                (
+                    int(recipe_ids[i]),
+                    float(coverage[i]),
+                    np.setdiff1d(
+                        self._get_ingredients(recipe_ids[i]), have
+                    ).tolist()
+                )
+                for i in order
+            ]
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,38 @@
+from time import sleep
+
+from django.core.management.base import BaseCommand
+
+from api.constants import TOGGLE_EVENTS_BATCH_SIZE
+from recipes.toggles import apply_events
+
+
+class Command(BaseCommand):
+    help = ('Переносит накопленные события избранного и списков покупок '
+            'в таблицы и обновляет счётчики рецептов')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=TOGGLE_EVENTS_BATCH_SIZE,
+            help='Сколько событий применять в одной транзакции'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=0,
+            help='Работать постоянно, проверяя журнал раз в столько секунд'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            total = 0
+            while processed := apply_events(options['batch_size']):
+                total += processed
+            if total or not options['interval']:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Применено событий: {total}'
+                ))
+            if not options['interval']:
+                return
+            sleep(options['interval'])
@@ -0,0 +1,77 @@
+from statistics import mean, median
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import connection
+from django.db.backends.signals import connection_created
+from rest_framework.test import APIRequestFactory
+
+from api.views import RecipeViewSet
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает время запросов к списку рецептов с новым '
+            'соединением на каждый запрос и с переиспользованием соединений')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=200,
+            help='Сколько запросов выполнить в каждом режиме'
+        )
+        parser.add_argument(
+            '--max-age',
+            type=int,
+            default=60,
+            help='CONN_MAX_AGE для режима с постоянными соединениями'
+        )
+
+    def run(self, max_age, count):
+        """
+        Выполняет count запросов к RecipeViewSet.list так же, как это
+        делает обработчик запросов, и возвращает их длительности
+        и количество открытых соединений.
+        """
+        view = RecipeViewSet.as_view({'get': 'list'})
+        factory = APIRequestFactory()
+        connects = []
+
+        def count_connect(**kwargs):
+            connects.append(1)
+
+        connection.close()
+        connection.settings_dict['CONN_MAX_AGE'] = max_age
+        connection_created.connect(count_connect)
+        timings = []
+        try:
+            for _ in range(count):
+                started = perf_counter()
+                request_started.send(sender=self.__class__)
+                try:
+                    view(factory.get('/api/recipes/')).render()
+                finally:
+                    request_finished.send(sender=self.__class__)
+                timings.append((perf_counter() - started) * 1000)
+        finally:
+            connection_created.disconnect(count_connect)
+            connection.close()
+
+        return timings, len(connects)
+
+    def handle(self, *args, **options):
+        max_age = connection.settings_dict['CONN_MAX_AGE']
+        try:
+            for mode_max_age in (0, options['max_age']):
+                timings, connects = self.run(mode_max_age, options['requests'])
+                timings.sort()
+                self.stdout.write(
+                    f'CONN_MAX_AGE={mode_max_age}: '
+                    f'среднее {mean(timings):.2f} мс, '
+                    f'медиана {median(timings):.2f} мс, '
+                    f'p95 {timings[int(len(timings) * 0.95)]:.2f} мс, '
+                    f'соединений открыто: {connects}'
+                )
+        finally:
+            connection.settings_dict['CONN_MAX_AGE'] = max_age
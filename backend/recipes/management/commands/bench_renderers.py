@@ -0,0 +1,58 @@
+import gzip
+from statistics import median
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from api.renderers import COMPACT_RENDERERS
+from api.views import IngredientViewSet, RecipeViewSet
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает размер ответа и время его кодирования в JSON '
+            'и в компактных форматах для списков рецептов и ингредиентов')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=100,
+            help='Сколько рецептов на странице'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=50,
+            help='Сколько раз кодировать каждый ответ'
+        )
+
+    def get_data(self, viewset, path):
+        view = viewset.as_view({'get': 'list'})
+        return view(APIRequestFactory().get(path)).data
+
+    def handle(self, *args, **options):
+        endpoints = (
+            ('рецепты', self.get_data(
+                RecipeViewSet, f'/api/recipes/?limit={options["limit"]}'
+            )),
+            ('ингредиенты', self.get_data(
+                IngredientViewSet, '/api/ingredients/'
+            )),
+        )
+        for name, data in endpoints:
+            self.stdout.write(f'{name}:')
+            for renderer_class in (JSONRenderer, *COMPACT_RENDERERS):
+                renderer = renderer_class()
+                timings = []
+                for _ in range(options['repeat']):
+                    started = perf_counter()
+                    content = renderer.render(data)
+                    timings.append((perf_counter() - started) * 1000)
+                self.stdout.write(
+                    f'  {renderer_class.media_type}: '
+                    f'{len(content)} байт, '
+                    f'gzip {len(gzip.compress(content))} байт, '
+                    f'кодирование {median(timings):.2f} мс'
+                )
@@ -0,0 +1,86 @@
+import os
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.constants import RECOMMENDATIONS_NEIGHBOURS, RECOMMENDATIONS_TOP_N
+from recipes.models import RecommendedRecipe
+from recipes.recommendations import (build_interaction_matrix,
+                                     load_interactions,
+                                     recommend,
+                                     train_item_similarity)
+
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает персональные рекомендации рецептов по избранному '
+            'и спискам покупок и сохраняет их в RecommendedRecipe')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top-n',
+            type=int,
+            default=RECOMMENDATIONS_TOP_N,
+            help='Сколько рекомендаций хранить для каждого пользователя'
+        )
+        parser.add_argument(
+            '--neighbours',
+            type=int,
+            default=RECOMMENDATIONS_NEIGHBOURS,
+            help='Сколько похожих рецептов учитывать для каждого рецепта'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Сколько строк матрицы считать за раз'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Количество процессов для расчёта схожести'
+        )
+
+    def handle(self, *args, **options):
+        started = perf_counter()
+
+        user_ids, recipe_ids, interactions = build_interaction_matrix(
+            *load_interactions()
+        )
+        similarity = train_item_similarity(
+            interactions,
+            neighbours=options['neighbours'],
+            chunk_size=options['chunk_size'],
+            workers=options['workers']
+        )
+        recommendations = [
+            RecommendedRecipe(user_id=user_id, recipe_id=recipe_id,
+                              score=score)
+            for rows, columns, scores in recommend(
+                interactions,
+                similarity,
+                top_n=options['top_n'],
+                chunk_size=options['chunk_size']
+            )
+            for user_id, recipe_id, score in zip(
+                user_ids[rows].tolist(),
+                recipe_ids[columns].tolist(),
+                scores.tolist()
+            )
+        ]
+
+        with transaction.atomic():
+            RecommendedRecipe.objects.all().delete()
+            RecommendedRecipe.objects.bulk_create(
+                recommendations, batch_size=BATCH_SIZE
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Сохранено {len(recommendations)} рекомендаций '
+            f'для {len(user_ids)} пользователей '
+            f'за {perf_counter() - started:.1f} с'
+        ))
@@ -0,0 +1,69 @@
+import os
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.constants import RELATED_RECIPES_TAG_WEIGHT, RELATED_RECIPES_TOP_K
+from recipes.models import RelatedRecipe
+from recipes.related import build_feature_matrix, compute_related
+
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает похожие рецепты по общим ингредиентам и тегам '
+            'и сохраняет их в RelatedRecipe')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top-k',
+            type=int,
+            default=RELATED_RECIPES_TOP_K,
+            help='Сколько похожих рецептов хранить для каждого рецепта'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Сколько строк матрицы схожести считать за раз'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Количество процессов для расчёта'
+        )
+
+    def handle(self, *args, **options):
+        started = perf_counter()
+
+        recipe_ids, features = build_feature_matrix(
+            RELATED_RECIPES_TAG_WEIGHT
+        )
+        sources, targets, scores = compute_related(
+            features,
+            top_k=options['top_k'],
+            chunk_size=options['chunk_size'],
+            workers=options['workers']
+        )
+        related = [
+            RelatedRecipe(recipe_id=recipe_id, related_id=related_id,
+                          score=score)
+            for recipe_id, related_id, score in zip(
+                recipe_ids[sources].tolist(),
+                recipe_ids[targets].tolist(),
+                scores.tolist()
+            )
+        ]
+
+        with transaction.atomic():
+            RelatedRecipe.objects.all().delete()
+            RelatedRecipe.objects.bulk_create(related, batch_size=BATCH_SIZE)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Сохранено {len(related)} пар похожих рецептов '
+            f'для {len(recipe_ids)} рецептов '
+            f'за {perf_counter() - started:.1f} с'
+        ))
@@ -0,0 +1,76 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from api.constants import RECOMMENDATIONS_NEIGHBOURS, RECOMMENDATIONS_TOP_N
+from recipes.recommendations import (evaluate,
+                                     generate_interactions,
+                                     load_interactions)
+
+
+class Command(BaseCommand):
+    help = ('Оценивает качество и скорость рекомендаций методом '
+            'leave-one-out на данных из базы или на синтетических данных')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--synthetic',
+            type=int,
+            default=0,
+            help='Сгенерировать столько взаимодействий вместо данных из базы'
+        )
+        parser.add_argument(
+            '--top-n',
+            type=int,
+            default=RECOMMENDATIONS_TOP_N
+        )
+        parser.add_argument(
+            '--neighbours',
+            type=int,
+            default=RECOMMENDATIONS_NEIGHBOURS
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count()
+        )
+        parser.add_argument(
+            '--sample-users',
+            type=int,
+            default=10000,
+            help='Сколько пользователей использовать для оценки'
+        )
+
+    def handle(self, *args, **options):
+        if options['synthetic']:
+            interactions = generate_interactions(options['synthetic'])
+        else:
+            interactions = load_interactions()
+
+        result = evaluate(
+            *interactions,
+            top_n=options['top_n'],
+            neighbours=options['neighbours'],
+            chunk_size=options['chunk_size'],
+            workers=options['workers'],
+            sample_users=options['sample_users']
+        )
+
+        self.stdout.write(
+            f'Взаимодействий: {result["interactions"]}, '
+            f'пользователей: {result["users"]}, '
+            f'рецептов: {result["recipes"]}'
+        )
+        self.stdout.write(
+            f'Hit rate@{options["top_n"]}: {result["hit_rate"]:.3f} '
+            f'на {result["evaluated_users"]} пользователях'
+        )
+        self.stdout.write(
+            f'Обучение: {result["train_seconds"]:.1f} с, '
+            f'рекомендации: {result["recommend_seconds"]:.1f} с'
+        )
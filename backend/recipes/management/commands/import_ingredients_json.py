@@ -3,24 +3,39 @@ import json
 from pathlib import Path
 
 from django.core.management.base import BaseCommand
+from django.db import transaction
 
-from recipes.models import Ingredient
+from recipes.meal_plans import bump_versions
+from recipes.models import Ingredient, MealPlan, RecipeIngredient
+from recipes.nutrition import refresh_recipe_totals
+from recipes.units import unit_catalog
 
 
 class Command(BaseCommand):
     help = ('Импортирует ингредиенты из ingredients.json '
             'или ingredients.csv в базу данных')
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file',
+            help='Путь к JSON-файлу вместо backend/data/ingredients.json. '
+                 'Кроме name и measurement_unit в записях могут быть '
+                 'calories, proteins, fats, carbohydrates и price, '
+                 'они обновляются и у уже существующих ингредиентов'
+        )
+
     def handle(self, *args, **kwargs):
         data_dir = os.path.join(Path(
             __file__
         ).resolve().parent.parent.parent.parent, 'data')
 
-        json_file = os.path.join(data_dir, 'ingredients.json')
+        json_file = kwargs['file'] or os.path.join(
+            data_dir, 'ingredients.json'
+        )
         if os.path.exists(json_file):
             self.import_from_json(json_file)
         else:
-            self.stdout.write('backend/data/ingredients.json не найден')
+            self.stdout.write(f'{json_file} не найден')
 
     def import_from_json(self, file_path):
         """Импорт из JSON файла"""
@@ -33,10 +48,63 @@ class Command(BaseCommand):
             ingredients = [
                 Ingredient(
                     name=item['name'],
-                    measurement_unit=item['measurement_unit'])
+                    measurement_unit=item['measurement_unit'],
+                    **{
+                        field: item.get(field)
+                        for field in Ingredient.nutrition_fields
+                    })
                 for item in ingredients_data
             ]
 
             Ingredient.objects.bulk_create(ingredients, ignore_conflicts=True)
 
+        fields = [
+            field for field in Ingredient.nutrition_fields
+            if any(field in item for item in ingredients_data)
+        ]
+        if fields:
+            self.update_nutrition(ingredients_data, fields)
+
         self.stdout.write(self.style.SUCCESS('Импорт из JSON завершен!'))
+
+    @transaction.atomic
+    def update_nutrition(self, ingredients_data, fields):
+        """
+        Обновляет пищевую ценность и цену у уже существующих ингредиентов
+        и пересчитывает итоги их рецептов.
+        """
+        existing = {
+            (name, measurement_unit): pk
+            for pk, name, measurement_unit in Ingredient.objects.filter(
+                name__in={item['name'] for item in ingredients_data}
+            ).values_list('pk', 'name', 'measurement_unit')
+        }
+        # Отсутствующие в записи поля не трогаем, поэтому записи
+        # обновляются группами с одинаковым набором полей
+        groups = {}
+        for item in ingredients_data:
+            pk = existing.get((item['name'], item['measurement_unit']))
+            present = tuple(field for field in fields if field in item)
+            if pk is not None and present:
+                groups.setdefault(present, []).append(Ingredient(
+                    pk=pk, **{field: item[field] for field in present}
+                ))
+        ingredients = []
+        for present, group in groups.items():
+            Ingredient.objects.bulk_update(group, present, batch_size=1000)
+            ingredients += group
+
+        unit_catalog.invalidate()
+        # bulk_update не отправляет сигналы, поэтому версии планов
+        # с этими ингредиентами увеличиваем сами
+        bump_versions(MealPlan.objects.filter(
+            entries__recipe__recipe_ingredients__ingredient__in=[
+                ingredient.pk for ingredient in ingredients
+            ]
+        ))
+        updated = refresh_recipe_totals(
+            RecipeIngredient.objects.filter(
+                ingredient__in=[ingredient.pk for ingredient in ingredients]
+            ).values_list('recipe_id', flat=True).distinct()
+        )
+        self.stdout.write(f'Пересчитаны итоги {updated} рецептов')
@@ -0,0 +1,83 @@
+from concurrent.futures import ThreadPoolExecutor
+from statistics import median
+from time import perf_counter
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест запущенного сервера: для каждого уровня '
+            'конкурентности выводит пропускную способность, задержки '
+            'и долю ошибок. Позволяет сравнить режимы SERVER_MODE=wsgi '
+            'и SERVER_MODE=asgi на одном и том же железе')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'urls',
+            nargs='+',
+            help='Адреса, которые запрашиваются по кругу'
+        )
+        parser.add_argument(
+            '--concurrency',
+            default='1,10,50,100,200',
+            help='Уровни конкурентности через запятую'
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=500,
+            help='Сколько запросов выполнить на каждом уровне'
+        )
+        parser.add_argument(
+            '--token',
+            help='Токен для запросов от имени пользователя'
+        )
+        parser.add_argument(
+            '--timeout',
+            type=float,
+            default=30,
+            help='Таймаут одного запроса, секунды'
+        )
+
+    def fetch(self, url, token, timeout):
+        request = Request(url)
+        if token:
+            request.add_header('Authorization', f'Token {token}')
+        started = perf_counter()
+        try:
+            with urlopen(request, timeout=timeout) as response:
+                response.read()
+                ok = response.status < 500
+        except HTTPError as error:
+            ok = error.code < 500
+        except (URLError, OSError):
+            ok = False
+
+        return perf_counter() - started, ok
+
+    def handle(self, *args, **options):
+        urls = options['urls']
+        for concurrency in map(int, options['concurrency'].split(',')):
+            started = perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                results = list(executor.map(
+                    lambda number: self.fetch(
+                        urls[number % len(urls)],
+                        options['token'],
+                        options['timeout']
+                    ),
+                    range(options['requests'])
+                ))
+            elapsed = perf_counter() - started
+
+            timings = sorted(timing * 1000 for timing, _ in results)
+            errors = sum(1 for _, ok in results if not ok)
+            self.stdout.write(
+                f'конкурентность {concurrency}: '
+                f'{len(results) / elapsed:.1f} запросов/с, '
+                f'медиана {median(timings):.1f} мс, '
+                f'p95 {timings[int(len(timings) * 0.95)]:.1f} мс, '
+                f'ошибок {errors / len(results):.1%}'
+            )
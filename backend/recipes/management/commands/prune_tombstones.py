@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import Tombstone
+from recipes.sync import get_retention_start
+
+
+class Command(BaseCommand):
+    help = ('Удаляет записи об удалениях старше срока хранения, '
+            'клиенты с более старым токеном синхронизируются заново')
+
+    def handle(self, *args, **options):
+        deleted, _ = Tombstone.objects.filter(
+            deleted_at__lt=get_retention_start()
+        ).delete()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено записей: {deleted}'
+        ))
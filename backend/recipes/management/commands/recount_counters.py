@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import FavouriteRecipe, Recipe, ShoppingList, User
+from users.models import Subscription
+
+
+def count_subquery(queryset, field):
+    """Подзапрос с количеством строк queryset для объекта из OuterRef."""
+    return Coalesce(Subquery(
+        queryset.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(
+            count=Count('pk')
+        ).values('count')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = ('Сверяет денормализованные счётчики рецептов и пользователей '
+            'с реальным количеством записей и исправляет расхождения')
+
+    def handle(self, *args, **kwargs):
+        counters = (
+            (Recipe, 'favourites_count', FavouriteRecipe.objects, 'recipe'),
+            (Recipe, 'shopping_cart_count', ShoppingList.objects, 'recipe'),
+            (User, 'recipes_count', Recipe.objects, 'author'),
+            (User, 'subscribers_count', Subscription.objects, 'author'),
+        )
+
+        for model, counter_field, related, field in counters:
+            actual = count_subquery(related, field)
+            drifted = list(
+                model.objects.annotate(
+                    actual=actual
+                ).exclude(
+                    **{counter_field: F('actual')}
+                ).values_list('pk', flat=True)
+            )
+            if drifted:
+                model.objects.filter(pk__in=drifted).update(
+                    **{counter_field: actual}
+                )
+
+            self.stdout.write(
+                f'{model.__name__}.{counter_field}: '
+                f'исправлено {len(drifted)}'
+            )
+
+        self.stdout.write(self.style.SUCCESS('Счётчики пересчитаны!'))
@@ -0,0 +1,73 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from api.constants import POPULARITY_LAG_SECONDS
+from recipes.models import Recipe, Watermark
+from recipes.popularity import (EPOCH,
+                                collect_contributions,
+                                get_removed_recipe_ids,
+                                logaddexp2)
+
+
+WATERMARK_NAME = 'popularity'
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = ('Обновляет рейтинг популярности рецептов по записям избранного '
+            'и списков покупок, добавленным с прошлого запуска')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Пересчитать рейтинг всех рецептов с нуля'
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        until = timezone.now() - timedelta(seconds=POPULARITY_LAG_SECONDS)
+
+        watermark, _ = Watermark.objects.select_for_update().get_or_create(
+            name=WATERMARK_NAME,
+            defaults={'value': EPOCH}
+        )
+        since = watermark.value
+        if options['full']:
+            Recipe.objects.update(popularity_score=0)
+            since = None
+
+        contributions = collect_contributions(since, until)
+        # Рецепты, из которых что-то удалили, считаются заново с нуля
+        # по оставшимся записям (см. recipes.popularity)
+        removed = set()
+        if since is not None:
+            removed = get_removed_recipe_ids(since, until)
+        if removed:
+            Recipe.objects.filter(pk__in=removed).update(popularity_score=0)
+            for recipe_id in removed:
+                contributions.pop(recipe_id, None)
+            contributions.update(
+                collect_contributions(None, until, recipe_ids=removed)
+            )
+        recipe_ids = list(contributions)
+
+        for start in range(0, len(recipe_ids), BATCH_SIZE):
+            recipes = list(Recipe.objects.filter(
+                pk__in=recipe_ids[start:start + BATCH_SIZE]
+            ).only('popularity_score'))
+            for recipe in recipes:
+                recipe.popularity_score = logaddexp2(
+                    recipe.popularity_score, contributions[recipe.pk]
+                )
+            Recipe.objects.bulk_update(recipes, ('popularity_score',))
+
+        watermark.value = until
+        watermark.save(update_fields=('value',))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Рейтинг обновлён у {len(removed.union(recipe_ids))} рецептов'
+        ))
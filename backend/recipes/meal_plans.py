@@ -0,0 +1,95 @@
+"""
+Список покупок по плану питания за период.
+
+Количества ингредиентов всех записей плана за период, пересчитанные
+на порции записи, складывает база одним сгруппированным запросом,
+а единицы измерения и похожие ингредиенты сводит unit_catalog, как
+и для обычного списка покупок. Количества здесь не округляются по
+записям: за неделю точная сумма полезнее.
+
+Готовый список кэшируется по (план, версия, период). Версия плана
+увеличивается при изменении его записей, входящих в него рецептов
+и их ингредиентов (см. recipes.signals), поэтому повторное скачивание
+без изменений не делает запросов, кроме чтения самого плана.
+"""
+from django.core.cache import cache
+from django.db.models import ExpressionWrapper, F, FloatField, Sum
+from django.db.models.functions import Cast
+
+from api import metrics
+from api.constants import MEAL_PLAN_SHOPPING_LIST_CACHE_SECONDS
+from recipes.nutrition import get_totals
+from recipes.units import unit_catalog
+
+
+def bump_versions(plans):
+    """Увеличивает версию планов, чтобы их списки покупок пересобрались."""
+    plans.update(version=F('version') + 1)
+
+
+def get_entries(plan, start=None, end=None):
+    entries = plan.entries.all()
+    if start is not None:
+        entries = entries.filter(date__gte=start)
+    if end is not None:
+        entries = entries.filter(date__lte=end)
+
+    return entries
+
+
+def get_rows(entries):
+    """
+    Пары (id ингредиента, количество) по записям плана: сумма
+    количества в рецепте, умноженного на отношение порций, одним
+    запросом с группировкой по ингредиенту.
+    """
+    # Приводим к float до деления, чтобы база не делила нацело
+    amount = ExpressionWrapper(
+        Cast('recipe__recipe_ingredients__amount', FloatField())
+        * F('servings') / F('recipe__servings'),
+        output_field=FloatField()
+    )
+
+    return list(
+        entries.filter(
+            recipe__recipe_ingredients__isnull=False
+        ).values(
+            'recipe__recipe_ingredients__ingredient_id'
+        ).annotate(
+            total_amount=Sum(amount)
+        ).order_by().values_list(
+            'recipe__recipe_ingredients__ingredient_id', 'total_amount'
+        )
+    )
+
+
+def get_shopping_list(plan, start=None, end=None):
+    """
+    Возвращает для записей плана за период (границы включаются)
+    рецепты, сводный список их ингредиентов и итоговые пищевую
+    ценность и стоимость - в том же виде, что get_shopping_cart.
+    """
+    key = f'meal_plan_shopping_list:{plan.pk}:{plan.version}:{start}:{end}'
+    shopping_list = cache.get(key)
+    if shopping_list is not None:
+        metrics.increment('meal_plan_shopping_list.hit')
+        return shopping_list
+    metrics.increment('meal_plan_shopping_list.miss')
+
+    entries = get_entries(plan, start, end)
+    recipes = [
+        {
+            'date': entry['date'],
+            'name': entry['recipe__name'],
+            'cooking_time': entry['recipe__cooking_time'],
+            'servings': entry['servings']
+        }
+        for entry in entries.values(
+            'date', 'recipe__name', 'recipe__cooking_time', 'servings'
+        )
+    ]
+    rows = get_rows(entries)
+    shopping_list = recipes, unit_catalog.aggregate(rows), get_totals(rows)
+    cache.set(key, shopping_list, MEAL_PLAN_SHOPPING_LIST_CACHE_SECONDS)
+
+    return shopping_list
@@ -0,0 +1,73 @@
+# Generated by Django 3.2.3 on 2026-10-19 09:42
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX recipe_search_vector_idx '
+            'ON recipes_recipe USING gin (search_vector)'
+        )
+        schema_editor.execute(
+            "UPDATE recipes_recipe r SET search_vector = "
+            "setweight(to_tsvector('russian', coalesce(r.name, '')), 'A') "
+            "|| setweight(to_tsvector('russian', coalesce(("
+            "SELECT string_agg(i.name, ' ') "
+            "FROM recipes_recipeingredient ri "
+            "JOIN recipes_ingredient i ON i.id = ri.ingredient_id "
+            "WHERE ri.recipe_id = r.id), '')), 'B') "
+            "|| setweight(to_tsvector('russian', coalesce(r.text, '')), 'C')"
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE recipes_recipe_fts '
+            "USING fts5(name, text, ingredients, tokenize='unicode61')"
+        )
+        schema_editor.execute(
+            'INSERT INTO recipes_recipe_fts (rowid, name, text, ingredients) '
+            'SELECT r.id, r.name, r.text, '
+            "COALESCE(GROUP_CONCAT(i.name, ' '), '') "
+            'FROM recipes_recipe r '
+            'LEFT JOIN recipes_recipeingredient ri ON ri.recipe_id = r.id '
+            'LEFT JOIN recipes_ingredient i ON i.id = ri.ingredient_id '
+            'GROUP BY r.id'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX recipe_search_vector_idx')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE recipes_recipe_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_recipe_author_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        # GIN-индекс есть только в Postgres, в SQLite вместо него FTS5
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='recipe',
+                    index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='recipe_search_vector_idx'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(create_search_index, drop_search_index),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.3 on 2026-10-19 09:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedRecipe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(verbose_name='Схожесть')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_recipes', to='recipes.recipe', verbose_name='Рецепт')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_to', to='recipes.recipe', verbose_name='Похожий рецепт')),
+            ],
+            options={
+                'verbose_name': 'похожий рецепт',
+                'verbose_name_plural': 'Похожие рецепты',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='relatedrecipe',
+            index=models.Index(fields=['recipe', '-score'], name='related_recipe_score_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='relatedrecipe',
+            constraint=models.UniqueConstraint(fields=('recipe', 'related'), name='unique_recipe_related'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.3 on 2026-10-19 09:48
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0010_auto_20261019_1245'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendedRecipe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(verbose_name='Оценка')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='recipes.recipe', verbose_name='Рецепт')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'рекомендация',
+                'verbose_name_plural': 'Рекомендации',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='recommendedrecipe',
+            index=models.Index(fields=['user', '-score'], name='recommendation_score_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='recommendedrecipe',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_user_recommended_recipe'),
+        ),
+    ]
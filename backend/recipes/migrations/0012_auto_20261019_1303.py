@@ -0,0 +1,36 @@
+# Generated by Django 3.2.3 on 2026-10-19 10:03
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0011_auto_20261019_1248'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ToggleEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('favourite', 'Избранное'), ('shopping_cart', 'Список покупок')], max_length=16, verbose_name='Куда')),
+                ('added', models.BooleanField(verbose_name='Добавлен')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создано')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='toggle_events', to='recipes.recipe', verbose_name='Рецепт')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='toggle_events', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'отложенное изменение',
+                'verbose_name_plural': 'Отложенные изменения',
+                'ordering': ('id',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='toggleevent',
+            index=models.Index(fields=['user', 'id'], name='toggle_event_user_idx'),
+        ),
+    ]
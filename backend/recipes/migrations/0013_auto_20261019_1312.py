@@ -0,0 +1,46 @@
+# Generated by Django 3.2.3 on 2026-10-19 10:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0012_auto_20261019_1303'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('recipe', 'Рецепт'), ('favourite', 'Избранное'), ('shopping_cart', 'Список покупок'), ('subscription', 'Подписка')], max_length=16, verbose_name='Что удалено')),
+                ('object_id', models.BigIntegerField(verbose_name='id рецепта или автора')),
+                ('deleted_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Удалено')),
+            ],
+            options={
+                'verbose_name': 'удаление',
+                'verbose_name_plural': 'Удаления',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='favouriterecipe',
+            index=models.Index(fields=['user', 'created_at'], name='favouriterecipe_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shoppinglist',
+            index=models.Index(fields=['user', 'created_at'], name='shoppinglist_user_idx'),
+        ),
+        migrations.AddField(
+            model_name='tombstone',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['user', 'deleted_at'], name='tombstone_user_deleted_idx'),
+        ),
+    ]
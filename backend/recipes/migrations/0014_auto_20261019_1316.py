@@ -0,0 +1,64 @@
+# Generated by Django 3.2.3 on 2026-10-19 10:16
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_auto_20261019_1312'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='calories',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Калорийность, ккал'),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='carbohydrates',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Углеводы, г'),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='fats',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Жиры, г'),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='price',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Цена, руб.'),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='proteins',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(0)], verbose_name='Белки, г'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='calories',
+            field=models.FloatField(editable=False, null=True, verbose_name='Калорийность, ккал'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='carbohydrates',
+            field=models.FloatField(editable=False, null=True, verbose_name='Углеводы, г'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='cost',
+            field=models.FloatField(editable=False, null=True, verbose_name='Стоимость, руб.'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='fats',
+            field=models.FloatField(editable=False, null=True, verbose_name='Жиры, г'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='proteins',
+            field=models.FloatField(editable=False, null=True, verbose_name='Белки, г'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.3 on 2026-10-19 10:21
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_auto_20261019_1316'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='servings',
+            field=models.PositiveSmallIntegerField(default=1, validators=[django.core.validators.MinValueValidator(1, message='Порций не может быть меньше 1'), django.core.validators.MaxValueValidator(100, message='Порций не может быть больше 100')], verbose_name='Порций'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 3.2.3 on 2026-10-19 10:23
+
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0015_recipe_servings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MealPlan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=128, verbose_name='Название')),
+                ('version', models.PositiveIntegerField(default=0, editable=False, verbose_name='Версия')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Добавлено')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='meal_plans', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'план питания',
+                'verbose_name_plural': 'Планы питания',
+                'ordering': ('-created_at',),
+            },
+        ),
+        migrations.CreateModel(
+            name='MealPlanEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('servings', models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1, message='Порций не может быть меньше 1'), django.core.validators.MaxValueValidator(100, message='Порций не может быть больше 100')], verbose_name='Порций')),
+                ('plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='recipes.mealplan', verbose_name='План питания')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='meal_plan_entries', to='recipes.recipe', verbose_name='Рецепт')),
+            ],
+            options={
+                'verbose_name': 'запись плана питания',
+                'verbose_name_plural': 'Записи плана питания',
+                'ordering': ('date', 'pk'),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='mealplanentry',
+            index=models.Index(fields=['plan', 'date'], name='meal_plan_entry_date_idx'),
+        ),
+    ]
@@ -1,12 +1,19 @@
 from hashids import Hashids
 
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.contrib.auth import get_user_model
-from django.core.validators import MinValueValidator
+from django.core.validators import MaxValueValidator, MinValueValidator
 
 from api.constants import (
+    DEFAULT_SERVINGS,
     MAX_CHAR_LENGTH,
     MAX_LENGTH_SHORT_LINK,
+    MAX_MEAL_PLAN_NAME_LENGTH,
+    MAX_WATERMARK_NAME_LENGTH,
+    MAX_TOGGLE_EVENT_KIND_LENGTH,
+    MAX_TOMBSTONE_KIND_LENGTH,
     MAX_TAG_NAME_CHAR_LENGTH,
     MAX_TAG_SLUG_CHAR_LENGTH,
     MAX_INGREDIENT_NAME_CHAR_LENGTH,
@@ -14,11 +21,22 @@ from api.constants import (
     MIN_INGREDIENT_AMOUNT_QUANTITY,
     MIN_HASHIDS_LENGTH,
     MIN_COOKING_TIME,
+    MIN_SERVINGS,
+    MAX_SERVINGS,
     STR_OUTPUT_SLICE,
 )
 
 
 User = get_user_model()
+
+SERVINGS_VALIDATORS = (
+    MinValueValidator(
+        MIN_SERVINGS,
+        message=f'Порций не может быть меньше {MIN_SERVINGS}'),
+    MaxValueValidator(
+        MAX_SERVINGS,
+        message=f'Порций не может быть больше {MAX_SERVINGS}'),
+)
 hashids = Hashids(min_length=MIN_HASHIDS_LENGTH)
 
 
@@ -49,6 +67,11 @@ class Recipe(models.Model):
                     f'{MIN_COOKING_TIME}'),),
         verbose_name='Время приготовления',
     )
+    servings = models.PositiveSmallIntegerField(
+        default=DEFAULT_SERVINGS,
+        validators=SERVINGS_VALIDATORS,
+        verbose_name='Порций',
+    )
     image = models.ImageField(
         upload_to='recipes/images/',
     )
@@ -62,17 +85,83 @@ class Recipe(models.Model):
         auto_now_add=True,
         verbose_name='Добавлено'
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+        verbose_name='Изменено'
+    )
     short_link = models.CharField(
         max_length=MAX_LENGTH_SHORT_LINK,
         blank=True,
         unique=True,
         null=True
     )
+    favourites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном'
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В списках покупок'
+    )
+    popularity_score = models.FloatField(
+        default=0,
+        editable=False,
+        verbose_name='Популярность'
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False
+    )
+    # Итоги по ингредиентам, их пересчитывает recipes.nutrition.
+    # Пусто, если хотя бы у одного ингредиента значение не заполнено
+    calories = models.FloatField(
+        null=True,
+        editable=False,
+        verbose_name='Калорийность, ккал'
+    )
+    proteins = models.FloatField(
+        null=True,
+        editable=False,
+        verbose_name='Белки, г'
+    )
+    fats = models.FloatField(
+        null=True,
+        editable=False,
+        verbose_name='Жиры, г'
+    )
+    carbohydrates = models.FloatField(
+        null=True,
+        editable=False,
+        verbose_name='Углеводы, г'
+    )
+    cost = models.FloatField(
+        null=True,
+        editable=False,
+        verbose_name='Стоимость, руб.'
+    )
 
     class Meta:
         verbose_name = 'рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-created_at',)
+        indexes = (
+            models.Index(
+                fields=('-popularity_score', '-created_at'),
+                name='recipe_popularity_idx'
+            ),
+            models.Index(
+                fields=('author', '-created_at'),
+                name='recipe_author_created_idx'
+            ),
+            # Создаётся только в Postgres, см. миграцию 0008
+            GinIndex(
+                fields=('search_vector',),
+                name='recipe_search_vector_idx'
+            ),
+        )
 
     def save(self, *args, **kwargs):
         if self.pk is None:
@@ -109,7 +198,21 @@ class Tag(models.Model):
 
 
 class Ingredient(models.Model):
-    """Модель 'Ингридиента'."""
+    """
+    Модель 'Ингридиента'.
+    Пищевая ценность и цена указываются на 100 г или 100 мл для
+    ингредиентов, которые меряются по массе или объёму, и на одну
+    единицу измерения для остальных.
+    """
+
+    # Поле ингредиента -> поле с итогом в модели Recipe
+    nutrition_fields = {
+        'calories': 'calories',
+        'proteins': 'proteins',
+        'fats': 'fats',
+        'carbohydrates': 'carbohydrates',
+        'price': 'cost',
+    }
 
     name = models.CharField(
         max_length=MAX_INGREDIENT_NAME_CHAR_LENGTH,
@@ -119,6 +222,36 @@ class Ingredient(models.Model):
         max_length=MAX_INGREDIENT_MEASUREMENT_UNIT_CHAR_LENGTH,
         verbose_name='Мера измерения'
     )
+    calories = models.FloatField(
+        null=True,
+        blank=True,
+        validators=(MinValueValidator(0),),
+        verbose_name='Калорийность, ккал'
+    )
+    proteins = models.FloatField(
+        null=True,
+        blank=True,
+        validators=(MinValueValidator(0),),
+        verbose_name='Белки, г'
+    )
+    fats = models.FloatField(
+        null=True,
+        blank=True,
+        validators=(MinValueValidator(0),),
+        verbose_name='Жиры, г'
+    )
+    carbohydrates = models.FloatField(
+        null=True,
+        blank=True,
+        validators=(MinValueValidator(0),),
+        verbose_name='Углеводы, г'
+    )
+    price = models.FloatField(
+        null=True,
+        blank=True,
+        validators=(MinValueValidator(0),),
+        verbose_name='Цена, руб.'
+    )
 
     class Meta:
         verbose_name = 'ингридиент'
@@ -181,6 +314,11 @@ class BaseUserRecipeRelation(models.Model):
         on_delete=models.CASCADE,
         verbose_name='Рецепт',
     )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name='Добавлено'
+    )
 
     class Meta:
         abstract = True
@@ -190,6 +328,13 @@ class BaseUserRecipeRelation(models.Model):
                 name='%(class)s_unique_user_recipe'
             ),
         )
+        indexes = (
+            # Для выборки новых записей пользователя при синхронизации
+            models.Index(
+                fields=('user', 'created_at'),
+                name='%(class)s_user_idx'
+            ),
+        )
 
     def __str__(self):
         return (f'Рецепт "{self.recipe.name}" добавлен в '
@@ -200,6 +345,11 @@ class BaseUserRecipeRelation(models.Model):
 class FavouriteRecipe(BaseUserRecipeRelation):
     """Связующая модель для 'Избранных рецептов'."""
 
+    # Денормализованный счётчик в модели Recipe
+    counter_field = 'favourites_count'
+    # Тип события в ToggleEvent
+    event_kind = 'favourite'
+
     class Meta(BaseUserRecipeRelation.Meta):
         default_related_name = 'favourites'
         verbose_name = 'избранное'
@@ -209,7 +359,310 @@ class FavouriteRecipe(BaseUserRecipeRelation):
 class ShoppingList(BaseUserRecipeRelation):
     """Связующая модель для 'Списка покупок'."""
 
+    counter_field = 'shopping_cart_count'
+    event_kind = 'shopping_cart'
+
     class Meta(BaseUserRecipeRelation.Meta):
         default_related_name = 'purchases'
         verbose_name = 'покупка'
         verbose_name_plural = 'Список покупок'
+
+
+class Watermark(models.Model):
+    """
+    Отметка о том, до какого момента фоновая задача
+    уже обработала данные.
+    """
+
+    name = models.CharField(
+        max_length=MAX_WATERMARK_NAME_LENGTH,
+        unique=True,
+        verbose_name='Задача'
+    )
+    value = models.DateTimeField(
+        verbose_name='Обработано до'
+    )
+
+    class Meta:
+        verbose_name = 'отметка обработки'
+        verbose_name_plural = 'Отметки обработки'
+
+    def __str__(self):
+        return f'{self.name}: {self.value}'
+
+
+class RelatedRecipe(models.Model):
+    """
+    Похожий рецепт, рассчитанный заранее командой build_related_recipes.
+    """
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='related_recipes',
+        verbose_name='Рецепт'
+    )
+    related = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='related_to',
+        verbose_name='Похожий рецепт'
+    )
+    score = models.FloatField(
+        verbose_name='Схожесть'
+    )
+
+    class Meta:
+        verbose_name = 'похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('recipe', 'related'),
+                name='unique_recipe_related'
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=('recipe', '-score'),
+                name='related_recipe_score_idx'
+            ),
+        )
+
+    def __str__(self):
+        return f'"{self.related}" похож на "{self.recipe}"'
+
+
+class RecommendedRecipe(models.Model):
+    """
+    Рекомендованный пользователю рецепт, рассчитанный заранее
+    командой build_recommendations.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='recommendations',
+        verbose_name='Пользователь'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='recommendations',
+        verbose_name='Рецепт'
+    )
+    score = models.FloatField(
+        verbose_name='Оценка'
+    )
+
+    class Meta:
+        verbose_name = 'рекомендация'
+        verbose_name_plural = 'Рекомендации'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_user_recommended_recipe'
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=('user', '-score'),
+                name='recommendation_score_idx'
+            ),
+        )
+
+    def __str__(self):
+        return f'"{self.recipe}" для {self.user}'
+
+
+class ToggleEvent(models.Model):
+    """
+    Отложенное добавление рецепта в избранное или список покупок
+    либо удаление из них. События применяет apply_toggle_events.
+    """
+
+    KIND_CHOICES = (
+        (FavouriteRecipe.event_kind, 'Избранное'),
+        (ShoppingList.event_kind, 'Список покупок'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='toggle_events',
+        verbose_name='Пользователь'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='toggle_events',
+        verbose_name='Рецепт'
+    )
+    kind = models.CharField(
+        max_length=MAX_TOGGLE_EVENT_KIND_LENGTH,
+        choices=KIND_CHOICES,
+        verbose_name='Куда'
+    )
+    added = models.BooleanField(
+        verbose_name='Добавлен'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Создано'
+    )
+
+    class Meta:
+        verbose_name = 'отложенное изменение'
+        verbose_name_plural = 'Отложенные изменения'
+        ordering = ('id',)
+        indexes = (
+            models.Index(
+                fields=('user', 'id'),
+                name='toggle_event_user_idx'
+            ),
+        )
+
+    def __str__(self):
+        action = 'добавлен в' if self.added else 'удалён из'
+        return f'Рецепт {self.recipe_id} {action} {self.kind}'
+
+
+class Tombstone(models.Model):
+    """
+    Запись об удалении рецепта, избранного, покупки или подписки,
+    по которым клиенты узнают об удалениях при синхронизации.
+    """
+
+    RECIPE = 'recipe'
+    SUBSCRIPTION = 'subscription'
+    KIND_CHOICES = (
+        (RECIPE, 'Рецепт'),
+        (FavouriteRecipe.event_kind, 'Избранное'),
+        (ShoppingList.event_kind, 'Список покупок'),
+        (SUBSCRIPTION, 'Подписка'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    kind = models.CharField(
+        max_length=MAX_TOMBSTONE_KIND_LENGTH,
+        choices=KIND_CHOICES,
+        verbose_name='Что удалено'
+    )
+    # Ограничение внешнего ключа в базе не создаётся (db_constraint=False):
+    # запись может появиться при удалении самого пользователя и пережить
+    # его, а у записей об удалённых рецептах пользователя нет вовсе
+    user = models.ForeignKey(
+        User,
+        null=True,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+        verbose_name='Пользователь'
+    )
+    object_id = models.BigIntegerField(
+        verbose_name='id рецепта или автора'
+    )
+    deleted_at = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+        verbose_name='Удалено'
+    )
+
+    class Meta:
+        verbose_name = 'удаление'
+        verbose_name_plural = 'Удаления'
+        indexes = (
+            models.Index(
+                fields=('user', 'deleted_at'),
+                name='tombstone_user_deleted_idx'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.kind} {self.object_id} удалён {self.deleted_at}'
+
+
+class MealPlan(models.Model):
+    """
+    План питания пользователя: какие рецепты и на сколько порций
+    он собирается готовить в какие дни.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='meal_plans',
+        verbose_name='Пользователь'
+    )
+    name = models.CharField(
+        max_length=MAX_MEAL_PLAN_NAME_LENGTH,
+        verbose_name='Название'
+    )
+    # Увеличивается при каждом изменении записей плана и входящих
+    # в него рецептов, по ней кэшируется список покупок
+    version = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Версия'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Добавлено'
+    )
+
+    class Meta:
+        verbose_name = 'план питания'
+        verbose_name_plural = 'Планы питания'
+        ordering = ('-created_at',)
+
+    def save(self, *args, **kwargs):
+        # Версия меняется только через update(version=F('version') + 1),
+        # поэтому у существующего плана она не сохраняется: иначе
+        # устаревшее значение перезапишет параллельное увеличение
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'version'
+            ]
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.name[:STR_OUTPUT_SLICE]
+
+
+class MealPlanEntry(models.Model):
+    """Рецепт в плане питания на определённый день."""
+
+    plan = models.ForeignKey(
+        MealPlan,
+        on_delete=models.CASCADE,
+        related_name='entries',
+        verbose_name='План питания'
+    )
+    date = models.DateField(
+        verbose_name='Дата'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='meal_plan_entries',
+        verbose_name='Рецепт'
+    )
+    servings = models.PositiveSmallIntegerField(
+        validators=SERVINGS_VALIDATORS,
+        verbose_name='Порций'
+    )
+
+    class Meta:
+        verbose_name = 'запись плана питания'
+        verbose_name_plural = 'Записи плана питания'
+        ordering = ('date', 'pk')
+        indexes = (
+            models.Index(
+                fields=('plan', 'date'),
+                name='meal_plan_entry_date_idx'
+            ),
+        )
+
+    def __str__(self):
+        return f'"{self.recipe}" на {self.date} в плане "{self.plan}"'
@@ -0,0 +1,133 @@
+"""
+Пищевая ценность и стоимость рецептов и списка покупок.
+
+Итоги - это суммы количества ингредиентов, умноженного на их
+значения на единицу измерения из unit_catalog. Для всех строк сразу
+они считаются векторно через np.bincount, без арифметики в Python
+и без join-ов в SQL. Итоги рецептов хранятся в самих рецептах и
+пересчитываются при изменении рецепта или его ингредиентов, поэтому
+списки рецептов показывают калорийность и стоимость без вычислений.
+
+Если у какого-то ингредиента значение не заполнено, итог получается
+NaN и сохраняется как пустое значение: неполная сумма вводила бы
+в заблуждение.
+"""
+import threading
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from recipes.models import Ingredient, Recipe, RecipeIngredient
+from recipes.units import unit_catalog
+
+
+RECIPE_FIELDS = tuple(Ingredient.nutrition_fields.values())
+# Сколько рецептов пересчитывается за один проход
+BATCH_SIZE = 500
+
+_pending = threading.local()
+
+
+def sum_by_key(keys, ingredient_ids, amounts):
+    """
+    Складывает пищевую ценность строк (ключ, id ингредиента, количество)
+    по ключам. Возвращает (ключи, массив итогов ключ x поле).
+    """
+    keys, rows = np.unique(keys, return_inverse=True)
+    values = unit_catalog.get_nutrition(ingredient_ids) * amounts[:, None]
+    totals = np.stack([
+        np.bincount(rows, weights=values[:, column], minlength=len(keys))
+        for column in range(values.shape[1])
+    ], axis=1)
+
+    return keys, np.round(totals, 2)
+
+
+def to_dict(totals):
+    return {
+        field: None if np.isnan(value) else float(value)
+        for field, value in zip(RECIPE_FIELDS, totals)
+    }
+
+
+def get_totals(rows):
+    """
+    Итоги по парам (id ингредиента, количество), например для списка
+    покупок, в виде словаря с ключами полей итогов рецепта.
+    """
+    rows = np.array(list(rows), dtype=np.float64).reshape(-1, 2)
+    if not len(rows):
+        return dict.fromkeys(RECIPE_FIELDS)
+
+    _, totals = sum_by_key(
+        np.zeros(len(rows), dtype=np.int64),
+        rows[:, 0].astype(np.int64),
+        rows[:, 1]
+    )
+    return to_dict(totals[0])
+
+
+def refresh_recipe_totals(recipe_ids=None):
+    """
+    Пересчитывает итоги рецептов (по умолчанию всех) и сохраняет
+    изменившиеся. Возвращает количество обновлённых рецептов.
+    """
+    if recipe_ids is None:
+        recipe_ids = Recipe.objects.values_list('pk', flat=True)
+    recipe_ids = sorted(recipe_ids)
+
+    updated = 0
+    for start in range(0, len(recipe_ids), BATCH_SIZE):
+        batch = recipe_ids[start:start + BATCH_SIZE]
+        rows = np.array(
+            list(RecipeIngredient.objects.filter(
+                recipe_id__in=batch
+            ).values_list('recipe_id', 'ingredient_id', 'amount')),
+            dtype=np.int64
+        ).reshape(-1, 3)
+        totals = {}
+        if len(rows):
+            keys, values = sum_by_key(rows[:, 0], rows[:, 1], rows[:, 2])
+            totals = {
+                int(key): to_dict(value) for key, value in zip(keys, values)
+            }
+
+        now = timezone.now()
+        recipes = []
+        for pk, *current in Recipe.objects.filter(
+            pk__in=batch
+        ).values_list('pk', *RECIPE_FIELDS):
+            new = totals.get(pk, dict.fromkeys(RECIPE_FIELDS))
+            if list(new.values()) != current:
+                # updated_at меняется, чтобы итоги дошли до /api/sync/
+                recipes.append(Recipe(pk=pk, updated_at=now, **new))
+        Recipe.objects.bulk_update(recipes, (*RECIPE_FIELDS, 'updated_at'))
+        updated += len(recipes)
+
+    return updated
+
+
+def _flush_totals():
+    recipe_ids = getattr(_pending, 'recipe_ids', None)
+    _pending.recipe_ids = set()
+    if getattr(_pending, 'reload_catalog', False):
+        _pending.reload_catalog = False
+        unit_catalog.invalidate()
+    if recipe_ids:
+        refresh_recipe_totals(recipe_ids)
+
+
+def schedule_totals_refresh(*recipe_ids, reload_catalog=False):
+    """
+    Откладывает пересчёт итогов до конца транзакции, чтобы рецепт
+    пересчитывался один раз и уже с сохранёнными ингредиентами.
+    reload_catalog - перечитать справочник, если менялись ингредиенты.
+    """
+    if not hasattr(_pending, 'recipe_ids'):
+        _pending.recipe_ids = set()
+    _pending.recipe_ids.update(recipe_ids)
+    _pending.reload_catalog = (
+        reload_catalog or getattr(_pending, 'reload_catalog', False)
+    )
+    transaction.on_commit(_flush_totals)
@@ -0,0 +1,90 @@
+"""
+Рейтинг популярности рецептов.
+
+Каждое добавление в избранное или в список покупок вносит в рейтинг вклад
+weight * 2 ** ((created_at - EPOCH) / half_life). Все вклады отсчитываются
+от одной фиксированной даты, поэтому затухание со временем одинаково
+для всех рецептов и не меняет их порядок: старые рейтинги не нужно
+пересчитывать, достаточно добавлять вклад новых записей.
+Чтобы числа не переполнялись, рейтинг хранится в виде log2 суммы вкладов,
+а нулевой рейтинг рецепта без активности соответствует единичному вкладу
+в момент EPOCH.
+
+Удаление из избранного или списка покупок должно убрать вклад записи,
+но вычитать его в логарифмической шкале неточно, а время добавления
+удалённой записи уже неизвестно. Поэтому рецепты, из которых с прошлого
+запуска что-то удалили (по записям Tombstone), пересчитываются целиком
+по оставшимся записям, а остальным добавляется только вклад новых.
+"""
+import math
+from datetime import datetime, timedelta, timezone
+
+from api.constants import (
+    FAVOURITE_POPULARITY_WEIGHT,
+    POPULARITY_HALF_LIFE_HOURS,
+    SHOPPING_CART_POPULARITY_WEIGHT,
+)
+from recipes.models import FavouriteRecipe, ShoppingList, Tombstone
+
+
+EPOCH = datetime(2025, 1, 1, tzinfo=timezone.utc)
+HALF_LIFE = timedelta(hours=POPULARITY_HALF_LIFE_HOURS)
+
+SOURCES = (
+    (FavouriteRecipe, FAVOURITE_POPULARITY_WEIGHT),
+    (ShoppingList, SHOPPING_CART_POPULARITY_WEIGHT),
+)
+
+
+def logaddexp2(first, second):
+    """Возвращает log2(2 ** first + 2 ** second) без переполнения."""
+    high, low = max(first, second), min(first, second)
+
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def get_contribution(weight, created_at):
+    """Вклад одной записи в рейтинг в логарифмической шкале."""
+    return math.log2(weight) + (created_at - EPOCH) / HALF_LIFE
+
+
+def collect_contributions(since, until, recipe_ids=None):
+    """
+    Суммирует вклады записей, добавленных в промежутке (since, until],
+    и возвращает словарь id рецепта -> вклад.
+    Если since не передан, учитываются все записи до until,
+    если передан recipe_ids - только записи этих рецептов.
+    """
+    contributions = {}
+
+    for model, weight in SOURCES:
+        rows = model.objects.filter(created_at__lte=until)
+        if since is not None:
+            rows = rows.filter(created_at__gt=since)
+        if recipe_ids is not None:
+            rows = rows.filter(recipe_id__in=recipe_ids)
+        rows = rows.values_list('recipe_id', 'created_at')
+
+        for recipe_id, created_at in rows.iterator():
+            contribution = get_contribution(weight, created_at)
+            if recipe_id in contributions:
+                contribution = logaddexp2(
+                    contributions[recipe_id], contribution
+                )
+            contributions[recipe_id] = contribution
+
+    return contributions
+
+
+def get_removed_recipe_ids(since, until):
+    """
+    Id рецептов, которые убирали из избранного или списков покупок
+    в промежутке (since, until].
+    """
+    return set(
+        Tombstone.objects.filter(
+            kind__in=[model.event_kind for model, _ in SOURCES],
+            deleted_at__gt=since,
+            deleted_at__lte=until
+        ).values_list('object_id', flat=True).distinct()
+    )
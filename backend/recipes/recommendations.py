@@ -0,0 +1,177 @@
+"""
+Рекомендации рецептов по избранному и спискам покупок.
+
+Из добавлений в избранное и в список покупок строится разреженная
+матрица пользователь x рецепт. По ней считается item-item схожесть:
+косинус между столбцами рецептов, от которой для каждого рецепта
+остаются только neighbours ближайших соседей. Оценка рецепта для
+пользователя - сумма схожестей с рецептами, которые он уже добавлял.
+Всё считается кусками по chunk_size строк, чтобы ограничить память.
+"""
+from time import perf_counter
+
+import numpy as np
+from scipy import sparse
+
+from api.constants import (FAVOURITE_INTERACTION_WEIGHT,
+                           SHOPPING_CART_INTERACTION_WEIGHT)
+from recipes.models import FavouriteRecipe, ShoppingList
+from recipes.related import compute_related, normalize_rows, top_k_per_row
+
+
+SOURCES = (
+    (FavouriteRecipe, FAVOURITE_INTERACTION_WEIGHT),
+    (ShoppingList, SHOPPING_CART_INTERACTION_WEIGHT),
+)
+
+
+def load_interactions():
+    """
+    Возвращает массивы (id пользователя, id рецепта, вес)
+    всех добавлений в избранное и списки покупок.
+    """
+    users, recipes, weights = [], [], []
+    for model, weight in SOURCES:
+        rows = np.array(
+            list(model.objects.order_by().values_list(
+                'user_id', 'recipe_id'
+            )),
+            dtype=np.int64
+        ).reshape(-1, 2)
+        users.append(rows[:, 0])
+        recipes.append(rows[:, 1])
+        weights.append(np.full(len(rows), weight))
+
+    return (np.concatenate(users),
+            np.concatenate(recipes),
+            np.concatenate(weights))
+
+
+def build_interaction_matrix(users, recipes, weights):
+    """
+    Возвращает (id пользователей, id рецептов, матрица), где в строке
+    пользователя и столбце рецепта лежит суммарный вес их взаимодействий.
+    """
+    user_ids, rows = np.unique(users, return_inverse=True)
+    recipe_ids, columns = np.unique(recipes, return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (weights, (rows, columns)),
+        shape=(len(user_ids), len(recipe_ids))
+    )
+
+    return user_ids, recipe_ids, matrix
+
+
+def train_item_similarity(interactions, neighbours, chunk_size, workers=1):
+    """
+    Возвращает разреженную матрицу рецепт x рецепт, где у каждого
+    рецепта оставлены neighbours самых похожих на него рецептов.
+    """
+    items = normalize_rows(interactions.T.tocsr())
+    sources, targets, scores = compute_related(
+        items, neighbours, chunk_size, workers
+    )
+
+    return sparse.csr_matrix(
+        (scores, (sources, targets)),
+        shape=(items.shape[0], items.shape[0])
+    )
+
+
+def recommend(interactions, similarity, top_n, chunk_size):
+    """
+    Для каждого пользователя возвращает до top_n рецептов, которые он ещё
+    не добавлял, в виде кусков (строки, столбцы, оценки).
+    """
+    for start in range(0, interactions.shape[0], chunk_size):
+        chunk = interactions[start:start + chunk_size]
+        rows, columns, scores = top_k_per_row(
+            chunk @ similarity, top_n, excluded=chunk
+        )
+        yield rows + start, columns, scores
+
+
+def generate_interactions(count, seed=0, clusters=50):
+    """
+    Генерирует count синтетических взаимодействий для оценки качества
+    и скорости: у каждого пользователя есть любимая группа рецептов,
+    а популярность рецептов убывает по степенному закону.
+    """
+    rng = np.random.default_rng(seed)
+    users_count, recipes_count = max(count // 20, 1), max(count // 50, 1)
+
+    popularity = 1 / np.arange(1, recipes_count + 1) ** 0.8
+    recipe_clusters = rng.integers(0, clusters, recipes_count)
+    users = rng.integers(0, users_count, count)
+    user_clusters = rng.integers(0, clusters, users_count)[users]
+
+    recipes = rng.choice(
+        recipes_count, size=count, p=popularity / popularity.sum()
+    )
+    # Большая часть взаимодействий - внутри любимой группы пользователя
+    own = rng.random(count) < 0.7
+    for cluster in range(clusters):
+        members = np.flatnonzero(recipe_clusters == cluster)
+        targets = np.flatnonzero(own & (user_clusters == cluster))
+        if len(members) and len(targets):
+            weights = popularity[members] / popularity[members].sum()
+            recipes[targets] = rng.choice(
+                members, size=len(targets), p=weights
+            )
+
+    weights = np.where(
+        rng.random(count) < 0.5,
+        FAVOURITE_INTERACTION_WEIGHT,
+        SHOPPING_CART_INTERACTION_WEIGHT
+    )
+    return users, recipes, weights
+
+
+def evaluate(users, recipes, weights, top_n, neighbours, chunk_size,
+             workers=1, sample_users=10000, seed=0):
+    """
+    Оценивает рекомендации методом leave-one-out: у каждого пользователя
+    прячется одно взаимодействие, и считается доля пользователей,
+    у которых спрятанный рецепт попал в top_n рекомендаций.
+    """
+    rng = np.random.default_rng(seed)
+    _, _, interactions = build_interaction_matrix(users, recipes, weights)
+    interactions.sum_duplicates()
+
+    # Прячем по одному взаимодействию у пользователей, у которых их >= 2
+    sizes = np.diff(interactions.indptr)
+    candidates = np.flatnonzero(sizes >= 2)
+    if len(candidates) > sample_users:
+        candidates = np.sort(
+            rng.choice(candidates, sample_users, replace=False)
+        )
+    hidden = interactions.indptr[candidates] + (
+        rng.random(len(candidates)) * sizes[candidates]
+    ).astype(np.int64)
+    hidden_recipes = interactions.indices[hidden]
+
+    train = interactions.copy()
+    train.data[hidden] = 0
+    train.eliminate_zeros()
+
+    started = perf_counter()
+    similarity = train_item_similarity(train, neighbours, chunk_size, workers)
+    train_seconds = perf_counter() - started
+
+    started = perf_counter()
+    hits = 0
+    for rows, columns, _ in recommend(
+        train[candidates], similarity, top_n, chunk_size
+    ):
+        hits += len(np.unique(rows[columns == hidden_recipes[rows]]))
+    recommend_seconds = perf_counter() - started
+
+    return {
+        'interactions': int(interactions.nnz),
+        'users': int(interactions.shape[0]),
+        'recipes': int(interactions.shape[1]),
+        'evaluated_users': int(len(candidates)),
+        'hit_rate': hits / len(candidates) if len(candidates) else 0.0,
+        'train_seconds': train_seconds,
+        'recommend_seconds': recommend_seconds,
+    }
@@ -0,0 +1,163 @@
+"""
+Офлайн-расчёт похожих рецептов.
+
+Каждый рецепт представляется разреженным вектором из его ингредиентов
+и тегов, схожесть рецептов - косинус угла между векторами. Матрица
+схожести считается кусками по chunk_size строк, куски раздаются
+по процессам, и от каждой строки остаются только top_k соседей.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import sparse
+
+from recipes.models import Recipe, RecipeIngredient
+
+
+# Матрица признаков в процессах-обработчиках
+_features = None
+
+
+def build_feature_matrix(tag_weight):
+    """
+    Возвращает (id рецептов, матрица признаков), где строка матрицы -
+    нормированный вектор ингредиентов и тегов рецепта.
+    """
+    ingredients = np.array(
+        list(RecipeIngredient.objects.order_by().values_list(
+            'recipe_id', 'ingredient_id'
+        )),
+        dtype=np.int64
+    ).reshape(-1, 2)
+    tags = np.array(
+        list(Recipe.tags.through.objects.order_by().values_list(
+            'recipe_id', 'tag_id'
+        )),
+        dtype=np.int64
+    ).reshape(-1, 2)
+
+    recipe_ids = np.unique(np.concatenate((ingredients[:, 0], tags[:, 0])))
+    ingredient_ids, ingredient_columns = np.unique(
+        ingredients[:, 1], return_inverse=True
+    )
+    _, tag_columns = np.unique(tags[:, 1], return_inverse=True)
+
+    rows = np.concatenate((
+        np.searchsorted(recipe_ids, ingredients[:, 0]),
+        np.searchsorted(recipe_ids, tags[:, 0])
+    ))
+    columns = np.concatenate((
+        ingredient_columns,
+        tag_columns + len(ingredient_ids)
+    ))
+    data = np.concatenate((
+        np.ones(len(ingredients)),
+        np.full(len(tags), tag_weight)
+    ))
+
+    features = sparse.csr_matrix(
+        (data, (rows, columns)),
+        shape=(len(recipe_ids), columns.max(initial=-1) + 1)
+    )
+
+    return recipe_ids, normalize_rows(features)
+
+
+def normalize_rows(matrix):
+    """Делит каждую строку разреженной матрицы на её длину."""
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)))
+    norms[norms == 0] = 1
+
+    return sparse.csr_matrix(matrix.multiply(1 / norms))
+
+
+def _init_worker(features):
+    global _features
+    _features = features
+
+
+def top_k_per_row(matrix, top_k, excluded=None):
+    """
+    Для каждой строки разреженной матрицы оставляет top_k наибольших
+    значений и возвращает их в виде массивов (строка, столбец, значение).
+    Элементы, ненулевые в матрице excluded той же формы, не учитываются.
+    """
+    matrix = sparse.csr_matrix(matrix)
+    if excluded is not None:
+        matrix = matrix - matrix.multiply(excluded.astype(bool))
+        matrix.eliminate_zeros()
+    rows, columns, values = [], [], []
+
+    for row in range(matrix.shape[0]):
+        begin, end = matrix.indptr[row], matrix.indptr[row + 1]
+        row_columns = matrix.indices[begin:end]
+        row_values = matrix.data[begin:end]
+
+        if len(row_values) > top_k:
+            best = np.argpartition(-row_values, top_k - 1)[:top_k]
+            row_columns, row_values = row_columns[best], row_values[best]
+
+        rows.append(np.full(len(row_columns), row))
+        columns.append(row_columns)
+        values.append(row_values)
+
+    if not rows:
+        return np.empty(0, int), np.empty(0, int), np.empty(0)
+
+    return (np.concatenate(rows),
+            np.concatenate(columns),
+            np.concatenate(values))
+
+
+def top_k_neighbours(start, stop, top_k, features=None):
+    """
+    Для строк матрицы с start по stop возвращает массивы
+    (строка, соседняя строка, схожесть) top_k самых похожих строк.
+    """
+    if features is None:
+        features = _features
+
+    similarity = sparse.csr_matrix(features[start:stop] @ features.T)
+    # Сам рецепт себе не сосед: обнуляем диагональ и выбрасываем нули
+    entry_rows = np.repeat(
+        np.arange(start, stop), np.diff(similarity.indptr)
+    )
+    similarity.data[similarity.indices == entry_rows] = 0
+    similarity.eliminate_zeros()
+    sources, targets, scores = top_k_per_row(similarity, top_k)
+
+    return sources + start, targets, scores
+
+
+def compute_related(features, top_k, chunk_size, workers):
+    """
+    Считает соседей для всех строк матрицы, при workers > 1 -
+    параллельно в пуле процессов. Возвращает массивы
+    (строка, соседняя строка, схожесть).
+    """
+    chunks = [
+        (start, min(start + chunk_size, features.shape[0]))
+        for start in range(0, features.shape[0], chunk_size)
+    ]
+
+    if workers > 1:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(features,)
+        ) as executor:
+            results = list(executor.map(
+                top_k_neighbours,
+                *zip(*chunks),
+                [top_k] * len(chunks)
+            ))
+    else:
+        results = [
+            top_k_neighbours(start, stop, top_k, features)
+            for start, stop in chunks
+        ]
+
+    if not results:
+        return np.empty(0, int), np.empty(0, int), np.empty(0)
+
+    return tuple(np.concatenate(column) for column in zip(*results))
@@ -0,0 +1,111 @@
+"""
+Пакетная вставка и удаление связей пользователей с объектами:
+избранного, списка покупок и подписок.
+
+Обе функции возвращают только те пары (id пользователя, id объекта),
+которые изменил именно этот вызов, чтобы денормализованные счётчики
+менялись ровно на них, даже если параллельный запрос успел вставить
+или удалить те же строки. Вызывать их нужно внутри транзакции.
+"""
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+
+# Сколько пар обрабатывать одним запросом
+CHUNK_SIZE = 500
+
+
+def _insert_returning(connection, model, field, pairs):
+    """
+    Один INSERT ... ON CONFLICT DO NOTHING RETURNING для Postgres:
+    база сама возвращает только вставленные строки.
+    """
+    quote = connection.ops.quote_name
+    user_column = quote(model._meta.get_field('user').column)
+    target_column = quote(model._meta.get_field(field).column)
+    created_column = quote(model._meta.get_field('created_at').column)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(model._meta.db_table)} '
+            f'({user_column}, {target_column}, {created_column}) '
+            f'SELECT pair.user_id, pair.target_id, %s '
+            f'FROM unnest(%s::bigint[], %s::bigint[]) '
+            f'AS pair (user_id, target_id) '
+            f'ON CONFLICT DO NOTHING '
+            f'RETURNING {user_column}, {target_column}',
+            [
+                timezone.now(),
+                [user_id for user_id, _ in pairs],
+                [target_id for _, target_id in pairs]
+            ]
+        )
+        return set(cursor.fetchall())
+
+
+def insert_relations(model, field, pairs):
+    """
+    Вставляет связи model для пар (id пользователя, id объекта поля
+    field), пропуская уже существующие, и возвращает вставленные пары.
+    """
+    pairs = list(dict.fromkeys(pairs))
+    using = router.db_for_write(model)
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        inserted = set()
+        for start in range(0, len(pairs), CHUNK_SIZE):
+            inserted |= _insert_returning(
+                connection, model, field, pairs[start:start + CHUNK_SIZE]
+            )
+        return inserted
+
+    # Без RETURNING у INSERT с пропуском конфликтов узнать вставленное
+    # нельзя, поэтому вставляем по строке, каждую в своей точке сохранения
+    inserted = set()
+    for user_id, target_id in pairs:
+        try:
+            with transaction.atomic(using=using):
+                model.objects.using(using).bulk_create([
+                    model(user_id=user_id, **{f'{field}_id': target_id})
+                ])
+        except IntegrityError:
+            continue
+        inserted.add((user_id, target_id))
+
+    return inserted
+
+
+def delete_relations(model, field, pairs):
+    """
+    Удаляет связи model для пар (id пользователя, id объекта поля
+    field) и возвращает удалённые пары. Строки сначала блокируются,
+    поэтому при параллельном удалении каждая пара достаётся одному
+    вызову. Удаление идёт через ORM, чтобы сработали сигналы.
+    """
+    by_user = defaultdict(list)
+    for user_id, target_id in dict.fromkeys(pairs):
+        by_user[user_id].append(target_id)
+    conditions = [
+        Q(user_id=user_id, **{f'{field}_id__in': target_ids})
+        for user_id, target_ids in by_user.items()
+    ]
+
+    deleted = set()
+    for start in range(0, len(conditions), CHUNK_SIZE):
+        rows = list(
+            model.objects.filter(
+                reduce(or_, conditions[start:start + CHUNK_SIZE])
+            ).select_for_update().values_list(
+                'pk', 'user_id', f'{field}_id'
+            )
+        )
+        if not rows:
+            continue
+        model.objects.filter(pk__in=[pk for pk, *_ in rows]).delete()
+        deleted.update((user_id, target_id) for _, user_id, target_id in rows)
+
+    return deleted
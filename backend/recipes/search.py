@@ -0,0 +1,131 @@
+"""
+Полнотекстовый поиск рецептов по названию, описанию и ингредиентам.
+
+В Postgres используется колонка search_vector c GIN-индексом
+и русским стеммингом. В SQLite, который используется для разработки,
+её роль играет теневая таблица FTS5 recipes_recipe_fts. Стемминга для
+русского языка в SQLite нет, поэтому там каждое слово ищется по префиксу.
+"""
+import re
+import threading
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery,
+                                            SearchRank,
+                                            SearchVector)
+from django.db import connection, transaction
+from django.db.models import F, OuterRef, Q, Subquery
+from django.db.models.expressions import RawSQL
+
+from recipes.models import Recipe, RecipeIngredient
+
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'recipes_recipe_fts'
+
+_pending = threading.local()
+
+
+def update_search_index(recipe_ids):
+    """Пересобирает поисковый индекс для переданных рецептов."""
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+
+    if connection.vendor == 'postgresql':
+        ingredient_names = RecipeIngredient.objects.filter(
+            recipe=OuterRef('pk')
+        ).order_by().values('recipe').annotate(
+            names=StringAgg('ingredient__name', ' ')
+        ).values('names')
+
+        Recipe.objects.filter(pk__in=recipe_ids).update(
+            search_vector=(
+                SearchVector('name', weight='A', config=SEARCH_CONFIG)
+                + SearchVector(
+                    Subquery(ingredient_names),
+                    weight='B',
+                    config=SEARCH_CONFIG
+                )
+                + SearchVector('text', weight='C', config=SEARCH_CONFIG)
+            )
+        )
+    elif connection.vendor == 'sqlite':
+        placeholders = ', '.join(['%s'] * len(recipe_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})',
+                recipe_ids
+            )
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, text, ingredients) '
+                'SELECT r.id, r.name, r.text, '
+                "COALESCE(GROUP_CONCAT(i.name, ' '), '') "
+                'FROM recipes_recipe r '
+                'LEFT JOIN recipes_recipeingredient ri ON ri.recipe_id = r.id '
+                'LEFT JOIN recipes_ingredient i ON i.id = ri.ingredient_id '
+                f'WHERE r.id IN ({placeholders}) GROUP BY r.id',
+                recipe_ids
+            )
+
+
+def _flush_search_index():
+    recipe_ids = getattr(_pending, 'recipe_ids', None)
+    _pending.recipe_ids = set()
+    if recipe_ids:
+        update_search_index(recipe_ids)
+
+
+def schedule_search_index_update(*recipe_ids):
+    """
+    Откладывает обновление индекса до конца транзакции, чтобы рецепт
+    индексировался один раз и уже вместе с сохранёнными ингредиентами.
+    """
+    if not hasattr(_pending, 'recipe_ids'):
+        _pending.recipe_ids = set()
+    _pending.recipe_ids.update(recipe_ids)
+    transaction.on_commit(_flush_search_index)
+
+
+def search_recipes(queryset, query):
+    """
+    Оставляет в queryset только подходящие под запрос рецепты
+    и сортирует их по релевантности.
+    """
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        return queryset.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(F('search_vector'), search_query)
+        ).order_by('-search_rank', '-created_at')
+
+    words = re.findall(r'\w+', query)
+    if not words:
+        return queryset.none()
+
+    if connection.vendor == 'sqlite':
+        match = ' '.join(f'"{word}"*' for word in words)
+        return queryset.filter(
+            pk__in=RawSQL(
+                f'SELECT rowid FROM {FTS_TABLE} '
+                f'WHERE {FTS_TABLE} MATCH %s',
+                (match,)
+            )
+        ).annotate(
+            # bm25 тем меньше, чем релевантнее рецепт
+            search_rank=RawSQL(
+                f'SELECT -bm25({FTS_TABLE}, 10.0, 1.0, 4.0) '
+                f'FROM {FTS_TABLE} '
+                f'WHERE {FTS_TABLE} MATCH %s AND rowid = recipes_recipe.id',
+                (match,)
+            )
+        ).order_by('-search_rank', '-created_at')
+
+    for word in words:
+        queryset = queryset.filter(
+            Q(name__icontains=word)
+            | Q(text__icontains=word)
+            | Q(ingredients__name__icontains=word)
+        )
+    return queryset.distinct()
@@ -0,0 +1,119 @@
+"""
+Пересчёт рецептов на другое число порций (?servings=).
+
+Количества ингредиентов умножаются на отношение порций и округляются
+по правилам recipes.units.scale_amount. Пересчитанный список
+ингредиентов кэшируется по (рецепт, порции, updated_at): сохранение
+рецепта и изменение его ингредиентов (см. recipes/signals.py) меняют
+updated_at, поэтому после редактирования старые записи больше не
+запрашиваются и просто истекают. Списки для всех рецептов
+из списка покупок читаются из кэша одним get_many, а недостающие
+собираются одним запросом.
+"""
+from django.core.cache import cache
+
+from api import metrics
+from api.constants import (MAX_SERVINGS,
+                           MIN_SERVINGS,
+                           SCALED_INGREDIENTS_CACHE_SECONDS)
+from recipes.models import RecipeIngredient
+from recipes.units import scale_amount
+
+
+def _parse_count(value):
+    try:
+        count = int(value)
+    except ValueError:
+        raise ValueError(f'Неверное число порций: {value}')
+    if not MIN_SERVINGS <= count <= MAX_SERVINGS:
+        raise ValueError(
+            f'Порций должно быть от {MIN_SERVINGS} до {MAX_SERVINGS}.'
+        )
+
+    return count
+
+
+def parse_servings(value):
+    """
+    Разбирает ?servings=: число порций для всех рецептов и/или пары
+    id_рецепта:порции через запятую, например 4 или 4,12:2.
+    Возвращает (порций для всех рецептов или None, {id рецепта: порций}).
+    """
+    default, overrides = None, {}
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        recipe_id, separator, count = item.partition(':')
+        if not separator:
+            default = _parse_count(item)
+            continue
+        try:
+            recipe_id = int(recipe_id)
+        except ValueError:
+            raise ValueError(f'Неверный id рецепта: {recipe_id}')
+        overrides[recipe_id] = _parse_count(count)
+
+    return default, overrides
+
+
+def get_target_servings(recipe, servings):
+    """Сколько порций рецепта запрошено разобранным ?servings=."""
+    default, overrides = servings
+    return overrides.get(recipe.pk, default or recipe.servings)
+
+
+def get_cache_key(recipe, servings):
+    return (
+        f'scaled_ingredients:{recipe.pk}:{servings}:'
+        f'{recipe.updated_at.timestamp()}'
+    )
+
+
+def get_scaled_ingredients(recipes, servings):
+    """
+    Возвращает ингредиенты рецептов, пересчитанные на заданное число
+    порций: {id рецепта: [{'id', 'name', 'measurement_unit', 'amount'}]}.
+    recipes - рецепты с загруженными servings и updated_at,
+    servings - {id рецепта: порций}.
+    """
+    keys = {
+        recipe.pk: get_cache_key(recipe, servings[recipe.pk])
+        for recipe in recipes
+    }
+    cached = cache.get_many(keys.values())
+    scaled = {pk: cached[key] for pk, key in keys.items() if key in cached}
+    metrics.increment('scaled_ingredients.hit', len(scaled))
+
+    missing = [recipe for recipe in recipes if recipe.pk not in scaled]
+    if not missing:
+        return scaled
+    metrics.increment('scaled_ingredients.miss', len(missing))
+
+    rows = {}
+    for recipe_id, *row in RecipeIngredient.objects.filter(
+        recipe__in=[recipe.pk for recipe in missing]
+    ).order_by('pk').values_list(
+        'recipe_id',
+        'ingredient_id',
+        'ingredient__name',
+        'ingredient__measurement_unit',
+        'amount'
+    ):
+        rows.setdefault(recipe_id, []).append(row)
+
+    new = {}
+    for recipe in missing:
+        factor = servings[recipe.pk] / recipe.servings
+        scaled[recipe.pk] = new[keys[recipe.pk]] = [
+            {
+                'id': ingredient_id,
+                'name': name,
+                'measurement_unit': unit,
+                'amount': scale_amount(amount, unit, factor)
+            }
+            for ingredient_id, name, unit, amount in rows.get(recipe.pk, ())
+        ]
+    cache.set_many(new, SCALED_INGREDIENTS_CACHE_SECONDS)
+
+    return scaled
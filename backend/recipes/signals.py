@@ -0,0 +1,137 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from recipes.ingredient_index import ingredient_index
+from recipes.models import (FavouriteRecipe,
+                            Ingredient,
+                            MealPlan,
+                            MealPlanEntry,
+                            Recipe,
+                            RecipeIngredient,
+                            ShoppingList,
+                            Tombstone)
+from recipes.meal_plans import bump_versions
+from recipes.nutrition import schedule_totals_refresh
+from recipes.search import schedule_search_index_update
+from recipes.units import unit_catalog
+from users.models import Subscription
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def update_recipe_search_index(sender, instance, **kwargs):
+    schedule_search_index_update(instance.pk)
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def update_recipe_ingredients_search_index(sender, instance, **kwargs):
+    schedule_search_index_update(instance.recipe_id)
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_search_index(sender, instance, created, **kwargs):
+    if not created:
+        schedule_search_index_update(
+            *instance.recipeingredient_set.values_list('recipe_id', flat=True)
+        )
+
+
+@receiver(post_save, sender=Recipe)
+def refresh_ingredient_index(sender, instance, **kwargs):
+    transaction.on_commit(ingredient_index.mark_stale)
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_from_ingredient_index(sender, instance, **kwargs):
+    recipe_id = instance.pk
+    transaction.on_commit(lambda: ingredient_index.remove(recipe_id))
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_unit_catalog(sender, **kwargs):
+    transaction.on_commit(unit_catalog.invalidate)
+
+
+@receiver(post_delete, sender=Recipe)
+def record_recipe_tombstone(sender, instance, **kwargs):
+    Tombstone.objects.create(kind=Tombstone.RECIPE, object_id=instance.pk)
+
+
+@receiver(post_delete, sender=FavouriteRecipe)
+@receiver(post_delete, sender=ShoppingList)
+def record_user_recipe_tombstone(sender, instance, **kwargs):
+    Tombstone.objects.create(
+        kind=sender.event_kind,
+        user_id=instance.user_id,
+        object_id=instance.recipe_id
+    )
+
+
+@receiver(post_delete, sender=Subscription)
+def record_subscription_tombstone(sender, instance, **kwargs):
+    Tombstone.objects.create(
+        kind=Tombstone.SUBSCRIPTION,
+        user_id=instance.user_id,
+        object_id=instance.author_id
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def schedule_recipe_totals(sender, instance, **kwargs):
+    schedule_totals_refresh(instance.pk)
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def schedule_recipe_ingredients_totals(sender, instance, **kwargs):
+    schedule_totals_refresh(instance.recipe_id)
+
+
+@receiver(post_save, sender=Ingredient)
+def schedule_ingredient_totals(sender, instance, created, **kwargs):
+    if not created:
+        schedule_totals_refresh(
+            *instance.recipeingredient_set.values_list(
+                'recipe_id', flat=True
+            ),
+            reload_catalog=True
+        )
+
+
+@receiver(post_save, sender=Ingredient)
+def touch_ingredient_recipes(sender, instance, created, **kwargs):
+    # Название и единица измерения входят в пересчитанные на другое
+    # число порций списки, которые кэшируются по updated_at рецепта,
+    # и в изменения рецептов для /api/sync/
+    if not created:
+        Recipe.objects.filter(
+            recipe_ingredients__ingredient=instance
+        ).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=MealPlanEntry)
+@receiver(post_delete, sender=MealPlanEntry)
+def bump_meal_plan_version(sender, instance, **kwargs):
+    bump_versions(MealPlan.objects.filter(pk=instance.plan_id))
+
+
+@receiver(post_save, sender=Recipe)
+def bump_recipe_meal_plans_version(sender, instance, created, **kwargs):
+    # Ингредиенты рецепта меняются вместе с сохранением самого рецепта
+    if not created:
+        bump_versions(MealPlan.objects.filter(entries__recipe=instance))
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(pre_delete, sender=Ingredient)
+def bump_ingredient_meal_plans_version(sender, instance, **kwargs):
+    # Пищевая ценность, цена и единица измерения ингредиента входят
+    # в список покупок. При удалении связи с рецептами ещё на месте
+    if not kwargs.get('created'):
+        bump_versions(MealPlan.objects.filter(
+            entries__recipe__recipe_ingredients__ingredient=instance
+        ))
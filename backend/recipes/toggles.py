@@ -0,0 +1,168 @@
+"""
+Отложенная запись (write-behind) избранного и списка покупок.
+
+При WRITE_BEHIND_TOGGLES = True добавление рецепта в избранное или
+список покупок и удаление из них не трогают FavouriteRecipe и
+ShoppingList, а дописывают событие в ToggleEvent и сразу отвечают
+клиенту. Команда apply_toggle_events применяет события пачками:
+для каждой пары (пользователь, рецепт) важно только последнее событие,
+так что добавление и последующее удаление взаимно сокращаются.
+
+Пока события не применены, чтение для их автора накладывает их
+поверх таблиц (см. get_pending и overlay_pending).
+"""
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BooleanField, Case, F, Value, When
+
+from recipes.models import FavouriteRecipe, Recipe, ShoppingList, ToggleEvent
+from recipes.relations import delete_relations, insert_relations
+
+
+MODELS = {model.event_kind: model for model in (FavouriteRecipe, ShoppingList)}
+
+
+def is_enabled():
+    return settings.WRITE_BEHIND_TOGGLES
+
+
+def record(user, model, recipe_id, added):
+    """Дописывает событие добавления или удаления рецепта."""
+    ToggleEvent.objects.create(
+        user=user, recipe_id=recipe_id, kind=model.event_kind, added=added
+    )
+
+
+def record_many(user, model, recipe_ids, added):
+    """Дописывает события для пачки рецептов одним INSERT."""
+    ToggleEvent.objects.bulk_create([
+        ToggleEvent(
+            user=user, recipe_id=recipe_id, kind=model.event_kind, added=added
+        )
+        for recipe_id in recipe_ids
+    ])
+
+
+def get_pending(user):
+    """
+    Возвращает непримененные события пользователя в виде словаря
+    тип -> (id добавленных рецептов, id удалённых рецептов).
+    """
+    states = defaultdict(dict)
+    for kind, recipe_id, added in ToggleEvent.objects.filter(
+        user=user
+    ).order_by('id').values_list('kind', 'recipe_id', 'added'):
+        states[kind][recipe_id] = added
+
+    return {
+        kind: (
+            {pk for pk, added in state.items() if added},
+            {pk for pk, added in state.items() if not added}
+        )
+        for kind, state in states.items()
+    }
+
+
+def is_active(user, model, recipe_id):
+    """Есть ли рецепт у пользователя с учётом непримененных событий."""
+    last = ToggleEvent.objects.filter(
+        user=user, recipe_id=recipe_id, kind=model.event_kind
+    ).order_by('-id').values_list('added', flat=True).first()
+    if last is not None:
+        return last
+
+    return model.objects.filter(user=user, recipe_id=recipe_id).exists()
+
+
+def get_active(user, model, recipe_ids):
+    """
+    Какие из рецептов есть у пользователя с учётом непримененных
+    событий, двумя запросами на весь список.
+    """
+    recipe_ids = set(recipe_ids)
+    added, removed = get_pending(user).get(model.event_kind, (set(), set()))
+    existing = set(
+        model.objects.filter(
+            user=user, recipe_id__in=recipe_ids
+        ).values_list('recipe_id', flat=True)
+    )
+
+    return (existing - removed) | (added & recipe_ids)
+
+
+def overlay_pending(expression, pending, model):
+    """
+    Накладывает непримененные события на логическое выражение
+    "рецепт есть у пользователя" для аннотаций вроде is_favorited.
+    """
+    added, removed = pending.get(model.event_kind, ((), ()))
+    cases = []
+    if added:
+        cases.append(When(pk__in=added, then=Value(True)))
+    if removed:
+        cases.append(When(pk__in=removed, then=Value(False)))
+    if not cases:
+        return expression
+
+    return Case(*cases, default=expression, output_field=BooleanField())
+
+
+def apply_kind(model, desired):
+    """
+    Приводит таблицу model к состояниям desired = {(user_id, recipe_id):
+    добавлен ли} и возвращает количество добавленных и удалённых строк.
+    """
+    # Счётчики меняются только на строки, которые действительно вставлены
+    # или удалены здесь: синхронные эндпоинты могут писать в те же
+    # таблицы одновременно
+    inserted = insert_relations(
+        model, 'recipe', [pair for pair, added in desired.items() if added]
+    )
+    deleted = delete_relations(
+        model, 'recipe',
+        [pair for pair, added in desired.items() if not added]
+    )
+
+    deltas = Counter(recipe_id for _, recipe_id in inserted)
+    deltas.subtract(recipe_id for _, recipe_id in deleted)
+    recipes_by_delta = defaultdict(list)
+    for recipe_id, delta in deltas.items():
+        if delta:
+            recipes_by_delta[delta].append(recipe_id)
+    for delta, recipe_ids in recipes_by_delta.items():
+        Recipe.objects.filter(pk__in=recipe_ids).update(**{
+            model.counter_field: F(model.counter_field) + delta
+        })
+
+    return len(inserted), len(deleted)
+
+
+def apply_events(batch_size):
+    """
+    Применяет до batch_size самых старых событий и удаляет их.
+    Возвращает количество обработанных событий.
+    """
+    with transaction.atomic():
+        events = list(
+            ToggleEvent.objects.select_for_update().order_by(
+                'id'
+            ).values_list(
+                'id', 'kind', 'user_id', 'recipe_id', 'added'
+            )[:batch_size]
+        )
+        if not events:
+            return 0
+
+        desired = defaultdict(dict)
+        for _, kind, user_id, recipe_id, added in events:
+            desired[kind][(user_id, recipe_id)] = added
+        for kind, states in desired.items():
+            apply_kind(MODELS[kind], states)
+
+        ToggleEvent.objects.filter(
+            id__in=[event[0] for event in events]
+        ).delete()
+
+    return len(events)
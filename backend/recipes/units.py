@@ -0,0 +1,272 @@
+"""
+Нормализация единиц измерения для сводного списка покупок.
+
+Ингредиенты с одинаковым названием и совместимыми единицами (например,
+"мука (г)" и "мука (кг)") попадают в одну группу, количества в ней
+суммируются в базовой единице (г, мл или шт.) и выводятся в удобной:
+крупные массы и объёмы - в кг и л. Если все строки группы в одной
+единице, она и сохраняется, чтобы "2 ст. л." не превращались в "30 мл".
+
+Справочник групп строится по всем ингредиентам один раз и хранится
+в памяти процесса в виде массивов NumPy, поэтому агрегация списка
+из тысяч строк сводится к нескольким векторным операциям. В нём же
+лежит пищевая ценность и цена ингредиентов в пересчёте на единицу
+измерения, по которой считает итоги recipes.nutrition.
+
+Здесь же округление количеств при пересчёте рецепта на другое число
+порций (см. recipes.servings): до шага, разумного для единицы.
+"""
+import re
+import threading
+from time import monotonic
+
+import numpy as np
+
+from api.constants import UNITS_CATALOG_TTL_SECONDS
+from recipes.models import Ingredient
+
+
+MASS, VOLUME, COUNT = 'mass', 'volume', 'count'
+
+# Единица -> (величина, множитель для перевода в базовую единицу)
+CONVERSIONS = {
+    'мг': (MASS, 0.001),
+    'г': (MASS, 1),
+    'кг': (MASS, 1000),
+    'капля': (VOLUME, 0.05),
+    'ч. л.': (VOLUME, 5),
+    'ст. л.': (VOLUME, 15),
+    'мл': (VOLUME, 1),
+    'стакан': (VOLUME, 250),
+    'л': (VOLUME, 1000),
+    'шт.': (COUNT, 1),
+}
+BASE_UNITS = {MASS: 'г', VOLUME: 'мл', COUNT: 'шт.'}
+# Во что переводить базовую единицу, начиная с какого количества
+LARGE_UNITS = {MASS: ('кг', 1000), VOLUME: ('л', 1000)}
+
+# Варианты написания единиц, которые встречаются в справочнике
+UNIT_ALIASES = {
+    'гр': 'г',
+    'гр.': 'г',
+    'грамм': 'г',
+    'кг.': 'кг',
+    'л.': 'л',
+    'шт': 'шт.',
+    'штука': 'шт.',
+    'ч.л.': 'ч. л.',
+    'чайная ложка': 'ч. л.',
+    'ст.л.': 'ст. л.',
+    'столовая ложка': 'ст. л.',
+}
+
+
+# Шаг, до которого округляется количество при пересчёте рецепта на
+# другое число порций. Граммы и миллилитры округляются до целых, а если
+# их меньше 10 - до десятых; единицы не из CONVERSIONS (банка, горсть) -
+# до половинки
+ROUNDING_STEPS = {
+    'кг': 0.05,
+    'л': 0.05,
+    'ч. л.': 0.25,
+    'ст. л.': 0.5,
+    'стакан': 0.25,
+    'капля': 1,
+    'шт.': 0.5,
+}
+DEFAULT_ROUNDING_STEP = 0.5
+
+
+def normalize_unit(unit):
+    unit = re.sub(r'\s+', ' ', unit.strip().lower())
+    return UNIT_ALIASES.get(unit, unit)
+
+
+def normalize_name(name):
+    return re.sub(r'\s+', ' ', name.strip().lower().replace('ё', 'е'))
+
+
+def format_amount(amount):
+    return f'{amount:.2f}'.rstrip('0').rstrip('.')
+
+
+def scale_amount(amount, unit, factor):
+    """
+    Умножает количество на factor и округляет до шага его единицы
+    измерения. Ненулевое количество не округляется до нуля.
+    """
+    unit = normalize_unit(unit)
+    amount *= factor
+    if unit in ROUNDING_STEPS:
+        step = ROUNDING_STEPS[unit]
+    elif unit in CONVERSIONS:
+        step = 1 if amount >= 10 else 0.1
+    else:
+        step = DEFAULT_ROUNDING_STEP
+    if amount:
+        amount = round(max(round(amount / step), 1) * step, 2)
+
+    return int(amount) if float(amount).is_integer() else amount
+
+
+class UnitCatalog:
+    """
+    Справочник групп ингредиентов: для каждого ингредиента - номер
+    группы, номер его единицы и множитель перевода в базовую единицу.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self.ingredient_ids = np.empty(0, dtype=np.int64)
+
+    def load(self):
+        groups, units = {}, {}
+        group_names, group_dimensions, unit_names = [], [], []
+        ingredient_ids, ingredient_groups = [], []
+        ingredient_units, factors, nutrition = [], [], []
+
+        for pk, name, unit, *values in Ingredient.objects.order_by(
+            'pk'
+        ).values_list(
+            'pk', 'name', 'measurement_unit', *Ingredient.nutrition_fields
+        ):
+            unit = normalize_unit(unit)
+            # Несовместимые ни с чем единицы (банка, горсть) - сами по себе
+            dimension, factor = CONVERSIONS.get(unit, (unit, 1))
+            # Значения по массе и объёму заданы на 100 базовых единиц
+            per_unit = factor / 100 if dimension in (MASS, VOLUME) else factor
+            nutrition.append([
+                np.nan if value is None else value * per_unit
+                for value in values
+            ])
+            key = (normalize_name(name), dimension)
+            if key not in groups:
+                groups[key] = len(group_names)
+                group_names.append(name)
+                group_dimensions.append(dimension)
+            if unit not in units:
+                units[unit] = len(unit_names)
+                unit_names.append(unit)
+
+            ingredient_ids.append(pk)
+            ingredient_groups.append(groups[key])
+            ingredient_units.append(units[unit])
+            factors.append(factor)
+
+        self.ingredient_ids = np.array(ingredient_ids, dtype=np.int64)
+        self.ingredient_groups = np.array(ingredient_groups, dtype=np.int64)
+        self.ingredient_units = np.array(ingredient_units, dtype=np.int64)
+        self.factors = np.array(factors, dtype=np.float64)
+        self.nutrition = np.array(nutrition, dtype=np.float64).reshape(
+            -1, len(Ingredient.nutrition_fields)
+        )
+        self.group_names = group_names
+        self.group_dimensions = group_dimensions
+        self.unit_names = unit_names
+        self._loaded_at = monotonic()
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    def _find(self, ingredient_ids):
+        if not len(self.ingredient_ids):
+            return None
+        positions = np.minimum(
+            np.searchsorted(self.ingredient_ids, ingredient_ids),
+            len(self.ingredient_ids) - 1
+        )
+        if not np.array_equal(self.ingredient_ids[positions], ingredient_ids):
+            return None
+
+        return positions
+
+    def _get_positions(self, ingredient_ids):
+        """
+        Возвращает позиции ингредиентов в справочнике, перечитывая его,
+        если он устарел или в нём нет каких-то из ингредиентов.
+        """
+        if (
+            self._loaded_at is None
+            or monotonic() - self._loaded_at > UNITS_CATALOG_TTL_SECONDS
+        ):
+            self.load()
+
+        positions = self._find(ingredient_ids)
+        if positions is None:
+            self.load()
+            positions = self._find(ingredient_ids)
+        if positions is None:
+            raise Ingredient.DoesNotExist
+
+        return positions
+
+    def get_nutrition(self, ingredient_ids):
+        """
+        Возвращает массив значений Ingredient.nutrition_fields на единицу
+        измерения для каждого id ингредиента, NaN - если не заполнено.
+        """
+        with self._lock:
+            positions = self._get_positions(ingredient_ids)
+            return self.nutrition[positions]
+
+    def aggregate(self, rows):
+        """
+        Суммирует пары (id ингредиента, количество) по группам
+        и возвращает отсортированный по названию список словарей
+        с ключами name, measurement_unit и amount.
+        """
+        rows = np.array(list(rows), dtype=np.float64).reshape(-1, 2)
+        if not len(rows):
+            return []
+        ingredient_ids, amounts = rows[:, 0].astype(np.int64), rows[:, 1]
+
+        with self._lock:
+            positions = self._get_positions(ingredient_ids)
+            groups = self.ingredient_groups[positions]
+            units = self.ingredient_units[positions]
+
+            used_groups, rows = np.unique(groups, return_inverse=True)
+            base_totals = np.bincount(
+                rows, weights=amounts * self.factors[positions],
+                minlength=len(used_groups)
+            )
+            totals = np.bincount(
+                rows, weights=amounts, minlength=len(used_groups)
+            )
+            # Группы, все строки которых в одной единице, выводим в ней же
+            first_units = np.empty(len(used_groups), dtype=np.int64)
+            first_units[rows[::-1]] = units[::-1]
+            uniform = np.bincount(
+                rows, weights=units != first_units[rows],
+                minlength=len(used_groups)
+            ) == 0
+
+            names = [self.group_names[group] for group in used_groups]
+            dimensions = [
+                self.group_dimensions[group] for group in used_groups
+            ]
+            unit_names = [self.unit_names[unit] for unit in first_units]
+
+        items = []
+        for index, dimension in enumerate(dimensions):
+            if uniform[index]:
+                unit, amount = unit_names[index], totals[index]
+            else:
+                unit, amount = BASE_UNITS[dimension], base_totals[index]
+
+            if unit == BASE_UNITS.get(dimension) and dimension in LARGE_UNITS:
+                large_unit, threshold = LARGE_UNITS[dimension]
+                if amount >= threshold:
+                    unit, amount = large_unit, amount / threshold
+
+            items.append({
+                'name': names[index],
+                'measurement_unit': unit,
+                'amount': format_amount(amount)
+            })
+
+        return sorted(items, key=lambda item: normalize_name(item['name']))
+
+
+unit_catalog = UnitCatalog()
@@ -1,8 +1,11 @@
 from django.shortcuts import get_object_or_404, redirect
 
 from recipes.models import Recipe
+from api.async_views import run_query
+from api.throttling import throttle
 
 
+@throttle('short_link')
 def redirect_to_recipe(request, short_link):
     """
     Вьюшка, которая производит редирект от короткой ссылки на нужный url.
@@ -11,3 +14,13 @@ def redirect_to_recipe(request, short_link):
     recipe = get_object_or_404(Recipe, short_link=short_link)
     # Перенаправляем на страницу рецепта
     return redirect(f'/recipes/{recipe.id}/')
+
+
+@throttle('short_link')
+async def redirect_to_recipe_async(request, short_link):
+    """
+    То же, что redirect_to_recipe, для ASGI-режима.
+    """
+
+    recipe = await run_query(get_object_or_404, Recipe, short_link=short_link)
+    return redirect(f'/recipes/{recipe.id}/')
@@ -2,6 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth import get_user_model
 
+from recipes.paginators import EstimatedCountPaginator
 from users.models import Subscription
 
 
@@ -18,20 +19,20 @@ class UserAdmin(UserAdmin):
         'email',
         'is_staff',
         'recipes_count',
-        'subscriptions_count'
+        'subscribers_count'
     )
+    # Точное совпадение без учёта регистра идёт по индексам
+    # на UPPER(email) и UPPER(username), в отличие от icontains
     search_fields = (
-        'email',
-        'username'
+        '=email',
+        '=username'
     )
-
-    @admin.display(description='Количество рецептов')
-    def recipes_count(self, obj):
-        return obj.recipes.count()
-
-    @admin.display(description='Количество подписчиков')
-    def subscriptions_count(self, obj):
-        return obj.subscriptions_to_author.count()
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
 
 
-admin.site.register(Subscription)
+@admin.register(Subscription)
+class SubscriptionAdmin(admin.ModelAdmin):
+    list_select_related = ('user', 'author')
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
@@ -0,0 +1,50 @@
+# Generated by Django 3.2.3 on 2026-10-19 09:38
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Subscription = apps.get_model('users', 'Subscription')
+
+    User.objects.update(
+        recipes_count=Coalesce(Subquery(
+            Recipe.objects.filter(
+                author=OuterRef('pk')
+            ).order_by().values('author').annotate(
+                count=Count('pk')
+            ).values('count')
+        ), 0),
+        subscribers_count=Coalesce(Subquery(
+            Subscription.objects.filter(
+                author=OuterRef('pk')
+            ).order_by().values('author').annotate(
+                count=Count('pk')
+            ).values('count')
+        ), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_alter_user_avatar'),
+        ('recipes', '0005_auto_20261019_1238'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество рецептов'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='subscribers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество подписчиков'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.3 on 2026-10-19 10:12
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_auto_20261019_1302'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscription',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Добавлено'),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['user', 'created_at'], name='subscription_user_idx'),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.core.exceptions import ValidationError
+from django.db.models.functions import Upper
 
 from api.constants import (
     MAX_FIRST_NAME_CHAR_LENGTH,
@@ -34,11 +35,25 @@ class User(AbstractUser):
         blank=True,
         null=True
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество рецептов'
+    )
+    subscribers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписчиков'
+    )
 
     class Meta:
         verbose_name = 'пользователь'
         verbose_name_plural = 'Пользователи'
         ordering = ('username',)
+        indexes = (
+            models.Index(Upper('email'), name='user_upper_email_idx'),
+            models.Index(Upper('username'), name='user_upper_username_idx'),
+        )
 
     def __str__(self):
         """Возвращает строковое представление пользователя."""
@@ -60,6 +75,10 @@ class Subscription(models.Model):
         related_name='subscriptions_to_author',
         verbose_name='Автор'
     )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Добавлено'
+    )
 
     class Meta:
         verbose_name = 'подписка'
@@ -70,6 +89,12 @@ class Subscription(models.Model):
                 name='unique_user_author'
             ),
         )
+        indexes = (
+            models.Index(
+                fields=('user', 'created_at'),
+                name='subscription_user_idx'
+            ),
+        )
 
     def clean(self):
         if self.user == self.author: